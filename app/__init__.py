@@ -1,12 +1,17 @@
 import os
 from flask import Flask
 from flask_login import LoginManager
-from flask_session import Session # 如果您有決定用 Server-Side Session
 from flask_wtf.csrf import CSRFProtect # <--- 【關鍵修正 1】引入套件
 from dotenv import load_dotenv
+from app.ldap_pool import ldap_pool
+from app.dc_locator import dc_locator
+from app.cache import directory_cache, authz_cache
+from app.ldap_metrics import ldap_metrics
+from app.fanout import fanout
+from app.session_store import init_session
 
-# 載入 .env 環境變數
-load_dotenv()
+# 載入 .env 環境變數 (整個行程只在這裡載入一次；已存在的環境變數不會被覆寫)
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env'))
 
 # 初始化 LoginManager
 login_manager = LoginManager()
@@ -30,15 +35,104 @@ def create_app():
     app.config['AD_BASEDN'] = os.getenv('AD_BASEDN')
     app.config['AD_DOMAIN'] = os.getenv('AD_DOMAIN')
 
+    # 多台 DC (AD_SERVER 以逗號分隔，或以 DNS SRV 探索)
+    app.config['AD_DC_SRV_DISCOVERY'] = os.getenv('AD_DC_SRV_DISCOVERY', 'false').lower() in ('1', 'true', 'yes')
+    app.config['AD_DC_SITE'] = os.getenv('AD_DC_SITE')  # 只探索此 AD 站台的 DC
+    app.config['AD_DC_SELECTION'] = os.getenv('AD_DC_SELECTION', 'latency').lower()  # latency / round_robin / first
+    app.config['AD_PDC'] = os.getenv('AD_PDC')  # 寫入優先的 DC，未設定時由 fSMORoleOwner 自動解析
+    app.config['LDAP_CONNECT_TIMEOUT'] = int(os.getenv('LDAP_CONNECT_TIMEOUT', 5))  # 單台 DC 的連線逾時秒數
+    app.config['LDAP_RECEIVE_TIMEOUT'] = int(os.getenv('LDAP_RECEIVE_TIMEOUT', 30))  # 等待 DC 回應的逾時秒數
+    app.config['DC_PROBE_INTERVAL'] = int(os.getenv('DC_PROBE_INTERVAL', 30))  # 背景量測延遲的間隔秒數，0 = 不量測
+    app.config['DC_DOWN_TIME'] = int(os.getenv('DC_DOWN_TIME', 60))  # 連不上的 DC 暫時排到最後的秒數
+
+    # LDAP 連線池設定
+    app.config['LDAP_POOL_MAX_SIZE'] = int(os.getenv('LDAP_POOL_MAX_SIZE', 5))  # 每個身分的最大連線數
+    app.config['LDAP_POOL_IDLE_TIMEOUT'] = int(os.getenv('LDAP_POOL_IDLE_TIMEOUT', 300))  # 閒置回收秒數
+    app.config['LDAP_POOL_ACQUIRE_TIMEOUT'] = int(os.getenv('LDAP_POOL_ACQUIRE_TIMEOUT', 10))  # 等待可用連線秒數
+    app.config['LDAP_POOL_HEALTH_CHECK_INTERVAL'] = int(os.getenv('LDAP_POOL_HEALTH_CHECK_INTERVAL', 60))
+
+    # 分頁搜尋設定
+    app.config['LDAP_PAGE_SIZE'] = int(os.getenv('LDAP_PAGE_SIZE', 500))  # 每頁筆數 (需 <= DC 的 MaxPageSize)
+    app.config['LDAP_MAX_RESULTS'] = int(os.getenv('LDAP_MAX_RESULTS', 0))  # 單次搜尋硬上限，0 = 不限制
+    app.config['DASHBOARD_PAGE_SIZE'] = int(os.getenv('DASHBOARD_PAGE_SIZE', 50))  # 儀表板每頁顯示筆數
+
+    # 目錄查詢快取 (TTL = 0 代表停用)
+    app.config['DIRECTORY_CACHE_TTL'] = int(os.getenv('DIRECTORY_CACHE_TTL', 30))
+    app.config['DIRECTORY_CACHE_MAX_ENTRIES'] = int(os.getenv('DIRECTORY_CACHE_MAX_ENTRIES', 512))
+
+    # 授權檢查快取
+    app.config['AUTHZ_CACHE_TTL'] = int(os.getenv('AUTHZ_CACHE_TTL', 60))  # Domain Admins 判定結果快取秒數
+    app.config['AUTHZ_CACHE_MAX_ENTRIES'] = int(os.getenv('AUTHZ_CACHE_MAX_ENTRIES', 1024))
+    app.config['AD_BIND_MODE'] = os.getenv('AD_BIND_MODE', 'user').lower()  # user = 以登入者身分連線 / service = 服務帳號共用連線池
+    app.config['AD_PROXY_AUTHZ'] = os.getenv('AD_PROXY_AUTHZ', 'false').lower() in ('1', 'true', 'yes')
+    app.config['AUTHZ_RECHECK_INTERVAL'] = int(os.getenv('AUTHZ_RECHECK_INTERVAL', 300))  # service 模式授權複查間隔秒數
+    app.config['ADMIN_GROUP_REFRESH'] = int(os.getenv('ADMIN_GROUP_REFRESH', 3600))  # Domain Admins 群組 DN 重新解析間隔
+
+    # 本機目錄鏡像 (以 uSNChanged 增量同步，啟用後列表直接讀鏡像)
+    app.config['DIRECTORY_MIRROR_ENABLED'] = os.getenv('DIRECTORY_MIRROR_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    app.config['DIRECTORY_SYNC_INTERVAL'] = int(os.getenv('DIRECTORY_SYNC_INTERVAL', 60))  # 輪詢秒數
+    app.config['DIRECTORY_SYNC_WRITE_WAIT'] = int(os.getenv('DIRECTORY_SYNC_WRITE_WAIT', 5))  # 寫入後等待同步的秒數
+    app.config['DIRECTORY_MIRROR_PATH'] = os.getenv('DIRECTORY_MIRROR_PATH',
+                                                    os.path.join(os.path.dirname(app.root_path), 'data', 'directory_mirror.json'))
+
+    # 批次匯入使用者
+    app.config['BULK_IMPORT_WORKERS'] = int(os.getenv('BULK_IMPORT_WORKERS', 4))  # 並行連線數 (工作線專用名額，不佔網頁請求的連線)
+    app.config['BULK_IMPORT_MAX_ROWS'] = int(os.getenv('BULK_IMPORT_MAX_ROWS', 5000))  # 單次匯入筆數上限
+
+    # 首次載入的並行查詢
+    app.config['DASHBOARD_FANOUT_WORKERS'] = int(os.getenv('DASHBOARD_FANOUT_WORKERS', 8))  # 並行查詢執行緒數 (整個行程共用)
+    app.config['DASHBOARD_QUERY_TIMEOUT'] = float(os.getenv('DASHBOARD_QUERY_TIMEOUT', 10))  # 單一區塊的逾時秒數
+
+    # LDAP 操作量測 (/metrics 與 Server-Timing 標頭)
+    app.config['LDAP_METRICS_ENABLED'] = os.getenv('LDAP_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    app.config['LDAP_SERVER_TIMING'] = os.getenv('LDAP_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+    app.config['LDAP_SLOW_OP_MS'] = int(os.getenv('LDAP_SLOW_OP_MS', 0))  # 超過此毫秒數的操作寫入 log，0 = 不記錄
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')  # 設定後 /metrics 需帶 Authorization: Bearer <token>
+    # 沒有設定 METRICS_TOKEN 時 /metrics 只接受本機連線；設為 true 才允許任何來源不帶 token 抓取
+    app.config['METRICS_ALLOW_REMOTE'] = os.getenv('METRICS_ALLOW_REMOTE', 'false').lower() in ('1', 'true', 'yes')
+
+    # DNS 反查索引
+    app.config['DNS_INDEX_REFRESH'] = int(os.getenv('DNS_INDEX_REFRESH', 30))  # 索引增量更新間隔秒數
+    app.config['DNS_SEARCH_LIMIT'] = int(os.getenv('DNS_SEARCH_LIMIT', 200))  # 單次搜尋最多回傳幾個節點
+
+    # DNS 區域清單 (DomainDnsZones / ForestDnsZones / System 並行查詢)
+    app.config['DNS_ZONE_CACHE_TTL'] = int(os.getenv('DNS_ZONE_CACHE_TTL', 3600))  # 區域清單快取秒數
+    app.config['DNS_ZONE_CHECK_INTERVAL'] = int(os.getenv('DNS_ZONE_CHECK_INTERVAL', 60))  # 以 uSNChanged 確認區域異動的間隔秒數
+
+    # 巢狀群組關係圖
+    app.config['GROUP_GRAPH_REFRESH'] = int(os.getenv('GROUP_GRAPH_REFRESH', 60))  # 增量更新間隔秒數
+    app.config['GROUP_GRAPH_FULL_REFRESH'] = int(os.getenv('GROUP_GRAPH_FULL_REFRESH', 3600))  # 完整重新載入間隔秒數
+
+    # 背景工作 (批次匯入等長時間操作)
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))  # 同時執行的工作數
+    app.config['JOB_PER_DC_LIMIT'] = int(os.getenv('JOB_PER_DC_LIMIT', 1))  # 同一台 DC 同時執行的工作數
+    app.config['JOB_RETENTION'] = int(os.getenv('JOB_RETENTION', 86400))  # 已結束工作的保留秒數
+    app.config['JOB_STATE_DIR'] = os.getenv('JOB_STATE_DIR', os.path.join(os.path.dirname(app.root_path), 'data', 'jobs'))
+
+    # 清理報表
+    app.config['REPORT_STALE_DAYS'] = int(os.getenv('REPORT_STALE_DAYS', 90))  # 「久未登入」預設天數
+    app.config['REPORT_CACHE_TTL'] = int(os.getenv('REPORT_CACHE_TTL', 300))  # 報表結果快取秒數
+
     # Session 安全設定 (建議)
     app.config['SESSION_COOKIE_HTTPONLY'] = True
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
-    app.config['SESSION_TYPE'] = 'filesystem' # 如果有裝 Flask-Session 再開這行
-    Session(app) # 如果有裝 Flask-Session 再開這行
+    # Server-side Session 後端 (memory / redis / filesystem)
+    app.config['SESSION_BACKEND'] = os.getenv('SESSION_BACKEND', 'memory').lower()
+    app.config['SESSION_LIFETIME'] = int(os.getenv('SESSION_LIFETIME', 28800))  # Session 有效秒數
+    app.config['SESSION_MAX_ENTRIES'] = int(os.getenv('SESSION_MAX_ENTRIES', 10000))  # memory 後端最多保留幾個 Session
+    app.config['SESSION_MAX_BYTES'] = int(os.getenv('SESSION_MAX_BYTES', 16384))  # 單一 Session 序列化後的上限 (memory / redis)，0 = 不限制
+    app.config['SESSION_REDIS_URL'] = os.getenv('SESSION_REDIS_URL')  # 例如 redis://localhost:6379/0；memory:// = 行程內替身
+    init_session(app)
 
     # 初始化套件
     login_manager.init_app(app)
     csrf.init_app(app) # <--- 這裡現在不會報錯了，因為上面有定義 csrf
+    dc_locator.init_app(app)
+    ldap_pool.init_app(app)
+    directory_cache.init_app(app)
+    authz_cache.init_app(app, prefix='AUTHZ_CACHE')
+    ldap_metrics.init_app(app)
+    fanout.init_app(app)
 
     # --- 註冊 Blueprints ---
     from app.routes_dashboard import bp as dashboard_bp
@@ -53,6 +147,20 @@ def create_app():
     except ImportError:
         pass
 
+    # 本機目錄鏡像 (需在 ad_ops 載入後才能匯入)
+    from app.dir_sync import directory_mirror
+    directory_mirror.init_app(app)
+    from app.dns_index import dns_index
+    dns_index.init_app(app)
+    from app.group_graph import group_graph
+    group_graph.init_app(app)
+    from app.jobs import job_queue
+    job_queue.init_app(app)
+
+    # CLI 指令 (flask import-users ...)
+    from app.cli import register_cli
+    register_cli(app)
+
     # --- User Loader ---
     from app.routes_auth import User
     @login_manager.user_loader
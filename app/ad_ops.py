@@ -1,31 +1,46 @@
 # app/ad_ops.py
 import struct
-import socket
-from ldap3 import Server, Connection, ALL, SUBTREE, MODIFY_REPLACE, NONE
-from flask import current_app
-import ssl
+import heapq
+import time
+from ldap3 import BASE, LEVEL, SUBTREE
 import sys
 from ldap3.utils.conv import escape_filter_chars
-from flask import current_app, session # <--- 引入 session
-from ldap3.utils.conv import escape_filter_chars
+from flask import current_app, session, has_request_context, g # <--- 引入 session
+from app.ldap_pool import ldap_pool
+from app.dc_locator import dc_locator
+from app.cache import directory_cache, authz_cache
+from app.dns_codec import decode_records, encode_record, DnsCodecError
+from app.ldap_controls import (sort_control, vlv_control, decode_vlv_response, get_supported_controls, SORT_REQUEST_OID,
+                               VLV_REQUEST_OID, proxied_authorization_control)
 
 def log(msg):
     # 寫入 stderr 而不是 stdout，確保 Docker logs 看得到
     sys.stderr.write(f"[DEBUG_DNS] {msg}\n")
     sys.stderr.flush()
 
-def get_ad_connection():
+def _service_mode():
+    """AD_BIND_MODE=service：所有流量走 AD_USER 服務帳號的共用連線池，授權只在登入時檢查"""
+    return current_app.config.get('AD_BIND_MODE', 'user') == 'service'
+
+def _get_bind_credentials():
     """
-    建立 AD 連線
-    策略：優先使用 Session 中的「當前登入者」身分，失敗則回退到 .env 設定(可選)
+    決定連線身分
+    - user 模式 (預設)：優先使用 Session 中的「當前登入者」身分，失敗則回退到 .env 設定
+    - service 模式：一律使用 .env 的服務帳號 (Session 中不保存密碼)
+    - 背景工作：使用提交工作時記下的身分 (g._ldap_identity)
     """
+    identity = g.get('_ldap_identity')
+    if identity:
+        return identity
+
     # 1. 預設先抓 .env 的 (作為 fallback)
     server_addr = current_app.config.get('AD_SERVER')
     bind_user = current_app.config.get('AD_USER')
     bind_pass = current_app.config.get('AD_PASS')
     
-    # 2. 【關鍵修改】檢查 Session 是否有登入者憑證
-    if 'ad_user_account' in session and 'ad_user_password' in session:
+    # 2. 【關鍵修改】檢查 Session 是否有登入者憑證 (CLI / 背景工作沒有 Session，直接用 .env)
+    if (not _service_mode() and has_request_context()
+            and 'ad_user_account' in session and 'ad_user_password' in session):
         current_user = session['ad_user_account']
         current_pass = session['ad_user_password']
         
@@ -38,18 +53,75 @@ def get_ad_connection():
             
         bind_pass = current_pass
         # log(f"使用當前登入者身分連線: {bind_user}") # Debug 用
-    
-    # SSL Context (保持不變)
-    tls_ctx = ssl.create_default_context()
-    tls_ctx.check_hostname = False
-    tls_ctx.verify_mode = ssl.CERT_NONE
 
-    server = Server(server_addr, use_ssl=True, tls=None, get_info=NONE)
-    
-    # 使用決定好的 bind_user/bind_pass 進行連線
-    conn = Connection(server, user=bind_user, password=bind_pass, authentication='SIMPLE', auto_bind=True)
+    return server_addr, bind_user, bind_pass
+
+def _authz_controls():
+    """
+    service 模式且 AD_PROXY_AUTHZ=true 時，每個操作附上 Proxied Authorization (u:登入者)
+    讓 DC 以登入者的權限判斷 ACL；AD DS 不支援此控制項 (critical，會被拒絕)，只適用於支援 RFC 4370 的目錄
+    """
+    if not (_service_mode() and current_app.config.get('AD_PROXY_AUTHZ')):
+        return ()
+    if g.get('_ldap_identity'):
+        return g.get('_ldap_authz_controls') or ()
+    if not has_request_context() or 'ad_user_account' not in session:
+        return ()
+    return (proxied_authorization_control(f"u:{session['ad_user_account']}"),)
+
+def get_ad_connection(write=False):
+    """
+    建立 AD 連線
+    多台 DC 時讀取走最近的 DC，write=True 走寫入用的 DC (PDC 優先)；
+    同一個請求寫入之後的讀取也留在寫入的 DC，不會因為複寫延遲讀到舊資料
+    """
+    server_addr, bind_user, bind_pass = _get_bind_credentials()
+    if write:
+        g._ldap_wrote = True
+    route = 'write' if g.get('_ldap_wrote') else 'read'
+    # 從連線池借出連線：同一個請求內共用，請求結束自動歸還 (不再每次重新 TLS 握手 + bind)
+    conn = ldap_pool.connection_for_request(server_addr, bind_user, bind_pass, route=route)
+    conn.extra_controls = _authz_controls()
     return conn
 
+# --- 查詢快取 ---
+
+def _cache_key(*parts):
+    """快取 key = 綁定身分 + base DN + 查詢內容 (不同身分看到的結果可能不同)"""
+    _, bind_user, _ = _get_bind_credentials()
+    identity = (bind_user or '').lower()
+    controls = _authz_controls()
+    if controls:
+        # 代理授權時結果依登入者的 ACL 而定，不能與其他使用者共用
+        identity += '|' + controls[0][2].decode('utf-8').lower()
+    return (identity, current_app.config.get('AD_BASEDN')) + parts
+
+def _dns_records_tag(zone_dn):
+    return f"dns_records:{zone_dn.lower()}"
+
+def _invalidate(*tags):
+    """
+    讓快取失效；DNS 區域的標籤同時把該區域的反查索引標成過期，
+    群組 / 成員異動則把群組關係圖標成過期 (都在下次查詢前增量更新)
+    """
+    directory_cache.invalidate(*tags)
+    from app.dns_index import dns_index
+    dns_index.mark_stale(*[tag.split(':', 1)[1] for tag in tags if tag.startswith('dns_records:')])
+    if 'groups' in tags or 'group_members' in tags:
+        from app.group_graph import group_graph
+        group_graph.mark_stale()
+
+def _after_write(*tags):
+    """寫入成功後：讓相關快取失效；啟用本機鏡像時請它立即做一次增量同步"""
+    _invalidate(*tags)
+    from app.dir_sync import directory_mirror
+    directory_mirror.request_sync(wait=current_app.config.get('DIRECTORY_SYNC_WRITE_WAIT', 5))
+
+def _directory_mirror():
+    """本機鏡像已啟用且同步完成時回傳鏡像，否則回傳 None (直接查 DC)"""
+    from app.dir_sync import directory_mirror
+    return directory_mirror if directory_mirror.ready else None
+
 def _get_domain_suffix(dn):
     config_domain = current_app.config.get('AD_DOMAIN')
     if config_domain:
@@ -60,178 +132,457 @@ def _get_domain_suffix(dn):
         return "local" 
     return '.'.join(dc_parts)
 
-# --- 核心搜尋功能 ---
+def _get_domain_root():
+    """從 AD_BASEDN 取出網域根目錄 (DC=... 的部分)"""
+    base_dn = current_app.config.get('AD_BASEDN')
+    if 'dc=' in base_dn.lower():
+        return base_dn[base_dn.lower().find('dc='):]
+    return base_dn
+
+# --- 查詢規劃：每種查詢只要求實際用到的屬性 ---
+
+NO_ATTRIBUTES = ['1.1']  # RFC 4511：只要 DN (entry_dn 本來就會回傳)，不帶任何屬性
+MEMBER_LOOKUP_BATCH_SIZE = 100  # OR filter 每批最多幾個 DN / 名稱
+
+# 名稱 -> DN 解析：(物件 filter, 名稱屬性)
+NAME_LOOKUPS = {
+    'user': ('(objectClass=user)(!(objectClass=computer))', 'sAMAccountName'),
+    'group': ('(objectClass=group)', 'cn'),
+}
 
 def find_dn_by_name(conn, name, type='user'):
+    """
+    單一名稱 -> DN；只取 DN (NO_ATTRIBUTES)，size_limit=2 足以判斷是否有重名
+    重名時 (例如不同 OU 的同名群組) 沿用第一筆並記錄
+    """
+    if type not in NAME_LOOKUPS or not name:
+        return None
+    object_filter, attribute = NAME_LOOKUPS[type]
     base_dn = current_app.config.get('AD_BASEDN')
-    if type == 'user':
-        search_filter = f'(&(objectClass=user)(sAMAccountName={name})(!(objectClass=computer)))'
-    elif type == 'group':
-        search_filter = f'(&(objectClass=group)(cn={name}))'
-    else:
+    conn.search(base_dn, f'(&{object_filter}({attribute}={escape_filter_chars(name)}))',
+                attributes=NO_ATTRIBUTES, size_limit=2)
+    if not conn.entries:
         return None
-    conn.search(base_dn, search_filter, attributes=['distinguishedName'])
-    if conn.entries:
-        return conn.entries[0].distinguishedName.value
-    return None
+    if len(conn.entries) > 1:
+        log(f"名稱 {name} 對應到多個{type}物件，使用 {conn.entries[0].entry_dn}")
+    return conn.entries[0].entry_dn
+
+def resolve_names(conn, wanted):
+    """
+    一次解析多種類型的名稱：wanted = {'user': [...], 'group': [...]}
+    所有類型合併成同一個 OR filter (每 MEMBER_LOOKUP_BATCH_SIZE 個名稱一批)，只取名稱屬性與 objectClass
+    回傳 {類型: {小寫名稱: DN}}，找不到的名稱不會出現在結果中
+    """
+    pending = [(type, name) for type, names in wanted.items() if type in NAME_LOOKUPS
+               for name in dict.fromkeys(n for n in names if n)]
+    found = {type: {} for type in wanted}
+    if not pending:
+        return found
+    attributes = sorted({NAME_LOOKUPS[type][1] for type, _ in pending} | {'objectClass'})
+    base_dn = current_app.config.get('AD_BASEDN')
+    for i in range(0, len(pending), MEMBER_LOOKUP_BATCH_SIZE):
+        batch = pending[i:i + MEMBER_LOOKUP_BATCH_SIZE]
+        clauses = []
+        for type in dict.fromkeys(t for t, _ in batch):
+            object_filter, attribute = NAME_LOOKUPS[type]
+            terms = ''.join(f'({attribute}={escape_filter_chars(name)})' for t, name in batch if t == type)
+            clauses.append(f'(&{object_filter}(|{terms}))')
+        search_filter = clauses[0] if len(clauses) == 1 else f"(|{''.join(clauses)})"
+        for entry in paged_search(conn, base_dn, search_filter, attributes=attributes):
+            classes = {str(c).lower() for c in entry.objectClass.values} if 'objectClass' in entry else set()
+            type = 'group' if 'group' in classes else 'user'
+            if type not in found or 'computer' in classes:
+                continue
+            value = entry[NAME_LOOKUPS[type][1]].value if NAME_LOOKUPS[type][1] in entry else None
+            if value:
+                found[type].setdefault(str(value).lower(), entry.entry_dn)
+    return found
+
+def find_dns_by_names(conn, names, type='user'):
+    """
+    批次版 find_dn_by_name：每 MEMBER_LOOKUP_BATCH_SIZE 個名稱合併成一個 OR filter 查詢
+    回傳 {小寫名稱: DN}，找不到的名稱不會出現在結果中
+    """
+    if type not in NAME_LOOKUPS:
+        return {}
+    return resolve_names(conn, {type: names})[type]
+
+PAGED_RESULTS_OID = '1.2.840.113556.1.4.319'
+
+def paged_search(conn, search_base, search_filter, attributes=None, search_scope=SUBTREE, page_size=None, max_results=None,
+                 controls=None):
+    """
+    分頁搜尋 (RFC 2696 Simple Paged Results)，逐筆 yield Entry
+    - 不會被 DC 的 MaxPageSize (預設 1000) 截斷
+    - 記憶體中同時只保留一頁的 Entry
+    - 超過 max_results (硬上限) 即停止，並通知 DC 放棄剩餘頁面
+    - controls 會附加在每一頁的請求上 (例如 Show Deleted)
+    - 讀完後 conn.result 是最後一頁的結果，DC 仍截斷時 result 為 sizeLimitExceeded
+    """
+    if page_size is None:
+        page_size = current_app.config.get('LDAP_PAGE_SIZE', 500)
+    if max_results is None:
+        max_results = current_app.config.get('LDAP_MAX_RESULTS', 0)
+    return _paged_search_iter(conn, search_base, search_filter, attributes, search_scope, page_size, max_results,
+                              controls)
+
+def _paged_search_iter(conn, search_base, search_filter, attributes, search_scope, page_size, max_results,
+                       controls=None):
+    cookie = None
+    count = 0
+    try:
+        while True:
+            conn.search(search_base, search_filter, search_scope=search_scope, attributes=attributes,
+                        paged_size=page_size, paged_cookie=cookie, controls=controls)
+            # 先取出本頁結果與 cookie，yield 之後呼叫端可能會用同一條連線做其他查詢
+            entries = conn.entries
+            response_controls = (conn.result or {}).get('controls') or {}
+            cookie = response_controls.get(PAGED_RESULTS_OID, {}).get('value', {}).get('cookie')
+            for entry in entries:
+                if max_results and count >= max_results:
+                    log(f"分頁搜尋達到上限 {max_results} 筆，停止讀取: {search_base} {search_filter}")
+                    return
+                count += 1
+                yield entry
+            if not cookie:
+                return
+    finally:
+        if cookie:
+            # 提前結束 (達上限或呼叫端不再讀取)：送出 size=0 讓 DC 釋放分頁狀態
+            try:
+                conn.search(search_base, search_filter, search_scope=search_scope, attributes=['1.1'],
+                            paged_size=0, paged_cookie=cookie, controls=controls)
+            except Exception:
+                pass
+
+# --- 儀表板列表 (分頁 / 排序 / 篩選) ---
+
+# 各列表的查詢定義：base filter、回傳屬性、可排序與可搜尋的欄位 (第一個可排序欄位為預設排序)
+DIRECTORY_LISTINGS = {
+    'users': {
+        'filter': '(&(objectClass=user)(!(objectClass=computer)))',
+        'attributes': ['sAMAccountName', 'displayName', 'userPrincipalName', 'userAccountControl'],
+        'sortable': ['sAMAccountName', 'displayName', 'userPrincipalName'],
+        'searchable': ['sAMAccountName', 'displayName', 'userPrincipalName'],
+    },
+    'groups': {
+        'filter': '(objectClass=group)',
+        'attributes': ['cn', 'description'],
+        'sortable': ['cn'],
+        'searchable': ['cn', 'description'],
+    },
+    'computers': {
+        'filter': '(objectClass=computer)',
+        'attributes': ['cn', 'operatingSystem'],
+        'sortable': ['cn', 'operatingSystem'],
+        'searchable': ['cn', 'operatingSystem'],
+    },
+}
+
+def _listing_filter(listing, q):
+    """把文字搜尋推到 LDAP filter (前綴比對，可用到 AD 索引)"""
+    if not q:
+        return listing['filter']
+    safe_q = escape_filter_chars(q.strip())
+    terms = ''.join(f'({attr}={safe_q}*)' for attr in listing['searchable'])
+    return f"(&{listing['filter']}(|{terms}))"
+
+def _entry_to_row(entry, attributes):
+    row = {'dn': entry.entry_dn}
+    for attr in attributes:
+        row[attr] = entry[attr].value if attr in entry else None
+    return row
+
+def _vlv_page(conn, base_dn, search_filter, attributes, sort, desc, page, per_page):
+    """以 Server-Side Sort + VLV 讓 DC 只回傳指定頁面；DC 拒絕時回傳 None"""
+    offset = (page - 1) * per_page + 1
+    controls = [
+        sort_control([(sort, desc)]),
+        vlv_control(offset, before_count=0, after_count=per_page - 1),
+    ]
+    try:
+        conn.search(base_dn, search_filter, attributes=attributes, controls=controls)
+    except Exception as e:
+        log(f"VLV 查詢失敗，改用分頁搜尋: {e}")
+        return None
+    vlv = decode_vlv_response(conn.result)
+    if conn.result.get('result') != 0 or vlv is None or vlv['result'] != 0:
+        log(f"VLV 查詢未成功 ({conn.result.get('description')})，改用分頁搜尋")
+        return None
+    total = vlv['content_count']
+    # 超出範圍時 DC 會回傳最後幾筆，這裡直接視為空頁
+    entries = conn.entries if offset <= total else []
+    return [_entry_to_row(e, attributes) for e in entries], total
+
+def _fallback_page(conn, base_dn, search_filter, attributes, sort, desc, page, per_page):
+    """DC 不支援 VLV 時：分頁搜尋 + 行程內排序，只保留前 page * per_page 筆"""
+    counter = {'total': 0}
+
+    def rows():
+        for entry in paged_search(conn, base_dn, search_filter, attributes=attributes):
+            counter['total'] += 1
+            yield _entry_to_row(entry, attributes)
+
+    def sort_key(row):
+        value = row.get(sort)
+        return (str(value).lower() if value is not None else '', row['dn'].lower())
+
+    pick = heapq.nlargest if desc else heapq.nsmallest
+    top = pick(page * per_page, rows(), key=sort_key)
+    return top[(page - 1) * per_page:], counter['total']
+
+def query_directory_page(kind, page=1, per_page=None, sort=None, desc=False, q=None):
+    """
+    取得使用者 / 群組 / 電腦列表的一頁
+    - 文字搜尋推到 LDAP filter
+    - DC 支援時使用 Server-Side Sort + VLV，只傳回該頁資料
+    - 否則退回分頁搜尋 + 行程內排序
+    - 結果放入快取，寫入操作時依 kind 失效
+    """
+    listing = DIRECTORY_LISTINGS[kind]
+    per_page = min(max(int(per_page or current_app.config.get('DASHBOARD_PAGE_SIZE', 50)), 1), 500)
+    page = max(int(page or 1), 1)
+    if sort not in listing['sortable']:
+        sort = listing['sortable'][0]
+    q = (q or '').strip()
+
+    mirror = _directory_mirror()
+    if mirror:
+        return mirror.query_page(kind, page, per_page, sort, desc, q, listing['searchable'])
+
+    key = _cache_key('page', kind, page, per_page, sort, bool(desc), q.lower())
+    return directory_cache.get_or_load(
+        key, lambda: _query_directory_page(kind, page, per_page, sort, desc, q), tags=(kind,))
+
+def _query_directory_page(kind, page, per_page, sort, desc, q):
+    listing = DIRECTORY_LISTINGS[kind]
+    conn = get_ad_connection()
+    base_dn = current_app.config.get('AD_BASEDN')
+    search_filter = _listing_filter(listing, q)
+    attributes = listing['attributes']
+
+    result = None
+    mode = 'vlv'
+    supported = get_supported_controls(conn)
+    if SORT_REQUEST_OID in supported and VLV_REQUEST_OID in supported:
+        result = _vlv_page(conn, base_dn, search_filter, attributes, sort, desc, page, per_page)
+    if result is None:
+        mode = 'paged'
+        result = _fallback_page(conn, base_dn, search_filter, attributes, sort, desc, page, per_page)
+
+    items, total = result
+    return {
+        'items': items,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': max((total + per_page - 1) // per_page, 1),
+        'sort': sort,
+        'desc': desc,
+        'q': q,
+        'mode': mode,
+    }
 
 # --- DNS 管理功能 ---
 
+# 三個存放 AD 整合 DNS 區域的位置：(名稱, 所在網域 / 樹系)
+DNS_ZONE_CONTAINERS = (
+    ('DomainDnsZones', 'CN=MicrosoftDNS,DC=DomainDnsZones,{domain}'),
+    ('ForestDnsZones', 'CN=MicrosoftDNS,DC=ForestDnsZones,{forest}'),
+    ('System', 'CN=MicrosoftDNS,CN=System,{domain}'),  # Windows 2000 相容的舊位置
+)
+DNS_ZONE_ATTRIBUTES = ['dc', 'uSNChanged']
+REVERSE_ZONE_SUFFIXES = ('.in-addr.arpa', '.ip6.arpa')
+LDAP_NO_SUCH_OBJECT = 32
+
 def get_dns_zones():
-    """取得 DNS 區域 (過濾版)"""
+    """
+    取得所有 AD 整合 DNS 區域 (正向與反向)，回傳 [{'name', 'dn', 'partition', 'reverse'}]
+    - 三個位置並行查詢 (各借一條連線)，單層搜尋，只取 dc 與 uSNChanged
+    - 結果快取 DNS_ZONE_CACHE_TTL 秒；每 DNS_ZONE_CHECK_INTERVAL 秒以 uSNChanged 確認
+      有沒有區域新增或異動 (只取 DN、最多一筆)，沒有就繼續用快取
+    - 直接刪除區域物件 (不經過 DNS 管理工具改名為 ..Deleted-) 不會改變 uSNChanged，要等快取到期
+    """
+    key = _cache_key('dns_zones')
+    cached = directory_cache.get(key)
+    now = time.monotonic()
+    if cached is not None:
+        if now - cached['checked'] < current_app.config.get('DNS_ZONE_CHECK_INTERVAL', 60):
+            return cached['zones']
+        if not _dns_zones_changed(cached):
+            cached['checked'] = now
+            return cached['zones']
+        log("DNS 區域有異動，重新讀取區域清單")
+    result = _get_dns_zones()
+    directory_cache.set(key, result, tags=('dns_zones',), ttl=current_app.config.get('DNS_ZONE_CACHE_TTL', 3600))
+    return result['zones']
+
+def read_forest_root(conn):
+    """讀 rootDSE 的 rootDomainNamingContext (樹系根網域)，讀不到時回傳 None (不需要 app context)"""
+    try:
+        if conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['rootDomainNamingContext']) \
+                and conn.entries and 'rootDomainNamingContext' in conn.entries[0]:
+            return conn.entries[0].rootDomainNamingContext.value or None
+    except Exception as e:
+        log(f"無法讀取 rootDomainNamingContext，ForestDnsZones 以目前網域為準: {e}")
+    return None
+
+def _forest_root(conn):
+    """樹系根網域；讀不到時視為與目前網域相同"""
+    key = _cache_key('forest_root')
+    forest = directory_cache.get(key)
+    if forest is None:
+        forest = read_forest_root(conn) or _get_domain_root()
+        directory_cache.set(key, forest, ttl=current_app.config.get('DNS_ZONE_CACHE_TTL', 3600))
+    return forest
+
+def _dns_zone_bases(conn):
+    domain = _get_domain_root()
+    forest = _forest_root(conn)
+    return [(partition, template.format(domain=domain, forest=forest)) for partition, template in DNS_ZONE_CONTAINERS]
+
+def _search_zone_container(base, search_filter, attributes, size_limit=0):
+    """在一個區域容器下單層搜尋；容器不存在 (例如沒有 ForestDnsZones 分割區) 視為沒有區域"""
     conn = get_ad_connection()
-    base_dn = current_app.config.get('AD_BASEDN')
-    target_domain = _get_domain_suffix(base_dn)
-    
-    if 'dc=' in base_dn.lower():
-        domain_root = base_dn.lower()[base_dn.lower().find('dc='):]
+    conn.search(base, search_filter, search_scope=LEVEL, attributes=attributes, size_limit=size_limit)
+    code = conn.result.get('result')
+    if code == LDAP_NO_SUCH_OBJECT:
+        return [], dc_locator.host_of(conn)
+    if code not in (0, 4):  # 4 = sizeLimitExceeded (只要一筆時正常)
+        raise RuntimeError(f"{conn.result.get('description')} ({base})")
+    return list(conn.entries), dc_locator.host_of(conn)
+
+def _run_zone_searches(bases, filters, attributes, size_limit=0):
+    """
+    各容器並行查詢 (filters = {分割區: filter})，回傳 ({分割區: (entries, DC)}, {分割區: 錯誤})
+    已經在 fanout 工作執行緒上 (例如 /api/batch 的 zones 區塊) 時改為依序查詢，不巢狀使用同一個執行緒池
+    """
+    from app.fanout import fanout
+    calls = {partition: (lambda base=base, search_filter=filters[partition]:
+                         _search_zone_container(base, search_filter, attributes, size_limit))
+             for partition, base in bases}
+    if fanout.in_worker():
+        results, errors = {}, {}
+        for partition, call in calls.items():
+            try:
+                results[partition] = call()
+            except Exception as e:
+                errors[partition] = str(e)
     else:
-        return []
+        results, errors, _ = fanout.run(calls)
+    for partition, message in errors.items():
+        log(f"查詢 DNS 區域失敗 ({partition}): {message}")
+    return results, errors
 
-    search_paths = [
-        f"DC=DomainDnsZones,{domain_root}", 
-        f"CN=MicrosoftDNS,DC=DomainDnsZones,{domain_root}",
-        f"CN=MicrosoftDNS,CN=System,{domain_root}"
-    ]
-    
-    found_zones = []
-    found_names = set()
+def _is_hidden_zone(name):
+    # RootDNSServers 是根提示；..TrustAnchors、..Deleted-、..InProgress- 是 DNS 伺服器內部使用的物件
+    return name.startswith('..') or name.lower() == 'rootdnsservers'
 
-    for path in search_paths:
-        try:
-            conn.search(path, '(objectClass=dnsZone)', attributes=['dc', 'distinguishedName'])
-            for entry in conn.entries:
-                zone_name = str(entry.dc)
-                if zone_name.lower() == target_domain.lower() and zone_name not in found_names:
-                    found_zones.append(entry)
-                    found_names.add(zone_name)
-        except Exception:
+def _get_dns_zones():
+    bases = _dns_zone_bases(get_ad_connection())
+    results, errors = _run_zone_searches(bases, {partition: '(objectClass=dnsZone)' for partition, _ in bases},
+                                         DNS_ZONE_ATTRIBUTES)
+    if errors and not results:
+        raise RuntimeError('；'.join(f"{partition}: {message}" for partition, message in errors.items()))
+
+    zones, seen, watermarks = [], set(), {}
+    for partition, _ in bases:
+        if partition not in results:
             continue
-    return found_zones
+        entries, host = results[partition]
+        usn = 0
+        for entry in entries:
+            usn = max(usn, int(entry.uSNChanged.value or 0) if 'uSNChanged' in entry else 0)
+            name = str(entry.dc.value) if 'dc' in entry else ''
+            if not name or _is_hidden_zone(name) or name.lower() in seen:
+                continue
+            seen.add(name.lower())
+            zones.append({'name': name, 'dn': entry.entry_dn, 'partition': partition,
+                          'reverse': name.lower().endswith(REVERSE_ZONE_SUFFIXES)})
+        watermarks[partition] = (usn, host)
+
+    # 網域本身的正向區域排第一，其次其他正向區域，反向區域最後
+    domain = _get_domain_suffix(current_app.config.get('AD_BASEDN')).lower()
+    zones.sort(key=lambda z: (z['reverse'], z['name'].lower() != domain, z['name'].lower()))
+    # 查詢失敗的容器不留水位，下次檢查時一定視為有異動而重新讀取
+    return {'zones': zones, 'watermarks': watermarks, 'bases': bases, 'checked': time.monotonic()}
+
+def _dns_zones_changed(cached):
+    """各容器是否出現 uSNChanged 大於上次讀取時的區域 (uSNChanged 是每台 DC 各自的計數器，換了 DC 一律視為異動)"""
+    watermarks = cached['watermarks']
+    if len(watermarks) < len(cached['bases']):
+        return True
+    filters = {partition: f"(&(objectClass=dnsZone)(uSNChanged>={usn + 1}))"
+               for partition, (usn, _) in watermarks.items()}
+    results, errors = _run_zone_searches(cached['bases'], filters, NO_ATTRIBUTES, size_limit=1)
+    if errors:
+        return True
+    return any(entries or host != watermarks[partition][1] for partition, (entries, host) in results.items())
 
 def get_dns_records(zone_dn):
     """取得指定區域內的 DNS 紀錄 (過濾掉系統紀錄與底線開頭的 SRV 紀錄)"""
+    return directory_cache.get_or_load(
+        _cache_key('dns_records', zone_dn.lower()), lambda: _get_dns_records(zone_dn), tags=(_dns_records_tag(zone_dn),))
+
+def _get_dns_records(zone_dn):
+    mirror = _directory_mirror()
+    if mirror:
+        records = []
+        for node in mirror.dns_nodes_in_zone(zone_dn):
+            record = _summarize_dns_node(node['name'], node['dn'], node['dnsRecord'])
+            if record:
+                records.append(record)
+        return sorted(records, key=lambda x: x['name'])
+
     conn = get_ad_connection()
     
-    # 搜尋條件：排除 tombstone (已刪除) 的紀錄
-    search_filter = '(&(objectClass=dnsNode)(!(dNSTombstoned=TRUE)))'
-    
-    conn.search(zone_dn, search_filter, attributes=['name', 'dnsRecord', 'distinguishedName'])
-    
+    # 搜尋條件：排除 tombstone (已刪除) 的紀錄，系統節點也在 DC 端排除，不必傳回它們的 dnsRecord
     records = []
-    # 定義要隱藏的系統保留名稱 (小寫比對)
-    hidden_names = ['@', 'domaindnszones', 'forestdnszones']
-
-    for entry in conn.entries:
-        # 取得名稱並去除空白
-        name = str(entry.name).strip()
-        name_lower = name.lower()
-
-        # ---【過濾邏輯開始】---
-        
-        # 1. 過濾系統保留字 (@, DomainDnsZones...)
-        if name_lower in hidden_names:
-            continue
-            
-        # 2. 過濾 AD 系統紀錄 (所有以 _ 開頭的，如 _msdcs, _ldap, _kerberos)
-        # 這些是 SRV 紀錄，管理者通常不需要動它們
-        if name.startswith('_'):
-            continue
-            
-        # ---【過濾邏輯結束】---
-
-        rec_type = "Unknown"
-        if entry.dnsRecord:
-            try:
-                raw_data = entry.dnsRecord.values[0] if isinstance(entry.dnsRecord.values, list) else entry.dnsRecord.value
-                
-                # 確保長度足夠解析 Type
-                if len(raw_data) > 2:
-                    type_id = raw_data[2]
-                    if type_id == 1: 
-                        rec_type = "A (Host)"
-                    elif type_id == 5: 
-                        rec_type = "CNAME (Alias)"
-            except:
-                pass
-        
-        # 只顯示我們認得的紀錄 (A 和 CNAME)，如果要顯示 Unknown 但非系統紀錄，就把這行 if 拿掉
-        # 建議保留這行，這樣介面最乾淨，只會看到您手動建的資料
-        if rec_type == "Unknown":
-            continue
-
-        records.append({
-            'name': name,
-            'type': rec_type,
-            'dn': str(entry.distinguishedName)
-        })
+    for entry in paged_search(conn, zone_dn, DNS_LISTING_FILTER, attributes=['name', 'dnsRecord']):
+        values = entry.dnsRecord.raw_values if 'dnsRecord' in entry else []
+        record = _summarize_dns_node(str(entry.name), entry.entry_dn, values)
+        if record:
+            records.append(record)
         
     return sorted(records, key=lambda x: x['name'])
 
-# --- DNS 封包與寫入 ---
+# 定義要隱藏的系統保留名稱 (小寫比對)
+HIDDEN_DNS_NAMES = ['@', 'domaindnszones', 'forestdnszones']
+# 列表的 LDAP filter：與 _summarize_dns_node 的過濾規則相同 (底線開頭的 SRV 節點通常是最多也最大的一群)
+DNS_LISTING_FILTER = ('(&(objectClass=dnsNode)(!(dNSTombstoned=TRUE))(!(name=_*))'
+                      + ''.join(f'(!(name={name}))' for name in HIDDEN_DNS_NAMES) + ')')
 
-def _encode_dns_name(name):
-    """CNAME 編碼"""
-    # 【修正 2】: 加入 .strip() 清除前後空白，避免 Bad Parameter
-    parts = name.strip().strip('.').split('.')
-    encoded = b''
-    for part in parts:
-        if part: # 避免空字串
-            encoded += struct.pack('B', len(part)) + part.encode('ascii')
-    encoded += b'\x00'
-    return encoded
+def _summarize_dns_node(name, dn, values):
+    """把一個 dnsNode 轉成列表用的紀錄 (解碼節點上所有 dnsRecord 值)，系統紀錄回傳 None"""
+    # 取得名稱並去除空白
+    name = name.strip()
+    name_lower = name.lower()
 
-def _create_dns_record_bytes(record_type, data_content, ttl=3600):
-    """
-    建立 DNS 二進位封包 (CNAME 修正版)
-    修正: CNAME 必須包含 2 bytes 前綴 [總長度][標籤數量]
-    """
-    try:
-        data_bytes = b''
+    # ---【過濾邏輯開始】---
+    
+    # 1. 過濾系統保留字 (@, DomainDnsZones...)
+    if name_lower in HIDDEN_DNS_NAMES:
+        return None
         
-        if record_type == 1: # A Record
-            data_bytes = socket.inet_aton(data_content)
-            
-        elif record_type == 5: # CNAME Record
-            # 1. 取得標準 DNS Wire Format (例如: 08 armytest ...)
-            raw_cname = _encode_dns_name(data_content)
-            
-            # 2. 計算 AD 要求的 Metadata
-            # (A) 總長度
-            cname_total_len = len(raw_cname)
-            
-            # (B) 標籤數量 (Label Count)
-            # 例如 "armytest.army.mil.tw" -> 4 個標籤
-            # 我們重新解析字串來計算比較穩
-            parts = [p for p in data_content.strip().strip('.').split('.') if p]
-            label_count = len(parts)
-            
-            # 3. 組合前綴: [Length(1B)] [Count(1B)]
-            # 注意：AD 裡的 CNAME data 開頭必須是這兩個 byte
-            prefix = struct.pack('BB', cname_total_len, label_count)
-            
-            data_bytes = prefix + raw_cname
+    # 2. 過濾 AD 系統紀錄 (所有以 _ 開頭的，如 _msdcs, _ldap, _kerberos)
+    # 這些是 SRV 紀錄，管理者通常不需要動它們
+    if name.startswith('_'):
+        return None
+        
+    # ---【過濾邏輯結束】---
 
-        else:
-            raise ValueError("不支援的紀錄類型")
+    records = decode_records(values if isinstance(values, (list, tuple)) else [values])
+    if not records:
+        return None
 
-        data_len = len(data_bytes)
-        
-        # --- 建構 Header (24 bytes) ---
-        # Part 1: Len, Type, Ver, Rank, Flags, Serial
-        part1 = struct.pack('<HHBBHI', 
-                           data_len, record_type, 5, 0xF0, 0, 0)
-        
-        # Part 2: TTL (Big Endian)
-        part2 = struct.pack('>I', ttl)
-        
-        # Part 3: Reserved, Timestamp
-        part3 = struct.pack('<II', 0, 0)
-        
-        return part1 + part2 + part3 + data_bytes
+    return {
+        'name': name,
+        'type': records[0].type,
+        'records': [record.to_dict() for record in records],
+        'dn': dn
+    }
 
-    except Exception as e:
-        raise ValueError(f"DNS 封包建立失敗: {e}")
+# --- DNS 寫入 ---
 
 def create_dns_record(zone_dn, hostname, record_type, value):
 
@@ -241,7 +592,7 @@ def create_dns_record(zone_dn, hostname, record_type, value):
     if not safe_name.replace('-', '').isalnum():
         return False, "名稱包含非法字元"
 
-    conn = get_ad_connection()
+    conn = get_ad_connection(write=True)
     hostname = hostname.strip()
     # 確保 CNAME 目標值也去除空白
     value = value.strip() 
@@ -249,8 +600,7 @@ def create_dns_record(zone_dn, hostname, record_type, value):
     new_record_dn = f"DC={hostname},{zone_dn}"
     
     try:
-        type_code = 1 if record_type == 'A' else 5
-        dns_blob = _create_dns_record_bytes(type_code, value)
+        dns_blob = encode_record(record_type, value)
         
         attrs = {
             'objectClass': ['top', 'dnsNode'],
@@ -259,6 +609,7 @@ def create_dns_record(zone_dn, hostname, record_type, value):
         }
         
         if conn.add(new_record_dn, attributes=attrs):
+            _after_write(_dns_records_tag(zone_dn))
             return True, f"DNS 紀錄 {hostname} 建立成功"
         else:
             err_msg = conn.result['description']
@@ -266,11 +617,16 @@ def create_dns_record(zone_dn, hostname, record_type, value):
                 return False, f"建立失敗: 紀錄 {hostname} 已存在，請先刪除舊紀錄。"
             return False, f"建立失敗: {err_msg}"
             
+    except DnsCodecError as e:
+        return False, f"DNS 封包建立失敗: {e}"
     except Exception as e:
         return False, str(e)
 
 def delete_dns_record(record_dn):
-    return delete_ad_object(record_dn)
+    success, msg = delete_ad_object(record_dn)
+    if success and ',' in record_dn:
+        _invalidate(_dns_records_tag(record_dn.split(',', 1)[1]))
+    return success, msg
 
 # --- 其他基本功能 (User/Group/Computer) ---
 # 為了完整性，這裡保留其他功能，避免覆蓋時遺失
@@ -278,18 +634,14 @@ def delete_dns_record(record_dn):
 def get_all_users():
     conn = get_ad_connection()
     base_dn = current_app.config.get('AD_BASEDN')
-    conn.search(base_dn, '(&(objectClass=user)(!(objectClass=computer)))', attributes=['sAMAccountName', 'displayName', 'userPrincipalName', 'userAccountControl', 'distinguishedName'])
-    return conn.entries
+    return paged_search(conn, base_dn, '(&(objectClass=user)(!(objectClass=computer)))', attributes=DIRECTORY_LISTINGS['users']['attributes'])
 
-def create_ad_user(username, password, firstname, lastname):
+def _is_valid_name(name):
+    """只允許英數與橫線"""
+    return bool(name) and escape_filter_chars(name).replace('-', '').isalnum()
 
-    safe_name = escape_filter_chars(username)
-    
-    # 2. 強制檢查輸入格式 (例如只允許英數與橫線)
-    if not safe_name.replace('-', '').isalnum():
-        return False, "名稱包含非法字元"
-
-    conn = get_ad_connection()
+def _build_user_entry(username, password, firstname, lastname):
+    """組出新使用者的 DN 與屬性 (單筆建立與批次匯入共用)"""
     base_dn = current_app.config.get('AD_BASEDN')
     if base_dn.lower().strip().startswith('dc='):
         user_dn = f"cn={username},cn=Users,{base_dn}"
@@ -309,8 +661,19 @@ def create_ad_user(username, password, firstname, lastname):
         'userAccountControl': 512, 
         'objectClass': ['top', 'person', 'organizationalPerson', 'user']
     }
+    return user_dn, attrs
+
+def create_ad_user(username, password, firstname, lastname):
+    
+    # 2. 強制檢查輸入格式 (例如只允許英數與橫線)
+    if not _is_valid_name(username):
+        return False, "名稱包含非法字元"
+
+    conn = get_ad_connection(write=True)
+    user_dn, attrs = _build_user_entry(username, password, firstname, lastname)
     try:
         if conn.add(user_dn, attributes=attrs):
+            _after_write('users')
             return True, "使用者建立成功"
         else:
             return False, f"建立失敗: {conn.result['description']}"
@@ -318,9 +681,11 @@ def create_ad_user(username, password, firstname, lastname):
         return False, str(e)
 
 def delete_ad_object(object_dn):
-    conn = get_ad_connection()
+    conn = get_ad_connection(write=True)
     try:
         if conn.delete(object_dn):
+            # 刪除的可能是任何類型的物件
+            _after_write('users', 'groups', 'computers', 'group_members')
             return True, "刪除成功"
         else:
             return False, f"刪除失敗: {conn.result['description']}"
@@ -330,34 +695,87 @@ def delete_ad_object(object_dn):
 def get_all_groups():
     conn = get_ad_connection()
     base_dn = current_app.config.get('AD_BASEDN')
-    conn.search(base_dn, '(objectClass=group)', attributes=['cn', 'description', 'distinguishedName'])
-    return conn.entries
+    return paged_search(conn, base_dn, '(objectClass=group)', attributes=DIRECTORY_LISTINGS['groups']['attributes'])
+
+def get_ranged_values(conn, dn, attribute):
+    """
+    讀取多值屬性的所有值 (range retrieval)
+    AD 每次最多回傳 MaxValRange (預設 1500) 個值，超過時會回傳 member;range=0-1499，
+    需再以 member;range=1500-* 逐段讀取直到上界為 *
+    """
+    values = []
+    requested = attribute
+    prefix = f"{attribute.lower()};range="
+    while True:
+        conn.search(dn, '(objectClass=*)', search_scope=BASE, attributes=[requested])
+        if not conn.response or conn.response[0].get('type') != 'searchResEntry':
+            break
+        attrs = conn.response[0]['attributes']
+        ranged = [name for name in attrs if name.lower().startswith(prefix)]
+        if not ranged:
+            # 值未超過上限，或 ldap3 的 auto_range 已經把分段合併回原屬性
+            values.extend(attrs.get(attribute) or [])
+            break
+        name = ranged[0]
+        values.extend(attrs[name])
+        high = name.partition(';range=')[2].partition('-')[2]
+        if high == '*':
+            break
+        requested = f"{attribute};range={int(high) + 1}-*"
+    return values
 
 def get_group_members_with_details(group_name):
+    """取得群組成員與顯示名稱 (有快取，成員異動時失效)"""
+    return directory_cache.get_or_load(
+        _cache_key('group_members', group_name.lower()), lambda: _get_group_members_with_details(group_name),
+        tags=('group_members',))
+
+def _get_group_members_with_details(group_name):
+    """
+    - 成員 DN：range retrieval 讀完整的 member (不受 MaxValRange 限制)
+    - 成員明細：一次分頁搜尋 (memberOf=<群組 DN>)，不再逐一查詢每個成員
+    - 網域樹以外的成員 (例如其他網域的物件) 再以 OR filter 批次補查
+    """
     conn = get_ad_connection()
     group_dn = find_dn_by_name(conn, group_name, 'group')
     if not group_dn: return []
-    conn.search(group_dn, '(objectClass=group)', attributes=['member'])
-    if not conn.entries: return []
-    member_dns = conn.entries[0].member.values if 'member' in conn.entries[0] else []
+    member_dns = get_ranged_values(conn, group_dn, 'member')
+    if not member_dns: return []
+
+    details = {}
+    attributes = ['sAMAccountName', 'displayName']
+    member_filter = f"(memberOf={escape_filter_chars(group_dn)})"
+    for entry in paged_search(conn, _get_domain_root(), member_filter, attributes=attributes):
+        details[entry.entry_dn.lower()] = entry
+
+    missing = [dn for dn in member_dns if dn.lower() not in details]
+    for i in range(0, len(missing), MEMBER_LOOKUP_BATCH_SIZE):
+        batch = missing[i:i + MEMBER_LOOKUP_BATCH_SIZE]
+        terms = ''.join(f"(distinguishedName={escape_filter_chars(dn)})" for dn in batch)
+        try:
+            for entry in paged_search(conn, _get_domain_root(), f"(|{terms})", attributes=attributes):
+                details[entry.entry_dn.lower()] = entry
+        except Exception:
+            continue
+
     detailed_members = []
     for m_dn in member_dns:
-        try:
-            conn.search(m_dn, '(objectClass=*)', attributes=['sAMAccountName', 'displayName'])
-            if conn.entries:
-                entry = conn.entries[0]
-                detailed_members.append({
-                    'name': str(entry.sAMAccountName) if 'sAMAccountName' in entry else 'N/A',
-                    'display': str(entry.displayName) if 'displayName' in entry else 'N/A',
-                    'dn': m_dn
-                })
-        except: continue
+        entry = details.get(m_dn.lower())
+        if entry is None:
+            continue
+        detailed_members.append({
+            'name': str(entry.sAMAccountName) if 'sAMAccountName' in entry else 'N/A',
+            'display': str(entry.displayName) if 'displayName' in entry else 'N/A',
+            'dn': m_dn
+        })
     return detailed_members
 
 def manage_group_member(action, group_name, username):
-    conn = get_ad_connection()
-    group_dn = find_dn_by_name(conn, group_name, 'group')
-    user_dn = find_dn_by_name(conn, username, 'user')
+    conn = get_ad_connection(write=True)
+    # 群組與使用者在同一個查詢中解析
+    found = resolve_names(conn, {'group': [group_name], 'user': [username]})
+    group_dn = found['group'].get((group_name or '').lower())
+    user_dn = found['user'].get((username or '').lower())
     if not group_dn or not user_dn: return False, "找不到群組或使用者"
     try:
         if action == 'add':
@@ -365,6 +783,7 @@ def manage_group_member(action, group_name, username):
         elif action == 'remove':
             conn.extend.microsoft.remove_members_from_groups([user_dn], [group_dn])
         if conn.result['result'] == 0:
+            _after_write('group_members')
             return True, "更新成功"
         else:
             return False, f"更新失敗: {conn.result['description']}"
@@ -374,8 +793,7 @@ def manage_group_member(action, group_name, username):
 def get_all_computers():
     conn = get_ad_connection()
     base_dn = current_app.config.get('AD_BASEDN')
-    conn.search(base_dn, '(objectClass=computer)', attributes=['cn', 'operatingSystem', 'distinguishedName'])
-    return conn.entries
+    return paged_search(conn, base_dn, '(objectClass=computer)', attributes=DIRECTORY_LISTINGS['computers']['attributes'])
 
 def create_computer(computer_name):
 
@@ -385,7 +803,7 @@ def create_computer(computer_name):
     if not safe_name.replace('-', '').isalnum():
         return False, "名稱包含非法字元"
 
-    conn = get_ad_connection()
+    conn = get_ad_connection(write=True)
     base_dn = current_app.config.get('AD_BASEDN')
     
     # 嘗試解析網域 (例如從 dc=army,dc=mil... 解析出 army.mil.tw)
@@ -427,6 +845,7 @@ def create_computer(computer_name):
     
     try:
         if conn.add(comp_dn, attributes=attrs):
+            _after_write('computers')
             return True, f"電腦 {computer_name} 建立成功"
         else:
             return False, f"建立失敗: {conn.result['description']}"
@@ -442,32 +861,79 @@ def verify_ad_login(username, password):
     
     user_upn = f"{username}@{domain}" if '@' not in username else username
 
+    if _service_mode():
+        return _verify_login_with_service_account(server_addr, user_upn, username, password)
+
+    conn = None
     try:
         # 1. 身份驗證 (Authentication)
-        server = Server(server_addr, use_ssl=True, tls=None, get_info=NONE)
-        conn = Connection(server, user=user_upn, password=password, authentication='SIMPLE', auto_bind=True)
+        # fresh=True：登入時一定重新 bind 以驗證密碼，驗證完的連線歸還連線池供後續頁面沿用
+        conn = ldap_pool.acquire(server_addr, user_upn, password, fresh=True)
         
         if conn.bound:
             # 2. 授權檢查 (Authorization)
             # 確保只有具備管理權限的人能進入系統
             if is_domain_admin(conn, username):
-                conn.unbind()
+                ldap_pool.release(conn)
                 return True, "登入成功"
             else:
-                conn.unbind()
+                ldap_pool.release(conn, discard=True)
                 log(f"拒絕登入：使用者 {username} 權限不足")
                 return False, "權限不足：您不具備 Domain Admins 權限"
+        ldap_pool.release(conn, discard=True)
                 
     except Exception as e:
+        if conn is not None:
+            ldap_pool.release(conn, discard=True)
         return False, f"登入失敗: {str(e)}"
     
     return False, "帳號或密碼錯誤"
 
+def _verify_login_with_service_account(server_addr, user_upn, username, password):
+    """
+    service 模式的登入：
+    1. 以使用者帳密 bind 一次驗證密碼，這條連線用完即丟 (不進連線池，也不保存密碼)
+    2. 以服務帳號的池化連線做 Domain Admins 授權檢查
+    """
+    if not current_app.config.get('AD_USER') or not current_app.config.get('AD_PASS'):
+        return False, "登入失敗: AD_BIND_MODE=service 需要設定 AD_USER / AD_PASSWORD 服務帳號"
+    if not password:
+        # 空密碼會變成匿名 bind (unauthenticated bind)，不能當作驗證通過
+        return False, "帳號或密碼錯誤"
+
+    conn = None
+    try:
+        conn = ldap_pool.acquire(server_addr, user_upn, password, fresh=True)
+        authenticated = conn.bound
+    except Exception as e:
+        return False, f"登入失敗: {str(e)}"
+    finally:
+        if conn is not None:
+            ldap_pool.release(conn, discard=True)
+    if not authenticated:
+        return False, "帳號或密碼錯誤"
+
+    try:
+        if check_user_authorization(username):
+            return True, "登入成功"
+    except Exception as e:
+        return False, f"登入失敗: {str(e)}"
+    log(f"拒絕登入：使用者 {username} 權限不足")
+    return False, "權限不足：您不具備 Domain Admins 權限"
+
+def check_user_authorization(username):
+    """以服務帳號的連線判斷使用者是否仍具備 Domain Admins 權限 (登入與定期複查共用)"""
+    server_addr, bind_user, bind_pass = (current_app.config.get('AD_SERVER'),
+                                         current_app.config.get('AD_USER'), current_app.config.get('AD_PASS'))
+    conn = ldap_pool.connection_for_request(server_addr, bind_user, bind_pass)
+    conn.extra_controls = ()  # 授權檢查本身以服務帳號身分查詢，不帶代理授權
+    return is_domain_admin(conn, username)
+
 def reset_user_password(username, new_password):
     """
     重置使用者密碼 (管理員操作)
     """
-    conn = get_ad_connection() # 使用 .env 的管理員帳號連線
+    conn = get_ad_connection(write=True) # 使用 .env 的管理員帳號連線
     user_dn = find_dn_by_name(conn, username, 'user')
     
     if not user_dn:
@@ -484,60 +950,83 @@ def reset_user_password(username, new_password):
     except Exception as e:
         return False, f"重置失敗: {str(e)}"
     
+def _sid_to_str(raw):
+    """二進位 SID 轉成 S-1-5-21-... 字串"""
+    sub_count = raw[1]
+    authority = int.from_bytes(raw[2:8], 'big')
+    subs = struct.unpack_from(f'<{sub_count}I', raw, 8)
+    return f"S-{raw[0]}-{authority}" + ''.join(f"-{sub}" for sub in subs)
+
+ADMIN_GROUP_RID = 512
+
+def _get_admin_group(conn, domain_root):
+    """
+    解析 Domain Admins 群組 (網域 SID + RID 512)，回傳 (admin_dn, admin_sid)
+    結果放在 directory_cache，ADMIN_GROUP_REFRESH 秒後重新解析；與登入身分無關，所有人共用同一份
+    """
+    key = ('admin_group', domain_root.lower())
+    cached = directory_cache.get(key)
+    if cached is not None:
+        return cached
+
+    conn.search(domain_root, '(objectClass=*)', search_scope=BASE, attributes=['objectSid'])
+    if not conn.entries or not conn.entries[0].entry_raw_attributes.get('objectSid'):
+        return None, None
+    domain_sid = conn.entries[0].entry_raw_attributes['objectSid'][0]
+    # 網域 SID 多加一個 sub-authority (RID 512)
+    admin_sid = bytes([domain_sid[0], domain_sid[1] + 1]) + domain_sid[2:] + struct.pack('<I', ADMIN_GROUP_RID)
+
+    conn.search(domain_root, f"(objectSid={_sid_to_str(admin_sid)})", attributes=NO_ATTRIBUTES, size_limit=1)
+    admin_dn = conn.entries[0].entry_dn if conn.entries else None
+    directory_cache.set(key, (admin_dn, admin_sid), ttl=current_app.config.get('ADMIN_GROUP_REFRESH', 3600))
+    log(f"成功識別管理員群組 DN: {admin_dn}")
+    return admin_dn, admin_sid
+
 def is_domain_admin(conn, username):
     """
-    專業授權服務：使用 entry_dn 避開屬性遺失錯誤
+    授權檢查：使用者是否屬於 Domain Admins (含巢狀群組與主要群組)
+    判定結果短暫快取 (AUTHZ_CACHE_TTL)，登入尖峰時不必重複查詢
     """
-    base_dn = current_app.config.get('AD_BASEDN')
-    
-    # 1. 動態解析網域根目錄
-    if 'dc=' in base_dn.lower():
-        domain_root = base_dn[base_dn.lower().find('dc='):]
-    else:
-        domain_root = base_dn
+    domain_root = _get_domain_root()
+    key = (domain_root.lower(), username.lower())
+    is_admin = authz_cache.get(key)
+    if is_admin is None:
+        is_admin = _check_domain_admin(conn, username, domain_root)
+        authz_cache.set(key, is_admin)
+    return is_admin
 
+def _check_domain_admin(conn, username, domain_root):
+    """
+    以使用者物件的 tokenGroups (一次 base 讀取) 判斷
+    tokenGroups 已包含所有巢狀群組與主要群組的 SID，不需要 in-chain 比對規則
+    """
     log(f"權限檢查啟動 | 使用者: {username} | 根目錄: {domain_root}")
 
-    # 2. 搜尋 Domain Admins 群組 (利用 RID 512)
-    # 我們不要求特定的 attributes，改用 entry_dn 獲取結果
-    conn.search(
-        search_base=domain_root,
-        search_filter='(&(objectClass=group)(primaryGroupToken=512))',
-        attributes=['cn'] # 隨便抓個屬性確保 Entry 被建立
-    )
-    
-    if not conn.entries:
-        log("RID 512 搜尋失敗，嘗試 sAMAccountName 搜尋...")
-        conn.search(
-            search_base=domain_root, 
-            search_filter='(&(objectClass=group)(sAMAccountName=Domain Admins))',
-            attributes=['cn']
-        )
-
-    if not conn.entries:
+    admin_dn, admin_sid = _get_admin_group(conn, domain_root)
+    if not admin_sid:
         log("嚴重錯誤：無法在網域中定位 Domain Admins 群組。")
         return False
-    
-    # 【關鍵修正】使用 entry_dn 替代 distinguishedName
-    admin_dn = conn.entries[0].entry_dn
-    log(f"成功識別管理員群組 DN: {admin_dn}")
 
-    # 3. 執行權限判定
     safe_user = escape_filter_chars(username)
-    
-    # 檢查 A: 主要群組 ID
-    conn.search(search_base=domain_root, search_filter=f'(sAMAccountName={safe_user})', attributes=['primaryGroupID'])
-    
-    user_primary_id = ""
-    if conn.entries and 'primaryGroupID' in conn.entries[0]:
-        user_primary_id = str(conn.entries[0].primaryGroupID.value)
-    
-    # 檢查 B: 遞迴成員身份 (Matching Rule In Chain)
-    recursive_filter = f"(&(sAMAccountName={safe_user})(memberOf:1.2.840.113556.1.4.1941:={admin_dn}))"
-    conn.search(search_base=domain_root, search_filter=recursive_filter, attributes=['cn'])
-    
-    is_admin = (user_primary_id == "512") or (len(conn.entries) > 0)
-    
+    conn.search(domain_root, f'(&(objectClass=user)(sAMAccountName={safe_user}))', attributes=NO_ATTRIBUTES, size_limit=1)
+    if not conn.entries:
+        log(f"拒絕授權：找不到使用者 {username}。")
+        return False
+    user_dn = conn.entries[0].entry_dn
+
+    conn.search(user_dn, '(objectClass=*)', search_scope=BASE, attributes=['tokenGroups'])
+    token_groups = conn.entries[0].entry_raw_attributes.get('tokenGroups') if conn.entries else None
+
+    if token_groups:
+        is_admin = admin_sid in token_groups
+    elif admin_dn:
+        # 讀不到 tokenGroups 時才退回遞迴成員比對 (Matching Rule In Chain)
+        recursive_filter = f"(&(sAMAccountName={safe_user})(memberOf:1.2.840.113556.1.4.1941:={escape_filter_chars(admin_dn)}))"
+        conn.search(domain_root, recursive_filter, attributes=['cn'])
+        is_admin = len(conn.entries) > 0
+    else:
+        is_admin = False
+
     if not is_admin:
         log(f"拒絕授權：使用者 {username} 不在管理員名單中。")
         
@@ -0,0 +1,247 @@
+# app/bulk_ops.py
+# 批次建立使用者：先整批驗證，再以多條連線並行送出 add
+import csv
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from ldap3 import MODIFY_ADD
+from ldap3.core.exceptions import LDAPException
+from app.ldap_pool import ldap_pool
+from app.ad_ops import (get_ad_connection, resolve_names, log, _get_bind_credentials, _authz_controls,
+                        _build_user_entry, _is_valid_name, _after_write)
+
+USER_IMPORT_FIELDS = ('username', 'password', 'firstname', 'lastname', 'groups')
+SAM_ACCOUNT_NAME_MAX = 20  # sAMAccountName 長度上限 (相容 NT4 的限制)
+
+
+class BulkImportError(Exception):
+    """匯入檔無法解析 (格式錯誤、缺少欄位、筆數過多)"""
+
+
+# --- 解析 ---
+
+def _split_groups(value):
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    # CSV 欄位內以分號分隔多個群組
+    return [v.strip() for v in str(value or '').split(';') if v.strip()]
+
+def _normalize_row(line_no, data):
+    return {
+        'row': line_no,
+        'username': str(data.get('username') or '').strip(),
+        'password': str(data.get('password') or ''),
+        'firstname': str(data.get('firstname') or '').strip(),
+        'lastname': str(data.get('lastname') or '').strip(),
+        'groups': _split_groups(data.get('groups')),
+    }
+
+def detect_format(filename):
+    return 'jsonl' if (filename or '').lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+def parse_user_rows(stream, fmt='csv'):
+    """
+    讀取匯入檔 (文字串流)，回傳標準化後的列
+    - csv：第一列為標題 username,password,firstname,lastname[,groups]，groups 以分號分隔
+    - jsonl：每行一個 JSON 物件，groups 可為陣列或分號分隔字串
+    """
+    rows = []
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                raise BulkImportError(f"第 {line_no} 行不是合法的 JSON: {e}")
+            if not isinstance(data, dict):
+                raise BulkImportError(f"第 {line_no} 行必須是 JSON 物件")
+            rows.append(_normalize_row(line_no, {str(k).strip().lower(): v for k, v in data.items()}))
+    else:
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames:
+            raise BulkImportError("CSV 檔案是空的")
+        reader.fieldnames = [(name or '').strip().lower() for name in reader.fieldnames]
+        missing = [f for f in USER_IMPORT_FIELDS[:4] if f not in reader.fieldnames]
+        if missing:
+            raise BulkImportError(f"CSV 缺少欄位: {', '.join(missing)}")
+        for data in reader:
+            if not any((v or '').strip() for v in data.values() if isinstance(v, str)):
+                continue
+            rows.append(_normalize_row(reader.line_num, data))
+
+    max_rows = current_app.config.get('BULK_IMPORT_MAX_ROWS', 5000)
+    if max_rows and len(rows) > max_rows:
+        raise BulkImportError(f"單次最多匯入 {max_rows} 筆 (檔案有 {len(rows)} 筆)")
+    return rows
+
+
+# --- 驗證 ---
+
+def validate_user_rows(conn, rows):
+    """
+    送出任何寫入前先檢查整批資料：
+    必填欄位、帳號格式、檔案內重複、AD 中已存在的帳號、不存在的群組
+    回傳 (errors, group_dns)，errors 為 [{'row', 'username', 'message'}]
+    """
+    problems = {row['row']: [] for row in rows}
+    seen = {}
+    for row in rows:
+        for field in USER_IMPORT_FIELDS[:4]:
+            if not row[field]:
+                problems[row['row']].append(f"缺少 {field}")
+        username = row['username']
+        if username:
+            if not _is_valid_name(username):
+                problems[row['row']].append("帳號包含非法字元")
+            elif len(username) > SAM_ACCOUNT_NAME_MAX:
+                problems[row['row']].append(f"帳號長度超過 {SAM_ACCOUNT_NAME_MAX} 個字元")
+            key = username.lower()
+            if key in seen:
+                problems[row['row']].append(f"與第 {seen[key]} 列的帳號重複")
+            else:
+                seen[key] = row['row']
+
+    # 帳號與群組合併成同一批 OR filter 查詢，而不是逐筆 find_dn_by_name
+    found = resolve_names(conn, {'user': [r['username'] for r in rows if _is_valid_name(r['username'])],
+                                 'group': [g for r in rows for g in r['groups']]})
+    existing, group_dns = found['user'], found['group']
+    for row in rows:
+        if row['username'].lower() in existing:
+            problems[row['row']].append("帳號已存在於 AD")
+        unknown = [g for g in row['groups'] if g.lower() not in group_dns]
+        if unknown:
+            problems[row['row']].append(f"找不到群組: {', '.join(unknown)}")
+
+    errors = [{'row': row['row'], 'username': row['username'], 'message': '；'.join(problems[row['row']])}
+              for row in rows if problems[row['row']]]
+    return errors, group_dns
+
+
+# --- 執行 ---
+
+def _add_user(conn, task):
+    """在指定連線上建立一個使用者並加入群組，回傳單列結果"""
+    result = dict(task['ident'], success=False, message='')
+    if not conn.add(task['dn'], attributes=task['attrs']):
+        result['message'] = f"建立失敗: {conn.result['description']}"
+        return result
+    result['success'] = True
+    failed_groups = []
+    for group_name, group_dn in task['groups']:
+        if not conn.modify(group_dn, {'member': [(MODIFY_ADD, [task['dn']])]}):
+            failed_groups.append(f"{group_name} ({conn.result['description']})")
+    if failed_groups:
+        result['message'] = f"使用者已建立，但加入群組失敗: {', '.join(failed_groups)}"
+    else:
+        result['message'] = "使用者建立成功"
+    return result
+
+def _run_lane(credentials, tasks, handler, controls=(), job=None):
+    """
+    一條工作線：從工作線專用的名額借一條連線，依序以 handler(conn, task) 處理分配到的工作 (各工作線之間並行)
+    連線發生 LDAP 例外時丟棄並重新借一條，其餘工作繼續處理
+    controls：呼叫端請求的代理授權控制項 (工作線沒有 Session，由呼叫端先取好)
+    job：背景工作 (app.jobs.Job)，每處理一筆回報進度；取消後剩下的工作不再送出
+    """
+    server_addr, bind_user, bind_pass = credentials
+    results = []
+    conn = None
+    try:
+        for task in tasks:
+            if job is not None and job.cancelled:
+                results.append(dict(task['ident'], success=False, message="已取消，未執行"))
+                continue
+            try:
+                if conn is None:
+                    conn = ldap_pool.acquire(server_addr, bind_user, bind_pass, route='write', lane=True)
+                    conn.extra_controls = controls
+                results.append(handler(conn, task))
+            except LDAPException as e:
+                if conn is not None:
+                    ldap_pool.release(conn, discard=True)
+                    conn = None
+                results.append(dict(task['ident'], success=False, message=str(e)))
+            except Exception as e:
+                results.append(dict(task['ident'], success=False, message=str(e)))
+            if job is not None:
+                job.advance()
+    finally:
+        if conn is not None:
+            ldap_pool.release(conn)
+    return results
+
+def run_in_lanes(tasks, handler, workers=None, job=None):
+    """
+    把工作分成數條工作線並行執行，每條工作線各用一條池化連線 (需在 app context 內呼叫)
+    每個 task 需帶 'ident' (結果的識別欄位)，回傳 (results, workers)，results 順序與 tasks 相同
+    工作線的連線與網頁請求分開計算 (ldap_pool 的 lane 名額)，匯入期間登入者仍能正常操作；
+    工作線數不超過目前空著的工作線名額 (同一身分同時有其他匯入時就少開幾條)
+    """
+    if not tasks:
+        return [], 0
+    if workers is None:
+        workers = current_app.config.get('BULK_IMPORT_WORKERS', 4)
+    credentials = _get_bind_credentials()
+    free = ldap_pool.available(credentials[0], credentials[1], route='write', lane=True)
+    workers = max(1, min(workers, free, len(tasks)))
+    lanes = [tasks[i::workers] for i in range(workers)]
+    controls = _authz_controls()
+    if job is not None:
+        job.set_total(len(tasks), "寫入中...")
+
+    ordered = [None] * len(tasks)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bulk-ldap') as executor:
+        lane_results = executor.map(lambda lane: _run_lane(credentials, lane, handler, controls, job), lanes)
+        for lane_no, results in enumerate(lane_results):
+            ordered[lane_no::workers] = results
+    return ordered, workers
+
+def _summarize(report, results, workers, started):
+    elapsed = time.monotonic() - started
+    report['results'] = results
+    report['succeeded'] = sum(1 for r in results if r['success'])
+    report['failed'] = len(results) - report['succeeded']
+    report['elapsed'] = round(elapsed, 3)
+    report['rate'] = round(report['succeeded'] / elapsed, 1) if elapsed > 0 else 0.0
+    report['workers'] = workers
+    return report
+
+def import_users(rows, workers=None, dry_run=False, job=None):
+    """
+    批次建立使用者 (需在 app context 內呼叫；有登入 Session 時以登入者身分寫入)
+    1. 整批驗證，有任何錯誤就不寫入
+    2. 依 workers 數把資料分成數條工作線，每條工作線各用一條池化連線並行送出
+    job：在背景工作內執行時回報進度、可被取消
+    回傳報告：{'total', 'succeeded', 'failed', 'errors', 'results', 'elapsed', 'rate', 'workers', 'dry_run'}
+    """
+    started = time.monotonic()
+    report = {'total': len(rows), 'succeeded': 0, 'failed': 0, 'errors': [], 'results': [],
+              'elapsed': 0.0, 'rate': 0.0, 'workers': 0, 'dry_run': dry_run}
+    if not rows:
+        return report
+
+    # 驗證與寫入都走寫入用的 DC，檢查「帳號是否已存在」時看到的是同一台 DC 的資料
+    conn = get_ad_connection(write=True)
+    errors, group_dns = validate_user_rows(conn, rows)
+    if errors or dry_run:
+        report['errors'] = errors
+        report['failed'] = len(errors)
+        report['elapsed'] = round(time.monotonic() - started, 3)
+        return report
+
+    # DN / 屬性在主執行緒組好 (需要 current_app)，工作執行緒只負責送出 LDAP 操作
+    tasks = []
+    for row in rows:
+        dn, attrs = _build_user_entry(row['username'], row['password'], row['firstname'], row['lastname'])
+        groups = [(g, group_dns[g.lower()]) for g in row['groups']]
+        tasks.append({'ident': {'row': row['row'], 'username': row['username']}, 'dn': dn, 'attrs': attrs, 'groups': groups})
+
+    results, workers = run_in_lanes(tasks, _add_user, workers, job)
+    _summarize(report, results, workers, started)
+    log(f"批次匯入完成: {report['succeeded']}/{report['total']} 筆，{report['elapsed']} 秒，{workers} 條連線")
+
+    if report['succeeded']:
+        _after_write('users', 'group_members')
+    return report
@@ -0,0 +1,130 @@
+# app/cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    執行緒安全的 TTL + LRU 快取
+    - 超過 ttl 秒的項目視為過期
+    - 超過 max_entries 時淘汰最久未使用的項目
+    - 每個項目可附帶標籤 (tag)，寫入操作以標籤精準失效
+    - get_or_load 的 loader 執行期間若發生失效 (同一個標籤、delete 或 clear)，
+      讀到的可能是寫入前的舊資料，這次的結果就不存入快取
+    """
+
+    def __init__(self, max_entries=512, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}             # tag -> set(key)
+        self._tag_versions = {}     # tag -> 失效次數 (標籤是固定的幾種，不會無限增長)
+        self._version = 0           # delete / clear 次數 (以 key 失效，無法對應到標籤)
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # fork 當下若有其他執行緒持有鎖，子行程會永遠拿不到，重建一把
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def init_app(self, app, prefix='DIRECTORY_CACHE'):
+        self.ttl = app.config.get(f'{prefix}_TTL', self.ttl)
+        self.max_entries = app.config.get(f'{prefix}_MAX_ENTRIES', self.max_entries)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def _drop_locked(self, key):
+        _, _, tags = self._data.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] <= time.monotonic():
+                self._drop_locked(key)
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value, tags=(), ttl=None):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._data:
+                self._drop_locked(key)
+            self._data[key] = (expires_at, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_entries:
+                self._drop_locked(next(iter(self._data)))
+
+    def _stamp_locked(self, tags):
+        return self._version, tuple(self._tag_versions.get(tag, 0) for tag in tags)
+
+    def get_or_load(self, key, loader, tags=(), ttl=None):
+        """讀穿式快取：命中直接回傳，否則呼叫 loader() 並存入 (loader 期間有失效時不存入)"""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            tags = tuple(tags)
+            with self._lock:
+                stamp = self._stamp_locked(tags)
+            value = loader()
+            with self._lock:
+                stale = self._stamp_locked(tags) != stamp
+            if not stale:
+                self.set(key, value, tags=tags, ttl=ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._version += 1
+            if key in self._data:
+                self._drop_locked(key)
+                return True
+        return False
+
+    def sweep(self):
+        """主動清掉所有已過期的項目 (平常只在讀到時才清)，回傳清掉的數量"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, item in self._data.items() if item[0] <= now]
+            for key in expired:
+                self._drop_locked(key)
+        return len(expired)
+
+    def invalidate(self, *tags):
+        """讓帶有任一標籤的項目全部失效"""
+        with self._lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+                for key in list(self._tags.get(tag, ())):
+                    if key in self._data:
+                        self._drop_locked(key)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._data.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+directory_cache = TTLCache()
+authz_cache = TTLCache(max_entries=1024, ttl=60)  # 登入授權判定結果
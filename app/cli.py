@@ -0,0 +1,88 @@
+# app/cli.py
+# Flask CLI 指令 (flask --app run <command>)，以 .env 的服務帳號身分執行
+import sys
+import click
+
+
+def register_cli(app):
+
+    @app.cli.command('import-users')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None, help="預設依副檔名判斷")
+    @click.option('--workers', type=int, default=None, help="並行連線數 (預設且最多 BULK_IMPORT_WORKERS)")
+    @click.option('--dry-run', is_flag=True, help="只驗證，不寫入 AD")
+    def import_users_command(path, fmt, workers, dry_run):
+        """批次匯入使用者 (CSV / JSONL)"""
+        from app.bulk_ops import BulkImportError, parse_user_rows, import_users, detect_format
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                rows = parse_user_rows(f, fmt or detect_format(path))
+        except (BulkImportError, UnicodeDecodeError) as e:
+            raise click.ClickException(f"匯入檔格式錯誤: {e}")
+
+        report = import_users(rows, workers=workers, dry_run=dry_run)
+        for error in report['errors']:
+            click.echo(f"[驗證失敗] 第 {error['row']} 列 {error['username']}: {error['message']}", err=True)
+        for result in report['results']:
+            status = 'OK' if result['success'] else '失敗'
+            click.echo(f"[{status}] 第 {result['row']} 列 {result['username']}: {result['message']}")
+
+        if report['errors']:
+            click.echo(f"驗證未通過 ({len(report['errors'])}/{report['total']} 列有錯誤)，未寫入任何資料", err=True)
+            sys.exit(1)
+        if dry_run:
+            click.echo(f"驗證通過，共 {report['total']} 列 (dry-run，未寫入)")
+            return
+        click.echo(f"完成: 成功 {report['succeeded']} / 失敗 {report['failed']} / 共 {report['total']} 列，"
+                   f"{report['elapsed']} 秒 ({report['rate']} 筆/秒，{report['workers']} 條連線)")
+        if report['failed']:
+            sys.exit(1)
+
+    @app.cli.command('export-zone')
+    @click.argument('zone_dn')
+    @click.option('--format', 'fmt', type=click.Choice(['bind', 'csv']), default='bind')
+    @click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help="預設輸出到 stdout")
+    def export_zone_command(zone_dn, fmt, output):
+        """匯出 DNS 區域紀錄 (BIND zone file / CSV)"""
+        from app.dns_bulk import export_zone
+        for chunk in export_zone(zone_dn, fmt):
+            output.write(chunk)
+
+    @app.cli.command('import-zone')
+    @click.argument('zone_dn')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['bind', 'csv']), default=None, help="預設依副檔名判斷")
+    @click.option('--prune', is_flag=True, help="一併刪除檔案中沒有的名稱")
+    @click.option('--workers', type=int, default=None, help="並行連線數 (預設且最多 BULK_IMPORT_WORKERS)")
+    @click.option('--dry-run', is_flag=True, help="只列出變更，不寫入 AD")
+    def import_zone_command(zone_dn, path, fmt, prune, workers, dry_run):
+        """以差異方式匯入 DNS 區域紀錄"""
+        from app.dns_bulk import ZoneFileError, parse_zone_file, import_zone, zone_name_from_dn, detect_zone_format
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as f:
+                records, errors, skipped = parse_zone_file(f, zone_name_from_dn(zone_dn), fmt or detect_zone_format(path))
+        except (ZoneFileError, UnicodeDecodeError) as e:
+            raise click.ClickException(f"匯入檔格式錯誤: {e}")
+        if skipped:
+            click.echo(f"略過 {skipped} 筆不支援類型的紀錄", err=True)
+
+        if not errors:
+            report = import_zone(zone_dn, records, prune=prune, dry_run=dry_run, workers=workers)
+            errors = report['errors']
+        if errors:
+            for error in errors:
+                click.echo(f"[驗證失敗] {error}", err=True)
+            sys.exit(1)
+
+        results = {r['name'].lower(): r for r in report['results']}
+        for change in report['changes']:
+            result = results.get(change['name'].lower())
+            status = 'PLAN' if dry_run else ('OK' if result and result['success'] else '失敗')
+            detail = ', '.join([f"+{d}" for d in change['added']] + [f"-{d}" for d in change['removed']])
+            click.echo(f"[{status}] {change['action']} {change['name']}: {detail}"
+                       + (f" ({result['message']})" if result and not result['success'] else ''))
+        click.echo(f"新增 {report['adds']} / 修改 {report['updates']} / 刪除 {report['deletes']} 個節點"
+                   + ("" if dry_run else f"，成功 {report['succeeded']} / 失敗 {report['failed']}，"
+                                         f"{report['elapsed']} 秒 ({report['rate']} 個/秒)"))
+        if report['failed']:
+            sys.exit(1)
@@ -0,0 +1,288 @@
+# app/dc_locator.py
+# 多台網域控制站 (DC) 的選擇與容錯：
+# - AD_SERVER 可填多台 (逗號分隔)，或以 DNS SRV (_ldap._tcp.dc._msdcs.<網域>) 自動探索
+# - 背景定期量測各 DC 的 TCP 連線延遲，讀取走最快 (或輪流) 的 DC，寫入優先走 PDC
+# - 實際連線交給 ldap3 ServerPool：候選 DC 依序嘗試，連不上的自動跳過
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ldap3 import Server, ServerPool, FIRST, BASE, NONE
+
+DC_SELECTIONS = ('latency', 'round_robin', 'first')
+LDAPS_PORT = 636
+PDC_REFRESH = 3600  # PDC 角色重新確認間隔秒數 (角色轉移很少發生)
+
+
+def _split_host(address, default_port=LDAPS_PORT):
+    """'dc1.corp.local' / 'dc1.corp.local:636' -> (主機, 埠號)"""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and ']' not in port:
+        return host, int(port)
+    return address, default_port
+
+
+class DomainControllerLocator:
+    """
+    DC 清單、健康狀態與延遲 (整個行程共用)
+    - 只設定一台 DC 時不做任何探測，行為與單一 Server 相同 (但套用連線 / 接收逾時)
+    - 量測在背景執行緒進行，請求不會因為探測而等待；還沒有量測結果時依設定順序
+    - 連線失敗的 DC 標記為離線 DC_DOWN_TIME 秒，期間排到候選清單最後 (全部離線時仍會嘗試)
+    """
+
+    def __init__(self):
+        self.hosts = []
+        self.selection = 'latency'
+        self.connect_timeout = 5
+        self.receive_timeout = 30
+        self.probe_interval = 30
+        self.down_time = 60
+        self.srv_discovery = False
+        self.domain = None
+        self.site = None
+        self.pdc = None
+        self._server_setting = None
+        self._configured_hosts = []
+        self._configured_pdc = None
+        self._domain_root = ''
+        self._pdc_checked = 0.0
+        self._servers = {}       # 主機 -> ldap3 Server
+        self._latency = {}       # 主機 -> 最近一次 TCP 連線秒數
+        self._down_until = {}    # 主機 -> 離線標記到期時間 (monotonic)
+        self._probed_at = 0.0
+        self._probing = False
+        self._rr = 0
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 量測執行緒不會跟著 fork 複製：重建鎖，讓子行程下一次使用時重新量測
+        self._lock = threading.Lock()
+        self._probing = False
+        self._probed_at = 0.0
+
+    def init_app(self, app):
+        self._server_setting = app.config.get('AD_SERVER')
+        self._configured_hosts = [h.strip() for h in (self._server_setting or '').split(',') if h.strip()]
+        self.selection = app.config.get('AD_DC_SELECTION', self.selection)
+        if self.selection not in DC_SELECTIONS:
+            raise RuntimeError(f"不支援的 AD_DC_SELECTION: {self.selection} (可用: {', '.join(DC_SELECTIONS)})")
+        self.connect_timeout = app.config.get('LDAP_CONNECT_TIMEOUT', self.connect_timeout)
+        self.receive_timeout = app.config.get('LDAP_RECEIVE_TIMEOUT', self.receive_timeout)
+        self.probe_interval = app.config.get('DC_PROBE_INTERVAL', self.probe_interval)
+        self.down_time = app.config.get('DC_DOWN_TIME', self.down_time)
+        self.srv_discovery = app.config.get('AD_DC_SRV_DISCOVERY', False)
+        self.domain = app.config.get('AD_DOMAIN')
+        self.site = app.config.get('AD_DC_SITE')
+        self._configured_pdc = app.config.get('AD_PDC')
+        self.pdc = self._configured_pdc
+        base_dn = app.config.get('AD_BASEDN') or ''
+        self._domain_root = base_dn[base_dn.lower().find('dc='):] if 'dc=' in base_dn.lower() else base_dn
+
+        self.hosts = list(self._configured_hosts)
+        if self.srv_discovery:
+            self.hosts = self._merge(self._discover(), self._configured_hosts)
+        if self.multiple:
+            from app.ad_ops import log
+            log(f"DC 清單: {', '.join(self.hosts)} (選擇方式: {self.selection})")
+
+    @property
+    def multiple(self):
+        return len(self.hosts) > 1
+
+    # --- DNS SRV 探索 ---
+
+    def _discover(self):
+        """
+        查詢 _ldap._tcp[.<站台>._sites].dc._msdcs.<網域> 取得 DC 清單 (依 priority、weight 排序)
+        SRV 記錄的埠號是 389，這裡一律改用 LDAPS 636 (與單一 AD_SERVER 時相同)
+        """
+        if not self.domain:
+            raise RuntimeError("AD_DC_SRV_DISCOVERY 需要設定 AD_DOMAIN")
+        try:
+            import dns.resolver
+        except ImportError:
+            raise RuntimeError("AD_DC_SRV_DISCOVERY 需要安裝 dnspython 套件 (pip install dnspython)")
+        site = f"{self.site}._sites." if self.site else ''
+        name = f"_ldap._tcp.{site}dc._msdcs.{self.domain}"
+        try:
+            answers = dns.resolver.resolve(name, 'SRV', lifetime=self.connect_timeout)
+        except Exception as e:
+            from app.ad_ops import log
+            log(f"DC SRV 探索失敗 ({name}): {e}")
+            return []
+        records = sorted(answers, key=lambda r: (r.priority, -r.weight))
+        return [str(r.target).rstrip('.') for r in records]
+
+    @staticmethod
+    def _merge(*lists):
+        merged = {}
+        for hosts in lists:
+            for host in hosts:
+                merged.setdefault(host.lower(), host)
+        return list(merged.values())
+
+    # --- 健康探測 ---
+
+    def _probe_host(self, host):
+        """以 TCP 連線時間估計延遲 (LDAPS 握手前的往返，不需要帳密)"""
+        address, port = _split_host(host)
+        started = time.perf_counter()
+        try:
+            with socket.create_connection((address, port), timeout=self.connect_timeout):
+                return time.perf_counter() - started
+        except OSError:
+            return None
+
+    def _probe_all(self):
+        try:
+            hosts = list(self.hosts)
+            if self.srv_discovery:
+                discovered = self._discover()
+                if discovered:
+                    hosts = self._merge(discovered, self._configured_hosts)
+            with ThreadPoolExecutor(max_workers=min(len(hosts), 8), thread_name_prefix='dc-probe') as executor:
+                results = dict(zip(hosts, executor.map(self._probe_host, hosts)))
+            now = time.monotonic()
+            with self._lock:
+                self.hosts = hosts
+                for host, seconds in results.items():
+                    if seconds is None:
+                        self._down_until[host] = now + self.down_time
+                        self._latency.pop(host, None)
+                    else:
+                        self._down_until.pop(host, None)
+                        self._latency[host] = seconds
+        finally:
+            with self._lock:
+                self._probing = False
+                self._probed_at = time.monotonic()
+
+    def _maybe_probe(self):
+        """量測結果過期時在背景重新量測 (不阻塞呼叫端)"""
+        if not self.multiple or not self.probe_interval:
+            return
+        with self._lock:
+            if self._probing or time.monotonic() - self._probed_at < self.probe_interval:
+                return
+            self._probing = True
+        threading.Thread(target=self._probe_all, name='dc-probe', daemon=True).start()
+
+    def mark_down(self, host):
+        with self._lock:
+            self._down_until[host] = time.monotonic() + self.down_time
+            self._latency.pop(host, None)
+        if host == self.pdc and not self._configured_pdc:
+            # PDC 離線時角色可能已經轉移，下次寫入前重新確認
+            self._pdc_checked = 0.0
+
+    # --- 選擇 ---
+
+    def candidates(self, route='read'):
+        """依路由排好的候選 DC：讀取依延遲 / 輪流，寫入把可用的 PDC 排第一；離線的 DC 排最後"""
+        self._maybe_probe()
+        now = time.monotonic()
+        with self._lock:
+            hosts = list(self.hosts)
+            up = [h for h in hosts if self._down_until.get(h, 0) <= now]
+            down = [h for h in hosts if h not in up]
+            if self.selection == 'latency':
+                # 還沒量到延遲的 DC 維持設定順序，排在已量測的後面
+                up.sort(key=lambda h: self._latency.get(h, float('inf')))
+            elif self.selection == 'round_robin' and up:
+                self._rr = (self._rr + 1) % len(up)
+                up = up[self._rr:] + up[:self._rr]
+        if route == 'write' and self.pdc:
+            # 只在 PDC 目前可用時排第一；離線 (或不在清單中) 時寫入照讀取的順序，不必每次先等它逾時
+            pdc = next((h for h in up if h.lower() == self.pdc.lower()), None)
+            if pdc is not None:
+                up = [pdc] + [h for h in up if h != pdc]
+        return up + down
+
+    def route_key(self, route):
+        """只有一台 DC 時讀寫共用同一組池化連線"""
+        return route if self.multiple else 'read'
+
+    def _get_server(self, host):
+        server = self._servers.get(host)
+        if server is None:
+            address, port = _split_host(host)
+            server = Server(address, port=port, use_ssl=True, tls=None, get_info=NONE,
+                            connect_timeout=self.connect_timeout)
+            self._servers[host] = server
+        return server
+
+    def server_for(self, server_addr, route='read'):
+        """
+        建立連線用的 ldap3 Server / ServerPool
+        server_addr 是設定的 AD_SERVER 時依 DC 清單選擇；其他位址 (例如指定單台) 直接連線
+        """
+        if not self.multiple or server_addr != self._server_setting:
+            return self._get_server(server_addr)
+        hosts = self.candidates(route)
+        # active=1：每次開啟連線最多把候選清單輪一次 (逐台檢查可否連線)，全部失敗才丟出例外
+        return ServerPool([self._get_server(h) for h in hosts], FIRST, active=1, exhaust=False)
+
+    def connected(self, pool, conn):
+        """連線成功後：排在實際連上那台之前的候選 DC 都被跳過了，標記為離線"""
+        if not isinstance(pool, ServerPool):
+            return
+        for server in pool.servers:
+            if server is conn.server:
+                break
+            self.mark_down(self._host_of(server))
+
+    def _host_of(self, server):
+        for host, candidate in self._servers.items():
+            if candidate is server:
+                return host
+        return server.host
+
+    def host_of(self, conn):
+        """連線目前所在的 DC (uSNChanged 等每台 DC 各自的計數器需要知道)"""
+        server = getattr(conn, 'server', None)
+        return self._host_of(server) if server is not None else None
+
+    # --- PDC ---
+
+    def needs_pdc(self):
+        return (self.multiple and not self._configured_pdc
+                and time.monotonic() - self._pdc_checked > PDC_REFRESH)
+
+    def resolve_pdc(self, conn):
+        """
+        由網域根目錄的 fSMORoleOwner (PDC 模擬器的 NTDS Settings) 找出 PDC 的 dNSHostName
+        找不到時不指定 PDC，寫入與讀取走相同的順序
+        """
+        self._pdc_checked = time.monotonic()
+        try:
+            conn.search(self._domain_root, '(objectClass=*)', search_scope=BASE, attributes=['fSMORoleOwner'])
+            if not conn.entries or 'fSMORoleOwner' not in conn.entries[0]:
+                return
+            ntds_dn = conn.entries[0].fSMORoleOwner.value
+            server_dn = ntds_dn.split(',', 1)[1]
+            conn.search(server_dn, '(objectClass=*)', search_scope=BASE, attributes=['dNSHostName'])
+            if conn.entries and 'dNSHostName' in conn.entries[0] and conn.entries[0].dNSHostName.value:
+                host = conn.entries[0].dNSHostName.value
+                known = next((h for h in self.hosts if _split_host(h)[0].lower() == host.lower()), host)
+                if known != self.pdc:
+                    from app.ad_ops import log
+                    log(f"PDC: {known}")
+                self.pdc = known
+        except Exception as e:
+            from app.ad_ops import log
+            log(f"無法解析 PDC: {e}")
+
+    def status(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{'host': h,
+                     'latency_ms': round(self._latency[h] * 1000, 2) if h in self._latency else None,
+                     'down': self._down_until.get(h, 0) > now,
+                     'pdc': h == self.pdc}
+                    for h in self.hosts]
+
+
+dc_locator = DomainControllerLocator()
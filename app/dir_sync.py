@@ -0,0 +1,372 @@
+# app/dir_sync.py
+import base64
+import heapq
+import json
+import os
+import threading
+import time
+from ldap3 import BASE, SUBTREE
+from ldap3.core.exceptions import LDAPNoSuchObjectResult
+from app.ad_ops import DIRECTORY_LISTINGS, LDAP_NO_SUCH_OBJECT, log, read_forest_root
+from app.ldap_pool import ldap_pool
+
+SHOW_DELETED_OID = '1.2.840.113556.1.4.417'  # LDAP_SERVER_SHOW_DELETED_OID：讓搜尋看得到 tombstone
+SNAPSHOT_VERSION = 1
+
+# 要鏡像的物件類型：users / groups / computers 沿用儀表板列表的定義，另外加上 DNS 節點
+MIRRORED_KINDS = {kind: {'filter': spec['filter'], 'attributes': spec['attributes']}
+                  for kind, spec in DIRECTORY_LISTINGS.items()}
+MIRRORED_KINDS['dns_nodes'] = {'filter': '(objectClass=dnsNode)', 'attributes': ['name', 'dnsRecord', 'dNSTombstoned']}
+
+
+class DirectoryMirror:
+    """
+    以 uSNChanged 增量同步的本機目錄鏡像 (MS 文件 "Polling for Changes Using USNChanged")
+    - 第一次 (或 DC 的 invocationId 改變時) 完整讀取一次
+    - 之後每輪只查 highestCommittedUSN 之間有變動的物件，成本與異動量成正比
+    - 刪除：以 Show Deleted 控制項查 isDeleted=TRUE 的 tombstone；DNS 節點的 dNSTombstoned=TRUE 也視為刪除
+    - uSNChanged 是每台 DC 各自的計數器；多台 DC 時若連線換到另一台 DC，invocationId 不同會自動重新完整同步
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 60
+        self.snapshot_path = None
+        self.highest_usn = 0
+        self.invocation_id = None
+        self.last_sync = None
+        self.last_error = None
+        self._objects = {kind: {} for kind in MIRRORED_KINDS}  # kind -> {objectGUID: row}
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._synced = threading.Condition()
+        self._generation = 0
+        self._running = False
+        self._thread = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 背景執行緒不會跟著 fork 複製，鎖也可能停在被持有的狀態：重建後在子行程重新啟動同步
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._synced = threading.Condition()
+        self._running = False
+        self._thread = None
+        if self.enabled:
+            self.start()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('DIRECTORY_MIRROR_ENABLED', False)
+        self.interval = app.config.get('DIRECTORY_SYNC_INTERVAL', self.interval)
+        self.snapshot_path = app.config.get('DIRECTORY_MIRROR_PATH')
+        self._server = app.config.get('AD_SERVER')
+        self._user = app.config.get('AD_USER')
+        self._password = app.config.get('AD_PASS')
+        self._page_size = app.config.get('LDAP_PAGE_SIZE', 500)
+        self._base_dn = app.config.get('AD_BASEDN') or ''
+        if 'dc=' in self._base_dn.lower():
+            self._domain_root = self._base_dn[self._base_dn.lower().find('dc='):]
+        else:
+            self._domain_root = self._base_dn
+        self._forest_root = None  # 第一次同步時由 rootDSE 的 rootDomainNamingContext 取得
+        if self.enabled:
+            self._load_snapshot()
+            self.start()
+
+    @property
+    def ready(self):
+        return self.enabled and self.invocation_id is not None
+
+    # --- 背景執行緒 ---
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='directory-mirror', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.sync_once()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def request_sync(self, wait=0):
+        """請背景執行緒立刻同步；wait > 0 時最多等待該秒數直到同步完成"""
+        if not self.enabled:
+            return
+        with self._synced:
+            # 若正在同步，這一輪可能沒包含剛剛的寫入，要等下一輪
+            target = self._generation + (2 if self._running else 1)
+        self._wakeup.set()
+        if wait:
+            with self._synced:
+                self._synced.wait_for(lambda: self._generation >= target, timeout=wait)
+
+    # --- 同步 ---
+
+    def sync_once(self):
+        with self._synced:
+            self._running = True
+        conn = None
+        try:
+            conn = ldap_pool.acquire(self._server, self._user, self._password)
+            if self._forest_root is None:
+                # ForestDnsZones 在樹系根網域底下，子網域的 AD_BASEDN 推不出來；讀不到時下一輪再試
+                self._forest_root = read_forest_root(conn)
+            highest_usn, invocation_id = self._read_watermark(conn)
+            if invocation_id != self.invocation_id or not self.highest_usn:
+                self._full_sync(conn, highest_usn, invocation_id)
+            elif highest_usn > self.highest_usn:
+                self._incremental_sync(conn, highest_usn)
+            self.last_sync = time.time()
+            self.last_error = None
+            ldap_pool.release(conn)
+        except Exception as e:
+            self.last_error = str(e)
+            log(f"同步失敗: {e}")
+            if conn is not None:
+                ldap_pool.release(conn, discard=True)
+        finally:
+            with self._synced:
+                self._running = False
+                self._generation += 1
+                self._synced.notify_all()
+
+    def _read_watermark(self, conn):
+        """讀取 RootDSE 的 highestCommittedUSN，以及這台 DC 的 invocationId"""
+        conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['highestCommittedUSN', 'dsServiceName'])
+        attrs = conn.response[0]['attributes']
+        highest_usn = int(_first(attrs.get('highestCommittedUSN')))
+        conn.search(_first(attrs.get('dsServiceName')), '(objectClass=*)', search_scope=BASE, attributes=['invocationId'])
+        invocation_id = _first(conn.response[0]['raw_attributes'].get('invocationId'))
+        return highest_usn, invocation_id.hex() if invocation_id else None
+
+    def _search_bases(self, kind):
+        if kind == 'dns_nodes':
+            return [f"DC=DomainDnsZones,{self._domain_root}",
+                    f"DC=ForestDnsZones,{self._forest_root or self._domain_root}",
+                    f"CN=MicrosoftDNS,CN=System,{self._domain_root}"]
+        return [self._base_dn]
+
+    def _naming_contexts(self):
+        return [self._domain_root,
+                f"DC=DomainDnsZones,{self._domain_root}",
+                f"DC=ForestDnsZones,{self._forest_root or self._domain_root}"]
+
+    def _paged(self, conn, base, search_filter, attributes, controls=None):
+        """
+        分頁讀取 base 底下的物件
+        - 只有不存在的分割區 (noSuchObject，例如沒有 ForestDnsZones) 會略過
+        - 其他錯誤 (DC 忙碌、timeLimitExceeded、連線中斷…) 一律丟出例外，
+          讓這一輪同步失敗，保留上一次的 USN 水位與鏡像，下一輪重試
+        """
+        try:
+            for resp in conn.extend.standard.paged_search(base, search_filter, search_scope=SUBTREE,
+                                                          attributes=attributes, controls=controls,
+                                                          paged_size=self._page_size, generator=True):
+                if resp.get('type') == 'searchResEntry':
+                    yield resp
+        except LDAPNoSuchObjectResult:
+            log(f"略過不存在的分割區 {base}")
+            return
+        # paged_search(generator=True) 遇到非 0 的結果碼不會丟例外，要自己檢查最後一頁的結果
+        code = (conn.result or {}).get('result')
+        if code == LDAP_NO_SUCH_OBJECT:
+            log(f"略過不存在的分割區 {base}")
+        elif code:
+            raise RuntimeError(f"讀取 {base} 失敗: {conn.result.get('description')} ({code})")
+
+    def _full_sync(self, conn, highest_usn, invocation_id):
+        started = time.monotonic()
+        objects = {kind: {} for kind in MIRRORED_KINDS}
+        for kind, spec in MIRRORED_KINDS.items():
+            attributes = spec['attributes'] + ['objectGUID']
+            for base in self._search_bases(kind):
+                for resp in self._paged(conn, base, spec['filter'], attributes):
+                    guid = _guid(resp)
+                    row = _to_row(kind, resp)
+                    if guid and row is not None:
+                        objects[kind][guid] = row
+        with self._lock:
+            self._objects = objects
+            self.highest_usn = highest_usn
+            self.invocation_id = invocation_id
+        self._save_snapshot()
+        log(f"完整同步完成：{ {k: len(v) for k, v in objects.items()} }，耗時 {time.monotonic() - started:.1f}s")
+
+    def _incremental_sync(self, conn, highest_usn):
+        low = self.highest_usn + 1
+        usn_range = f"(uSNChanged>={low})(uSNChanged<={highest_usn})"
+        # 先讀完所有分割區再一次套用：中途失敗時鏡像與 USN 水位都維持上一輪的狀態
+        updates = []  # (kind, guid, row)；row 為 None 表示移除
+        deleted = []
+
+        for kind, spec in MIRRORED_KINDS.items():
+            attributes = spec['attributes'] + ['objectGUID']
+            # users / groups / computers 從網域根目錄查，才能發現被移出 base DN 的物件
+            bases = self._search_bases(kind) if kind == 'dns_nodes' else [self._domain_root]
+            for base in bases:
+                for resp in self._paged(conn, base, f"(&{spec['filter']}{usn_range})", attributes):
+                    guid = _guid(resp)
+                    if not guid:
+                        continue
+                    row = _to_row(kind, resp)
+                    in_scope = kind == 'dns_nodes' or resp['dn'].lower().endswith(self._base_dn.lower())
+                    updates.append((kind, guid, row if in_scope else None))
+
+        # 已刪除的物件 (tombstone)
+        show_deleted = [(SHOW_DELETED_OID, True, None)]
+        for base in self._naming_contexts():
+            for resp in self._paged(conn, base, f"(&(isDeleted=TRUE){usn_range})", ['objectGUID'], controls=show_deleted):
+                deleted.append(_guid(resp))
+
+        with self._lock:
+            for kind, guid, row in updates:
+                if row is None:
+                    self._objects[kind].pop(guid, None)
+                else:
+                    self._objects[kind][guid] = row
+            for guid in deleted:
+                for rows in self._objects.values():
+                    rows.pop(guid, None)
+            self.highest_usn = highest_usn
+        changed = len(updates) + len(deleted)
+        if changed:
+            self._save_snapshot()
+            log(f"增量同步：USN {low}-{highest_usn}，{changed} 筆異動")
+
+    # --- 快照 (重啟後從上次的 USN 接續，不必完整重讀) ---
+
+    def _save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        with self._lock:
+            data = {
+                'version': SNAPSHOT_VERSION,
+                'invocation_id': self.invocation_id,
+                'highest_usn': self.highest_usn,
+                'objects': {kind: {guid: _encode_row(row) for guid, row in rows.items()}
+                            for kind, rows in self._objects.items()},
+            }
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            log(f"寫入快照失敗: {e}")
+
+    def _load_snapshot(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != SNAPSHOT_VERSION:
+                return
+            objects = {kind: {} for kind in MIRRORED_KINDS}
+            for kind, rows in data['objects'].items():
+                if kind in objects:
+                    objects[kind] = {guid: _decode_row(row) for guid, row in rows.items()}
+            with self._lock:
+                self._objects = objects
+                self.highest_usn = data['highest_usn']
+                self.invocation_id = data['invocation_id']
+        except Exception as e:
+            log(f"讀取快照失敗，將重新完整同步: {e}")
+
+    # --- 查詢 ---
+
+    def query_page(self, kind, page, per_page, sort, desc, q, searchable):
+        """與 ad_ops.query_directory_page 相同的回傳格式，但完全在記憶體中完成"""
+        with self._lock:
+            rows = list(self._objects[kind].values())
+        if q:
+            prefix = q.lower()
+            rows = [row for row in rows
+                    if any(str(row.get(attr) or '').lower().startswith(prefix) for attr in searchable)]
+
+        def sort_key(row):
+            value = row.get(sort)
+            return (str(value).lower() if value is not None else '', row['dn'].lower())
+
+        pick = heapq.nlargest if desc else heapq.nsmallest
+        top = pick(page * per_page, rows, key=sort_key)
+        total = len(rows)
+        return {
+            'items': top[(page - 1) * per_page:],
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': max((total + per_page - 1) // per_page, 1),
+            'sort': sort,
+            'desc': desc,
+            'q': q,
+            'mode': 'mirror',
+        }
+
+    def dns_nodes_in_zone(self, zone_dn):
+        zone_dn = zone_dn.lower()
+        with self._lock:
+            return [row for row in self._objects['dns_nodes'].values() if row['zone_dn'].lower() == zone_dn]
+
+    def status(self):
+        with self._lock:
+            counts = {kind: len(rows) for kind, rows in self._objects.items()}
+        return {
+            'enabled': self.enabled,
+            'ready': self.ready,
+            'highest_usn': self.highest_usn,
+            'last_sync': self.last_sync,
+            'last_error': self.last_error,
+            'counts': counts,
+        }
+
+
+def _first(values):
+    if isinstance(values, list):
+        return values[0] if values else None
+    return values
+
+
+def _guid(resp):
+    values = resp['raw_attributes'].get('objectGUID')
+    return values[0].hex() if values else None
+
+
+def _to_row(kind, resp):
+    """把搜尋結果轉成鏡像列；DNS 節點已 tombstone 時回傳 None"""
+    attrs = resp['attributes']
+    row = {'dn': resp['dn']}
+    if kind == 'dns_nodes':
+        if str(_first(attrs.get('dNSTombstoned'))).upper() == 'TRUE':
+            return None
+        row['name'] = str(_first(attrs.get('name')) or '')
+        row['zone_dn'] = resp['dn'].split(',', 1)[1] if ',' in resp['dn'] else ''
+        row['dnsRecord'] = list(resp['raw_attributes'].get('dnsRecord') or [])
+        return row
+    for attr in MIRRORED_KINDS[kind]['attributes']:
+        value = attrs.get(attr)
+        if isinstance(value, list):
+            value = value[0] if len(value) == 1 else (value or None)
+        if attr == 'userAccountControl' and value is not None:
+            value = int(value)
+        row[attr] = value
+    return row
+
+
+def _encode_row(row):
+    if 'dnsRecord' in row:
+        row = dict(row, dnsRecord=[base64.b64encode(v).decode('ascii') for v in row['dnsRecord']])
+    return row
+
+
+def _decode_row(row):
+    if 'dnsRecord' in row:
+        row['dnsRecord'] = [base64.b64decode(v) for v in row['dnsRecord']]
+    return row
+
+
+directory_mirror = DirectoryMirror()
@@ -0,0 +1,96 @@
+# app/directory_export.py
+# 串流匯出使用者 / 群組 (含成員) / 電腦：直接由分頁搜尋逐頁產生資料列，
+# 回應一開始就有位元組送出，worker 記憶體用量與物件數無關 (只保留一頁 + 一個輸出區塊)
+import csv
+import io
+import json
+from flask import current_app
+from app.ad_ops import DIRECTORY_LISTINGS, get_ad_connection, get_ranged_values, paged_search, _listing_filter
+from app.uac import is_enabled
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 64 * 1024  # 累積到這個大小才送出一塊 (避免每列一個 chunk)
+
+# 各類型的匯出欄位：(欄位名稱, 取值函式)；attributes 是實際向 DC 要求的屬性
+EXPORT_KINDS = {
+    'users': {
+        'attributes': ['sAMAccountName', 'displayName', 'userPrincipalName', 'mail', 'userAccountControl'],
+        'columns': ['sAMAccountName', 'displayName', 'userPrincipalName', 'mail', 'enabled', 'dn'],
+    },
+    'groups': {
+        'attributes': ['cn', 'description', 'member'],
+        'columns': ['cn', 'description', 'members', 'dn'],
+    },
+    'computers': {
+        'attributes': ['cn', 'dNSHostName', 'operatingSystem', 'userAccountControl'],
+        'columns': ['cn', 'dNSHostName', 'operatingSystem', 'enabled', 'dn'],
+    },
+}
+
+
+def _value(entry, attribute):
+    return entry[attribute].value if attribute in entry else None
+
+
+def _export_row(kind, conn, entry):
+    row = {}
+    for attribute in EXPORT_KINDS[kind]['attributes']:
+        if attribute == 'userAccountControl':
+            row['enabled'] = is_enabled(_value(entry, attribute))
+        elif attribute == 'member':
+            members = list(entry.member.values) if 'member' in entry else []
+            if any(';range=' in name for name in entry.entry_raw_attributes):
+                members = get_ranged_values(conn, entry.entry_dn, 'member')
+            row['members'] = members
+        else:
+            row[attribute] = _value(entry, attribute)
+    row['dn'] = entry.entry_dn
+    return row
+
+
+def _csv_text(row, columns):
+    out = io.StringIO()
+    values = []
+    for column in columns:
+        value = row.get(column)
+        if isinstance(value, list):
+            value = ';'.join(value)
+        elif isinstance(value, bool):
+            value = 'TRUE' if value else 'FALSE'
+        values.append('' if value is None else value)
+    csv.writer(out).writerow(values)
+    return out.getvalue()
+
+
+def iter_export_rows(kind, q=None):
+    """逐筆產生匯出資料列 (dict)，q 與儀表板列表的搜尋相同 (前綴比對)"""
+    conn = get_ad_connection()
+    base_dn = current_app.config.get('AD_BASEDN')
+    search_filter = _listing_filter(DIRECTORY_LISTINGS[kind], q)
+    # 匯出要完整：不套用 LDAP_MAX_RESULTS (分頁搜尋本來就只保留一頁在記憶體)
+    for entry in paged_search(conn, base_dn, search_filter, attributes=EXPORT_KINDS[kind]['attributes'],
+                              max_results=0):
+        yield _export_row(kind, conn, entry)
+
+
+def export_directory(kind, fmt='csv', q=None):
+    """
+    串流匯出，逐塊 yield 文字 (CSV 第一列為欄位名稱；JSONL 每列一個 JSON 物件)
+    標頭立刻送出，之後每累積 EXPORT_CHUNK_SIZE 才送一塊
+    """
+    columns = EXPORT_KINDS[kind]['columns']
+    if fmt == 'csv':
+        # BOM 讓 Excel 以 UTF-8 開啟中文欄位
+        yield '\ufeff' + _csv_text({c: c for c in columns}, columns)
+    buffer, size = [], 0
+    threshold = EXPORT_CHUNK_SIZE if fmt == 'csv' else 1  # JSONL 沒有標頭，第一筆讀到就先送出
+    for row in iter_export_rows(kind, q):
+        line = _csv_text(row, columns) if fmt == 'csv' else json.dumps(row, ensure_ascii=False) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= threshold:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+            threshold = EXPORT_CHUNK_SIZE
+    if buffer:
+        yield ''.join(buffer)
@@ -0,0 +1,347 @@
+# app/dns_bulk.py
+# DNS 區域批次匯出 / 匯入：匯出為 BIND zone file 或 CSV，匯入時與現有紀錄比對只送出差異
+import csv
+import io
+import re
+import time
+from datetime import datetime
+from ldap3 import MODIFY_ADD, MODIFY_DELETE, MODIFY_REPLACE
+from app.ad_ops import get_ad_connection, paged_search, log, HIDDEN_DNS_NAMES, _dns_records_tag, _after_write
+from app.bulk_ops import run_in_lanes, _summarize
+from app.dns_codec import decode_record, make_record, DnsCodecError, DEFAULT_TTL
+
+# 可匯出 / 匯入的紀錄類型 (SOA 由 DNS 伺服器維護，不經由檔案修改)
+MANAGED_TYPES = ('A', 'AAAA', 'CNAME', 'MX', 'TXT', 'SRV', 'PTR', 'NS')
+ZONE_FILE_FORMATS = ('bind', 'csv')
+ZONE_CSV_FIELDS = ('name', 'type', 'ttl', 'value')
+
+
+class ZoneFileError(Exception):
+    """zone file / CSV 無法解析"""
+
+
+def zone_name_from_dn(zone_dn):
+    """DC=corp.local,CN=MicrosoftDNS,... -> corp.local"""
+    return zone_dn.split(',', 1)[0].split('=', 1)[-1].strip()
+
+def detect_zone_format(filename):
+    return 'csv' if (filename or '').lower().endswith('.csv') else 'bind'
+
+def _is_protected(name):
+    """系統保留名稱 (@、DomainDnsZones 與底線開頭的 SRV 紀錄) 不匯出也不允許匯入"""
+    return name.lower() in HIDDEN_DNS_NAMES or name.startswith('_')
+
+
+# --- 讀取現有紀錄 ---
+
+def _decode(raw):
+    try:
+        return decode_record(raw)
+    except (DnsCodecError, ValueError, IndexError):
+        return None
+
+def iter_zone_nodes(conn, zone_dn):
+    """逐一 yield 區域內的 dnsNode：(name, dn, [(raw, DnsRecord)])，無法解碼的值 DnsRecord 為 None"""
+    search_filter = '(&(objectClass=dnsNode)(!(dNSTombstoned=TRUE)))'
+    for entry in paged_search(conn, zone_dn, search_filter, attributes=['name', 'dnsRecord']):
+        # name 與 RDN (DC=<name>) 相同，少數情況下沒有回傳 name 時改從 DN 取
+        name = str(entry.name.value or '').strip() or entry.entry_dn.split(',', 1)[0].split('=', 1)[-1]
+        values = entry.dnsRecord.raw_values if 'dnsRecord' in entry else []
+        yield name, entry.entry_dn, [(bytes(raw), _decode(raw)) for raw in values]
+
+def _is_managed(record):
+    return record is not None and record.type in MANAGED_TYPES
+
+def iter_zone_records(conn, zone_dn):
+    """逐筆 yield 可管理的紀錄 (name, DnsRecord) (依 LDAP 回傳順序)"""
+    for name, _, values in iter_zone_nodes(conn, zone_dn):
+        if _is_protected(name):
+            continue
+        for _, record in values:
+            if _is_managed(record):
+                yield name, record
+
+
+# --- 匯出 ---
+
+def export_zone(zone_dn, fmt='bind'):
+    """
+    串流匯出區域內的紀錄，逐行 yield 文字
+    (分頁搜尋一次只保留一頁在記憶體，大區域也不必先組出整份檔案)
+    RDATA 內的名稱一律寫成絕對名稱 (結尾加點)，匯入時不會再被接上 origin
+    """
+    conn = get_ad_connection()
+    zone_name = zone_name_from_dn(zone_dn)
+    if fmt == 'csv':
+        yield ','.join(ZONE_CSV_FIELDS) + '\r\n'
+        for name, record in iter_zone_records(conn, zone_dn):
+            yield _csv_line([name, record.type, record.ttl, record.to_text(absolute=True)])
+        return
+
+    yield f"; zone: {zone_name}\n"
+    yield f"; exported: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+    yield f"$ORIGIN {zone_name}.\n"
+    for name, record in iter_zone_records(conn, zone_dn):
+        yield f"{name:<24} {record.ttl:<7} IN {record.type:<6} {record.to_text(absolute=True)}\n"
+
+def _csv_line(values):
+    out = io.StringIO()
+    csv.writer(out).writerow(values)
+    return out.getvalue()
+
+
+# --- 解析匯入檔 ---
+
+def _valid_label(label):
+    stripped = label.replace('-', '')
+    return 0 < len(label) <= 63 and stripped.isascii() and stripped.isalnum()
+
+def _relative_name(name, origin, zone_name):
+    """把 zone file 中的名稱轉成相對於區域的名稱，不屬於此區域時回傳 None"""
+    fqdn = (name if name.endswith('.') else f"{name}.{origin}").rstrip('.')
+    zone = zone_name.rstrip('.').lower()
+    if fqdn.lower() == zone:
+        return '@'
+    if fqdn.lower().endswith('.' + zone):
+        return fqdn[:len(fqdn) - len(zone) - 1]
+    return None
+
+def _strip_comment(line):
+    """去掉 ; 之後的註解 (引號內的 ; 不算)"""
+    quoted = escaped = False
+    for idx, char in enumerate(line):
+        if escaped:
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == '"':
+            quoted = not quoted
+        elif char == ';' and not quoted:
+            return line[:idx]
+    return line
+
+def parse_zone_file(stream, zone_name, fmt='bind'):
+    """
+    解析匯入檔，回傳 (records, errors, skipped)
+    - bind：支援 $ORIGIN / $TTL、省略名稱 (沿用上一行)、省略 TTL / class
+    - csv：欄位 name,type,ttl,value (ttl 可留空，value 為 zone file 格式的 RDATA)
+    只處理 MANAGED_TYPES，其他類型計入 skipped
+    records: [{'line', 'name', 'type', 'ttl', 'value', 'record'}]
+    """
+    records, errors, skipped = [], [], 0
+    origin = zone_name.rstrip('.') + '.'
+    default_ttl = DEFAULT_TTL
+
+    def add(line_no, name, rtype, ttl, rdata):
+        relative = _relative_name(name, origin, zone_name)
+        if relative is None:
+            errors.append(f"第 {line_no} 行: {name} 不屬於區域 {zone_name}")
+        elif _is_protected(relative):
+            errors.append(f"第 {line_no} 行: {relative} 是系統保留名稱")
+        elif not all(_valid_label(label) for label in relative.split('.')):
+            errors.append(f"第 {line_no} 行: 名稱 {relative} 包含非法字元")
+        elif not 0 <= ttl <= 0x7FFFFFFF:
+            errors.append(f"第 {line_no} 行: TTL {ttl} 超出範圍")
+        else:
+            try:
+                record = make_record(rtype, rdata, ttl, origin)
+            except DnsCodecError as e:
+                errors.append(f"第 {line_no} 行: {e}")
+                return
+            records.append({'line': line_no, 'name': relative, 'type': record.type, 'ttl': ttl,
+                            'value': record.to_text(), 'record': record})
+
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if not reader.fieldnames:
+            raise ZoneFileError("CSV 檔案是空的")
+        reader.fieldnames = [(name or '').strip().lower() for name in reader.fieldnames]
+        missing = [f for f in ('name', 'type', 'value') if f not in reader.fieldnames]
+        if missing:
+            raise ZoneFileError(f"CSV 缺少欄位: {', '.join(missing)}")
+        for row in reader:
+            name = (row.get('name') or '').strip()
+            rtype = (row.get('type') or '').strip().upper()
+            value = (row.get('value') or '').strip()
+            if not (name or rtype or value):
+                continue
+            if rtype not in MANAGED_TYPES:
+                skipped += 1
+                continue
+            ttl_text = (row.get('ttl') or '').strip()
+            if ttl_text and not ttl_text.isdigit():
+                errors.append(f"第 {reader.line_num} 行: TTL {ttl_text} 不是數字")
+                continue
+            add(reader.line_num, name, rtype, int(ttl_text) if ttl_text else default_ttl, value)
+        return records, errors, skipped
+
+    last_name = None
+    for line_no, raw_line in enumerate(stream, start=1):
+        line = _strip_comment(raw_line).rstrip()
+        if not line.strip():
+            continue
+        # 保留每個欄位在行內的位置，RDATA 取型別之後的整段原文 (TXT 可能含空白與引號)
+        fields = list(re.finditer(r'\S+', line))
+        directive = fields[0].group().upper()
+        if directive == '$ORIGIN' and len(fields) > 1:
+            value = fields[1].group()
+            origin = value if value.endswith('.') else f"{value}.{origin}"
+            continue
+        if directive == '$TTL' and len(fields) > 1:
+            if not fields[1].group().isdigit():
+                errors.append(f"第 {line_no} 行: $TTL {fields[1].group()} 不是數字")
+            else:
+                default_ttl = int(fields[1].group())
+            continue
+        if directive.startswith('$'):
+            errors.append(f"第 {line_no} 行: 不支援的指令 {fields[0].group()}")
+            continue
+
+        if line[0].isspace():
+            name = last_name
+        else:
+            name, fields = fields[0].group(), fields[1:]
+            last_name = name
+        if name is None:
+            errors.append(f"第 {line_no} 行: 缺少名稱")
+            continue
+
+        ttl = default_ttl
+        while fields and (fields[0].group().isdigit() or fields[0].group().upper() in ('IN', 'CH', 'HS')):
+            if fields[0].group().isdigit():
+                ttl = int(fields[0].group())
+            fields = fields[1:]
+        if len(fields) < 2:
+            errors.append(f"第 {line_no} 行: 無法解析")
+            continue
+        rtype = fields[0].group().upper()
+        if rtype not in MANAGED_TYPES:
+            skipped += 1
+            continue
+        add(line_no, name, rtype, ttl, line[fields[1].start():].strip())
+    return records, errors, skipped
+
+
+# --- 差異比對 ---
+
+def _check_conflicts(records):
+    """同一名稱不能同時有 CNAME 與其他紀錄，也不能有多筆 CNAME"""
+    errors = []
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record['name'].lower(), []).append(record)
+    for items in by_name.values():
+        cnames = {r['value'].lower() for r in items if r['type'] == 'CNAME'}
+        if cnames and (len(cnames) > 1 or any(r['type'] != 'CNAME' for r in items)):
+            errors.append(f"第 {items[0]['line']} 行: {items[0]['name']} 的 CNAME 不能與其他紀錄並存")
+    return errors
+
+def plan_zone_import(conn, zone_dn, records, prune=False):
+    """
+    與區域現有紀錄比對，回傳要執行的節點變更
+    - 檔案中的名稱：補上缺少的紀錄、移除檔案中沒有的紀錄 (TTL 不同視為替換)
+    - prune=True 時，檔案中沒出現的名稱其紀錄也一併移除
+    - 不在 MANAGED_TYPES 內 (例如 SOA) 或無法解碼的值一律保留
+    """
+    desired = {}
+    for record in records:
+        node = desired.setdefault(record['name'].lower(), {'name': record['name'], 'records': {}})
+        node['records'][record['record'].key()] = record
+
+    changes = []
+    seen = set()
+    for name, dn, values in iter_zone_nodes(conn, zone_dn):
+        key = name.lower()
+        if _is_protected(name):
+            continue
+        managed = {record.key(): (raw, record) for raw, record in values if _is_managed(record)}
+        others = len(values) - len(managed)
+        if key not in desired:
+            if prune and managed:
+                changes.append(_node_change(name, dn, [], list(managed.values()), delete_node=not others))
+            continue
+        seen.add(key)
+        wanted = desired[key]['records']
+        adds = [r for k, r in wanted.items() if k not in managed or managed[k][1].ttl != r['ttl']]
+        deletes = [v for k, v in managed.items() if k not in wanted or wanted[k]['ttl'] != v[1].ttl]
+        if adds or deletes:
+            changes.append(_node_change(name, dn, adds, deletes))
+
+    zone_suffix = ',' + zone_dn
+    for key, node in desired.items():
+        if key not in seen:
+            changes.append(_node_change(node['name'], f"DC={node['name']}{zone_suffix}",
+                                        list(node['records'].values()), [], create_node=True))
+    changes.sort(key=lambda c: c['ident']['name'].lower())
+    return changes
+
+def _describe(record):
+    return f"{record.type} {record.to_text()} (TTL {record.ttl})"
+
+def _node_change(name, dn, adds, deletes, create_node=False, delete_node=False):
+    action = 'add' if create_node else ('delete' if delete_node else 'update')
+    return {
+        'ident': {'name': name, 'action': action},
+        'dn': dn,
+        'add_values': [r['record'].encode() for r in adds],
+        'delete_values': [raw for raw, _ in deletes],
+        'added': [_describe(r['record']) for r in adds],
+        'removed': [_describe(record) for _, record in deletes],
+    }
+
+
+# --- 寫入 ---
+
+def _apply_node_change(conn, change):
+    """在指定連線上套用一個節點的變更，回傳單筆結果"""
+    result = dict(change['ident'], success=False, message='')
+    action = change['ident']['action']
+    if action == 'delete':
+        ok = conn.delete(change['dn'])
+    elif action == 'add':
+        attrs = {'objectClass': ['top', 'dnsNode'], 'dnsRecord': change['add_values'], 'dNSTombstoned': 'FALSE'}
+        ok = conn.add(change['dn'], attributes=attrs)
+        if not ok and conn.result.get('result') == 68:
+            # 同名的 tombstone 節點仍在 (DNS 刪除後 AD 會保留一段時間)，改為直接覆寫
+            ok = conn.modify(change['dn'], {'dnsRecord': [(MODIFY_REPLACE, change['add_values'])],
+                                            'dNSTombstoned': [(MODIFY_REPLACE, ['FALSE'])]})
+    else:
+        ops = []
+        if change['delete_values']:
+            ops.append((MODIFY_DELETE, change['delete_values']))
+        if change['add_values']:
+            ops.append((MODIFY_ADD, change['add_values']))
+        ok = conn.modify(change['dn'], {'dnsRecord': ops})
+    result['success'] = bool(ok)
+    result['message'] = '完成' if ok else f"失敗: {conn.result['description']}"
+    return result
+
+def import_zone(zone_dn, records, prune=False, dry_run=False, workers=None, job=None):
+    """
+    把解析後的紀錄以差異方式套用到區域 (需在 app context 內呼叫；job 為背景工作時回報進度、可被取消)
+    回傳報告：{'zone', 'total', 'adds', 'updates', 'deletes', 'changes', 'errors', 'results',
+              'succeeded', 'failed', 'elapsed', 'rate', 'workers', 'dry_run'}
+    """
+    started = time.monotonic()
+    report = {'zone': zone_name_from_dn(zone_dn), 'total': 0, 'adds': 0, 'updates': 0, 'deletes': 0,
+              'changes': [], 'errors': _check_conflicts(records), 'results': [], 'succeeded': 0, 'failed': 0,
+              'elapsed': 0.0, 'rate': 0.0, 'workers': 0, 'dry_run': dry_run}
+    if report['errors']:
+        return report
+
+    conn = get_ad_connection(write=True)  # 差異比對與寫入在同一台 DC 上進行
+    changes = plan_zone_import(conn, zone_dn, records, prune=prune)
+    report['total'] = len(changes)
+    for change in changes:
+        report[change['ident']['action'] + 's'] += 1
+    report['changes'] = [dict(c['ident'], added=c['added'], removed=c['removed']) for c in changes]
+    if dry_run or not changes:
+        report['elapsed'] = round(time.monotonic() - started, 3)
+        return report
+
+    results, workers = run_in_lanes(changes, _apply_node_change, workers, job)
+    _summarize(report, results, workers, started)
+    log(f"DNS 匯入完成 {report['zone']}: {report['succeeded']}/{report['total']} 個節點，{report['elapsed']} 秒")
+    if report['succeeded']:
+        _after_write(_dns_records_tag(zone_dn))
+    return report
@@ -0,0 +1,322 @@
+# app/dns_codec.py
+# MS-DNSP DNS_RECORD (AD 的 dnsRecord 屬性值) 編碼與解碼
+#
+#  0       2       4   5   6       8               12              16              20              24
+#  +-------+-------+---+---+-------+---------------+---------------+---------------+---------------+---------
+#  |DataLen| Type  |Ver|Rnk| Flags |    Serial     | TTL (big-end) |   Reserved    |   TimeStamp   | Data ...
+#  +-------+-------+---+---+-------+---------------+---------------+---------------+---------------+---------
+#  除了 TTL 與 RDATA 內的數值 (MX / SRV / SOA) 是網路位元組順序，其餘欄位皆為 little-endian
+import shlex
+import socket
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+RECORD_TYPES = {'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'AAAA': 28, 'SRV': 33}
+TYPE_NAMES = {code: name for name, code in RECORD_TYPES.items()}
+
+DNS_RECORD_VERSION = 5
+RANK_ZONE = 0xF0          # 區域權威資料 (DNS 管理工具建立的紀錄)
+DEFAULT_TTL = 3600
+HEADER_SIZE = 24
+
+_HEADER = struct.Struct('<HHBBHI')  # DataLength, Type, Version, Rank, Flags, Serial
+_TTL = struct.Struct('>I')
+_TAIL = struct.Struct('<II')        # Reserved, TimeStamp (自 1601-01-01 起的小時數，0 = 靜態紀錄)
+_U16 = struct.Struct('>H')
+_SRV = struct.Struct('>HHH')
+_SOA = struct.Struct('>IIIII')
+_TIMESTAMP_EPOCH = datetime(1601, 1, 1)
+
+
+class DnsCodecError(ValueError):
+    """dnsRecord 值格式錯誤或無法編碼"""
+
+
+# 各類型的 RDATA；A / AAAA / NS / CNAME / PTR 直接是字串，TXT 是字串 tuple，未知類型保留原始 bytes
+MXData = namedtuple('MXData', 'preference exchange')
+SRVData = namedtuple('SRVData', 'priority weight port target')
+SOAData = namedtuple('SOAData', 'serial refresh retry expire minimum primary admin')
+
+
+class DnsRecord:
+    """一個 dnsRecord 值 (同一個 dnsNode 可以有多個)"""
+    __slots__ = ('type_id', 'rdata', 'ttl', 'serial', 'timestamp', 'rank', 'flags')
+
+    def __init__(self, type_id, rdata, ttl=DEFAULT_TTL, serial=0, timestamp=0, rank=RANK_ZONE, flags=0):
+        self.type_id = type_id
+        self.rdata = rdata
+        self.ttl = ttl
+        self.serial = serial
+        self.timestamp = timestamp
+        self.rank = rank
+        self.flags = flags
+
+    @property
+    def type(self):
+        return TYPE_NAMES.get(self.type_id, f"TYPE{self.type_id}")
+
+    @property
+    def is_static(self):
+        return self.timestamp == 0
+
+    @property
+    def aged_at(self):
+        """動態紀錄最後一次更新的時間 (scavenging 依據)，靜態紀錄回傳 None"""
+        return None if self.is_static else _TIMESTAMP_EPOCH + timedelta(hours=self.timestamp)
+
+    def to_text(self, absolute=False):
+        """
+        RDATA 的文字表示 (zone file 格式)
+        absolute=True 時名稱加上結尾的點，可直接寫進 $ORIGIN 不同的 zone file
+        """
+        dot = '.' if absolute else ''
+        rdata = self.rdata
+        if self.type_id in (1, 28):
+            return rdata
+        if self.type_id in (2, 5, 12):
+            return rdata + dot
+        if self.type_id == 15:
+            return f"{rdata.preference} {rdata.exchange}{dot}"
+        if self.type_id == 33:
+            return f"{rdata.priority} {rdata.weight} {rdata.port} {rdata.target}{dot}"
+        if self.type_id == 16:
+            return ' '.join('"%s"' % s.replace('\\', '\\\\').replace('"', '\\"') for s in rdata)
+        if self.type_id == 6:
+            return (f"{rdata.primary}{dot} {rdata.admin}{dot} {rdata.serial} {rdata.refresh} "
+                    f"{rdata.retry} {rdata.expire} {rdata.minimum}")
+        return f"\\# {len(rdata)} {bytes(rdata).hex()}"  # RFC 3597 未知類型
+
+    def key(self):
+        """比對用：同類型且 RDATA 相同即視為同一筆 (名稱不分大小寫)"""
+        return self.type, self.to_text().lower()
+
+    def to_dict(self):
+        aged_at = self.aged_at
+        return {
+            'type': self.type,
+            'value': self.to_text(),
+            'ttl': self.ttl,
+            'serial': self.serial,
+            'static': self.is_static,
+            'timestamp': aged_at.isoformat() if aged_at else None,
+        }
+
+    def encode(self):
+        encoder = _ENCODERS.get(self.type_id)
+        if encoder is None:
+            if not isinstance(self.rdata, (bytes, bytearray, memoryview)):
+                raise DnsCodecError(f"不支援的紀錄類型: {self.type}")
+            data = bytes(self.rdata)
+        else:
+            data = encoder(self.rdata)
+        try:
+            return (_HEADER.pack(len(data), self.type_id, DNS_RECORD_VERSION, self.rank, self.flags, self.serial)
+                    + _TTL.pack(self.ttl) + _TAIL.pack(0, self.timestamp) + data)
+        except struct.error as e:
+            raise DnsCodecError(f"無法編碼 {self.type} 紀錄: {e}")
+
+    def __repr__(self):
+        return f"DnsRecord({self.type} {self.to_text()!r} ttl={self.ttl})"
+
+
+# --- 名稱 (DNS_COUNT_NAME：[總長度][標籤數][長度+標籤]...[0]) ---
+
+def _decode_name(mv, pos, end):
+    """回傳 (名稱, 下一個位置)"""
+    if pos + 2 > end:
+        raise DnsCodecError("名稱長度不足")
+    label_count = mv[pos + 1]
+    pos += 2
+    labels = []
+    for _ in range(label_count):
+        if pos >= end:
+            raise DnsCodecError("名稱標籤數與資料不符")
+        size = mv[pos]
+        if pos + 1 + size > end:
+            raise DnsCodecError("名稱標籤超出資料範圍")
+        labels.append(bytes(mv[pos + 1:pos + 1 + size]).decode('utf-8', 'replace'))
+        pos += 1 + size
+    if pos < end and mv[pos] == 0:
+        pos += 1
+    return '.'.join(labels), pos
+
+def _encode_name(name):
+    labels = [label for label in name.strip().rstrip('.').split('.') if label]
+    raw = bytearray()
+    for label in labels:
+        encoded = label.encode('utf-8')
+        if len(encoded) > 63:
+            raise DnsCodecError(f"標籤過長 (上限 63 bytes): {label}")
+        raw.append(len(encoded))
+        raw += encoded
+    raw.append(0)
+    if len(raw) > 255:
+        raise DnsCodecError(f"名稱過長 (上限 255 bytes): {name}")
+    return bytes((len(raw), len(labels))) + raw
+
+
+# --- 各類型 RDATA ---
+
+def _decode_a(mv, pos, end):
+    if end - pos < 4:
+        raise DnsCodecError("A 紀錄長度不足")
+    return socket.inet_ntop(socket.AF_INET, mv[pos:pos + 4])
+
+def _decode_aaaa(mv, pos, end):
+    if end - pos < 16:
+        raise DnsCodecError("AAAA 紀錄長度不足")
+    return socket.inet_ntop(socket.AF_INET6, mv[pos:pos + 16])
+
+def _decode_name_only(mv, pos, end):
+    return _decode_name(mv, pos, end)[0]
+
+def _decode_mx(mv, pos, end):
+    if end - pos < 2:
+        raise DnsCodecError("MX 紀錄長度不足")
+    return MXData(_U16.unpack_from(mv, pos)[0], _decode_name(mv, pos + 2, end)[0])
+
+def _decode_srv(mv, pos, end):
+    if end - pos < 6:
+        raise DnsCodecError("SRV 紀錄長度不足")
+    priority, weight, port = _SRV.unpack_from(mv, pos)
+    return SRVData(priority, weight, port, _decode_name(mv, pos + 6, end)[0])
+
+def _decode_txt(mv, pos, end):
+    strings = []
+    while pos < end:
+        size = mv[pos]
+        if pos + 1 + size > end:
+            raise DnsCodecError("TXT 字串超出資料範圍")
+        strings.append(bytes(mv[pos + 1:pos + 1 + size]).decode('utf-8', 'replace'))
+        pos += 1 + size
+    return tuple(strings)
+
+def _decode_soa(mv, pos, end):
+    if end - pos < 20:
+        raise DnsCodecError("SOA 紀錄長度不足")
+    numbers = _SOA.unpack_from(mv, pos)
+    primary, pos = _decode_name(mv, pos + 20, end)
+    admin, _ = _decode_name(mv, pos, end)
+    return SOAData(*numbers, primary, admin)
+
+_DECODERS = {
+    1: _decode_a, 2: _decode_name_only, 5: _decode_name_only, 6: _decode_soa, 12: _decode_name_only,
+    15: _decode_mx, 16: _decode_txt, 28: _decode_aaaa, 33: _decode_srv,
+}
+
+def _encode_txt(strings):
+    raw = bytearray()
+    for text in strings:
+        encoded = text.encode('utf-8')
+        if len(encoded) > 255:
+            raise DnsCodecError("TXT 單一字串上限 255 bytes")
+        raw.append(len(encoded))
+        raw += encoded
+    return bytes(raw)
+
+_ENCODERS = {
+    1: lambda ip: socket.inet_pton(socket.AF_INET, ip),
+    2: _encode_name,
+    5: _encode_name,
+    6: lambda soa: _SOA.pack(soa.serial, soa.refresh, soa.retry, soa.expire, soa.minimum)
+                   + _encode_name(soa.primary) + _encode_name(soa.admin),
+    12: _encode_name,
+    15: lambda mx: _U16.pack(mx.preference) + _encode_name(mx.exchange),
+    16: _encode_txt,
+    28: lambda ip: socket.inet_pton(socket.AF_INET6, ip),
+    33: lambda srv: _SRV.pack(srv.priority, srv.weight, srv.port) + _encode_name(srv.target),
+}
+
+
+# --- 解碼 ---
+
+def decode_record(blob):
+    """解碼一個 dnsRecord 值 (bytes / memoryview，不複製整段資料)"""
+    mv = memoryview(blob)
+    if len(mv) < HEADER_SIZE:
+        raise DnsCodecError("dnsRecord 長度不足 24 bytes")
+    data_len, type_id, _, rank, flags, serial = _HEADER.unpack_from(mv, 0)
+    ttl = _TTL.unpack_from(mv, 12)[0]
+    timestamp = _TAIL.unpack_from(mv, 16)[1]
+    end = HEADER_SIZE + data_len
+    if end > len(mv):
+        raise DnsCodecError("dnsRecord 資料長度與 DataLength 不符")
+    decoder = _DECODERS.get(type_id)
+    rdata = decoder(mv, HEADER_SIZE, end) if decoder else bytes(mv[HEADER_SIZE:end])
+    return DnsRecord(type_id, rdata, ttl, serial, timestamp, rank, flags)
+
+def decode_records(values):
+    """解碼一個 dnsNode 的所有 dnsRecord 值，略過格式錯誤的值"""
+    records = []
+    for value in values or ():
+        try:
+            records.append(decode_record(value))
+        except (DnsCodecError, struct.error, IndexError, ValueError):
+            continue
+    return records
+
+
+# --- 由文字建立紀錄 ---
+
+def _qualify(name, origin):
+    """zone file 名稱轉成 FQDN (不含結尾的點)：@ 代表 origin，不以點結尾者接上 origin"""
+    origin = (origin or '').rstrip('.')
+    if name == '@':
+        if not origin:
+            raise DnsCodecError("@ 需要指定 origin")
+        return origin
+    if name.endswith('.') or not origin:
+        return name.rstrip('.')
+    return f"{name}.{origin}"
+
+def _uint(token, limit, label):
+    if not token.isdigit() or int(token) > limit:
+        raise DnsCodecError(f"{label} 必須是 0 ~ {limit} 的整數: {token}")
+    return int(token)
+
+def parse_rdata(rtype, text, origin=None):
+    """
+    把 zone file 格式的 RDATA 文字轉成 rdata
+    例：parse_rdata('MX', '10 mail', 'corp.local') -> MXData(10, 'mail.corp.local')
+    """
+    rtype = rtype.upper()
+    if rtype not in RECORD_TYPES:
+        raise DnsCodecError(f"不支援的紀錄類型: {rtype}")
+    try:
+        tokens = shlex.split(text) if rtype == 'TXT' else text.split()
+    except ValueError as e:
+        raise DnsCodecError(f"無法解析 {rtype} 資料: {e}")
+    counts = {'MX': 2, 'SRV': 4, 'SOA': 7}
+    if not tokens or len(tokens) < counts.get(rtype, 1):
+        raise DnsCodecError(f"{rtype} 資料不完整: {text}")
+
+    if rtype in ('A', 'AAAA'):
+        family = socket.AF_INET if rtype == 'A' else socket.AF_INET6
+        try:
+            # 經過 pton / ntop 來回一次，取得標準寫法 (例如 IPv6 的壓縮格式)
+            return socket.inet_ntop(family, socket.inet_pton(family, tokens[0]))
+        except OSError:
+            raise DnsCodecError(f"不是合法的 {'IPv4' if rtype == 'A' else 'IPv6'} 位址: {tokens[0]}")
+    if rtype in ('NS', 'CNAME', 'PTR'):
+        return _qualify(tokens[0], origin)
+    if rtype == 'MX':
+        return MXData(_uint(tokens[0], 0xFFFF, 'MX preference'), _qualify(tokens[1], origin))
+    if rtype == 'SRV':
+        return SRVData(_uint(tokens[0], 0xFFFF, 'SRV priority'), _uint(tokens[1], 0xFFFF, 'SRV weight'),
+                       _uint(tokens[2], 0xFFFF, 'SRV port'), _qualify(tokens[3], origin))
+    if rtype == 'TXT':
+        return tuple(tokens)
+    return SOAData(*(_uint(t, 0xFFFFFFFF, 'SOA') for t in tokens[2:7]),
+                   _qualify(tokens[0], origin), _qualify(tokens[1], origin))
+
+def make_record(rtype, text, ttl=DEFAULT_TTL, origin=None):
+    """由類型與 RDATA 文字建立 DnsRecord (會先試編碼一次，確保可以寫入)"""
+    rdata = parse_rdata(rtype, text, origin)
+    record = DnsRecord(RECORD_TYPES[rtype.upper()], rdata, ttl=ttl)
+    record.encode()
+    return record
+
+def encode_record(rtype, text, ttl=DEFAULT_TTL, origin=None):
+    """由類型與 RDATA 文字直接產生 dnsRecord 二進位值"""
+    return make_record(rtype, text, ttl, origin).encode()
@@ -0,0 +1,390 @@
+# app/dns_index.py
+# DNS 反查索引：IP -> 名稱、目標 -> 別名、名稱前綴 trie，查詢完全在記憶體中完成
+import ipaddress
+import os
+import threading
+import time
+from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
+from app.ad_ops import get_ad_connection, paged_search, log, _directory_mirror
+from app.dc_locator import dc_locator
+from app.dns_codec import decode_records, DnsRecord
+from app.dir_sync import SHOW_DELETED_OID
+
+ADDRESS_TYPES = ('A', 'AAAA')
+NODE_ATTRIBUTES = ['name', 'dnsRecord', 'dNSTombstoned', 'uSNChanged', 'objectGUID']
+
+
+class _TrieNode:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children = {}
+        self.names = None  # 在此結束的名稱 (小寫)，沒有時為 None 以節省記憶體
+
+
+class NameTrie:
+    """名稱前綴樹 (小寫)，用於 web-* 這類前綴查詢"""
+
+    def __init__(self):
+        self._root = _TrieNode()
+
+    def insert(self, name):
+        node = self._root
+        for char in name:
+            node = node.children.setdefault(char, _TrieNode())
+        node.names = True
+
+    def remove(self, name):
+        path = [self._root]
+        for char in name:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].names = None
+        # 由下往上清掉沒有用途的節點
+        for depth in range(len(name), 0, -1):
+            node = path[depth]
+            if node.names or node.children:
+                break
+            del path[depth - 1].children[name[depth - 1]]
+
+    def with_prefix(self, prefix, limit=None):
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        found = []
+        stack = [(node, prefix)]
+        while stack:
+            node, name = stack.pop()
+            if node.names:
+                found.append(name)
+                if limit and len(found) >= limit:
+                    break
+            for char in sorted(node.children, reverse=True):
+                stack.append((node.children[char], name + char))
+        return found
+
+
+class _IndexedNode:
+    __slots__ = ('name', 'dn', 'guid', 'fingerprint', 'records')
+
+    def __init__(self, name, dn, guid, fingerprint, records):
+        self.name = name
+        self.dn = dn
+        self.guid = guid
+        self.fingerprint = fingerprint  # dnsRecord 原始值，沒變就不必重新解碼 / 重建索引
+        self.records = records
+
+    def to_dict(self, match=None):
+        return {
+            'name': self.name,
+            'dn': self.dn,
+            'type': self.records[0].type if self.records else None,
+            'records': [record.to_dict() for record in self.records],
+            'match': match,
+        }
+
+
+def _target_of(record):
+    """會指向其他主機名稱的紀錄，回傳目標 FQDN (小寫)"""
+    rdata = record.rdata
+    if record.type in ('CNAME', 'NS', 'PTR'):
+        return rdata.lower()
+    if record.type == 'MX':
+        return rdata.exchange.lower()
+    if record.type == 'SRV':
+        return rdata.target.lower()
+    return None
+
+
+class ZoneIndex:
+    """單一區域的索引；以 uSNChanged (或鏡像的原始值比對) 增量更新"""
+
+    def __init__(self, zone_dn):
+        self.zone_dn = zone_dn
+        self.zone_name = zone_dn.split(',', 1)[0].split('=', 1)[-1].lower()
+        self.nodes = {}        # 名稱 (小寫) -> _IndexedNode
+        self.guids = {}        # objectGUID -> 名稱 (小寫)
+        self.by_address = {}   # IP -> {名稱}
+        self.by_target = {}    # 目標 FQDN -> {(名稱, 類型)}
+        self.trie = NameTrie()
+        self.highest_usn = 0
+        self.dc = None         # highest_usn 所屬的 DC
+        self.refreshed_at = 0.0
+        self.mode = None
+        self.stale = True
+        self.lock = threading.RLock()
+
+    # --- 維護 ---
+
+    def _put(self, name, dn, guid, raws):
+        key = name.lower()
+        fingerprint = tuple(bytes(raw) for raw in raws)
+        current = self.nodes.get(key)
+        if current is not None and current.fingerprint == fingerprint and current.dn == dn:
+            return False
+        if current is not None:
+            self._drop(key)
+        node = _IndexedNode(name, dn, guid, fingerprint, decode_records(fingerprint))
+        self.nodes[key] = node
+        if guid:
+            self.guids[guid] = key
+        self.trie.insert(key)
+        for record in node.records:
+            if record.type in ADDRESS_TYPES:
+                self.by_address.setdefault(record.rdata, set()).add(key)
+            target = _target_of(record)
+            if target:
+                self.by_target.setdefault(target, set()).add((key, record.type))
+        return True
+
+    def _drop(self, key):
+        node = self.nodes.pop(key, None)
+        if node is None:
+            return False
+        if node.guid:
+            self.guids.pop(node.guid, None)
+        self.trie.remove(key)
+        for record in node.records:
+            if record.type in ADDRESS_TYPES:
+                _discard(self.by_address, record.rdata, key)
+            target = _target_of(record)
+            if target:
+                _discard(self.by_target, target, (key, record.type))
+        return True
+
+    def apply_rows(self, rows, complete):
+        """
+        套用節點資料 [{'name', 'dn', 'guid', 'dnsRecord', 'tombstoned'}]
+        complete=True 代表 rows 是區域的完整內容，沒出現的節點會被移除
+        回傳異動的節點數
+        """
+        changed = 0
+        seen = set()
+        for row in rows:
+            name = row['name'] or row['dn'].split(',', 1)[0].split('=', 1)[-1]
+            key = name.lower()
+            if row.get('tombstoned'):
+                changed += self._drop(key)
+                continue
+            seen.add(key)
+            changed += self._put(name, row['dn'], row.get('guid'), row['dnsRecord'])
+        if complete:
+            for key in [k for k in self.nodes if k not in seen]:
+                changed += self._drop(key)
+        return changed
+
+    def drop_guids(self, guids):
+        return sum(self._drop(self.guids[guid]) for guid in guids if guid in self.guids)
+
+    # --- 查詢 ---
+
+    def _relative(self, name):
+        name = name.strip().rstrip('.').lower()
+        if name == self.zone_name:
+            return '@'
+        if name.endswith('.' + self.zone_name):
+            return name[:-len(self.zone_name) - 1]
+        return name
+
+    def _fqdn(self, name):
+        return self.zone_name if name == '@' else f"{name}.{self.zone_name}"
+
+    def search(self, q, limit=200):
+        """
+        - IP 位址：哪些名稱的 A / AAAA 指向它
+        - 結尾 *：名稱前綴 (例如 web-*)
+        - 其他：同名節點 + 以它為目標的 CNAME / MX / SRV / NS / PTR
+        回傳 (kind, items)
+        """
+        q = q.strip()
+        try:
+            address = str(ipaddress.ip_address(q))
+        except ValueError:
+            address = None
+        if address:
+            keys = sorted(self.by_address.get(address, ()))[:limit]
+            return 'address', [self.nodes[key].to_dict(match='address') for key in keys]
+
+        if q.endswith('*'):
+            prefix = q.rstrip('*').strip().rstrip('.').lower()
+            if prefix.endswith('.' + self.zone_name):
+                prefix = prefix[:-len(self.zone_name) - 1]
+            keys = self.trie.with_prefix(prefix, limit)
+            return 'prefix', [self.nodes[key].to_dict(match='prefix') for key in keys]
+
+        relative = self._relative(q)
+        items = []
+        if relative in self.nodes:
+            items.append(self.nodes[relative].to_dict(match='name'))
+        # 目標可能寫成相對名稱 (web) 或 FQDN (web.corp.local)
+        targets = {self._fqdn(relative), q.rstrip('.').lower()}
+        referrers = sorted({ref for target in targets for ref in self.by_target.get(target, ())})
+        for key, rtype in referrers[:max(limit - len(items), 0)]:
+            items.append(self.nodes[key].to_dict(match=rtype))
+        return 'name', items
+
+    def stats(self):
+        return {
+            'nodes': len(self.nodes),
+            'addresses': len(self.by_address),
+            'targets': len(self.by_target),
+            'highest_usn': self.highest_usn,
+            'refreshed_at': self.refreshed_at,
+            'mode': self.mode,
+        }
+
+
+def _discard(mapping, key, value):
+    values = mapping.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del mapping[key]
+
+
+def _partition_root(zone_dn):
+    """區域所在的目錄分割區 (tombstone 會搬到該分割區的 Deleted Objects)"""
+    lower = zone_dn.lower()
+    idx = lower.find('cn=microsoftdns,')
+    root = zone_dn[idx + len('cn=microsoftdns,'):] if idx >= 0 else zone_dn
+    return root[len('cn=system,'):] if root.lower().startswith('cn=system,') else root
+
+
+def _entry_row(entry):
+    guid = entry.objectGUID.raw_values[0].hex() if 'objectGUID' in entry and entry.objectGUID.raw_values else None
+    usn = entry.uSNChanged.value if 'uSNChanged' in entry else None
+    return {
+        'name': str(entry.name.value or '').strip() if 'name' in entry else '',
+        'dn': entry.entry_dn,
+        'guid': guid,
+        'dnsRecord': entry.dnsRecord.raw_values if 'dnsRecord' in entry else [],
+        'tombstoned': str(entry.dNSTombstoned.value).upper() == 'TRUE' if 'dNSTombstoned' in entry else False,
+        'usn': int(usn) if usn is not None else 0,
+    }
+
+
+class DnsIndex:
+    """
+    各區域的反查索引 (以區域 DN 為 key，第一次查詢時建立)
+    - 啟用本機鏡像時直接從鏡像更新 (只重新解碼原始值有變動的節點)
+    - 否則向 DC 查 uSNChanged 比上次大的節點，刪除的節點以 Show Deleted 找 tombstone
+    - 本程式的 DNS 寫入會把索引標成過期，下次查詢前先做一次增量更新
+    """
+
+    def __init__(self, refresh_interval=30, search_limit=200):
+        self.refresh_interval = refresh_interval
+        self.search_limit = search_limit
+        self._zones = {}
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 各區域的鎖可能在 fork 當下被持有，子行程直接丟掉索引，第一次查詢時重建
+        self._zones = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('DNS_INDEX_REFRESH', self.refresh_interval)
+        self.search_limit = app.config.get('DNS_SEARCH_LIMIT', self.search_limit)
+
+    def mark_stale(self, *zone_dns):
+        with self._lock:
+            for zone_dn in zone_dns:
+                index = self._zones.get(zone_dn.lower())
+                if index is not None:
+                    index.stale = True
+
+    def get(self, zone_dn):
+        """取得區域索引，過期 (或超過 refresh_interval) 時先增量更新 (需在 app context 內呼叫)"""
+        with self._lock:
+            index = self._zones.setdefault(zone_dn.lower(), ZoneIndex(zone_dn))
+        with index.lock:
+            if index.stale or time.monotonic() - index.refreshed_at >= self.refresh_interval:
+                self._refresh(index)
+        return index
+
+    def search(self, zone_dn, q, limit=None):
+        index = self.get(zone_dn)
+        limit = min(limit or self.search_limit, self.search_limit)
+        started = time.perf_counter()
+        with index.lock:
+            kind, items = index.search(q, limit)
+        return {
+            'kind': kind,
+            'items': items,
+            'total': len(items),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'index': index.stats(),
+        }
+
+    def _refresh(self, index):
+        started = time.monotonic()
+        mirror = _directory_mirror()
+        if mirror:
+            rows = [{'name': row['name'], 'dn': row['dn'], 'dnsRecord': row['dnsRecord']}
+                    for row in mirror.dns_nodes_in_zone(index.zone_dn)]
+            changed = index.apply_rows(rows, complete=True)
+            index.mode = 'mirror'
+        else:
+            changed = self._refresh_from_dc(index)
+        index.stale = False
+        index.refreshed_at = time.monotonic()
+        if changed:
+            log(f"DNS 索引更新 {index.zone_name}: {changed} 個節點，{(time.monotonic() - started) * 1000:.1f}ms")
+
+    def _refresh_from_dc(self, index):
+        conn = get_ad_connection()
+        dc = dc_locator.host_of(conn)
+        if dc != index.dc:
+            # uSNChanged 是每台 DC 各自的計數器，換了一台 DC 就重新完整比對
+            index.highest_usn = 0
+            index.dc = dc
+        if not index.highest_usn:
+            # 第一次 (或 DC 不提供 uSNChanged)
+            return self._full_refresh(conn, index)
+
+        low = index.highest_usn + 1
+        # 不套用 LDAP_MAX_RESULTS：水位會前進到讀到的最大 USN，被截掉的節點之後就再也不會讀到
+        rows = [_entry_row(entry) for entry in paged_search(conn, index.zone_dn,
+                                                             f'(&(objectClass=dnsNode)(uSNChanged>={low}))',
+                                                             attributes=NODE_ATTRIBUTES, max_results=0)]
+        if (conn.result or {}).get('result') == RESULT_SIZE_LIMIT_EXCEEDED:
+            log(f"DNS 索引 {index.zone_name} 的異動查詢被截斷，改為完整比對")
+            return self._full_refresh(conn, index)
+        changed = index.apply_rows(rows, complete=False)
+        highest_usn = max((row['usn'] for row in rows), default=index.highest_usn)
+
+        # 被刪除的節點已搬到 Deleted Objects，以 objectGUID 對回索引 (分頁讀取，大量刪除時也不會被 MaxPageSize 截斷)
+        try:
+            deleted = [_entry_row(entry) for entry in paged_search(
+                conn, _partition_root(index.zone_dn), f'(&(isDeleted=TRUE)(objectClass=dnsNode)(uSNChanged>={low}))',
+                attributes=['objectGUID', 'uSNChanged'], max_results=0, controls=[(SHOW_DELETED_OID, True, None)])]
+            if (conn.result or {}).get('result') == RESULT_SIZE_LIMIT_EXCEEDED:
+                # 少了任何一筆 tombstone，索引裡就會留著已刪除的節點
+                log(f"DNS 索引 {index.zone_name} 的 tombstone 查詢被截斷，改為完整比對")
+                return changed + self._full_refresh(conn, index)
+        except Exception as e:
+            # 不支援 Show Deleted 時直接完整比對
+            log(f"DNS 索引無法查詢 tombstone，改為完整比對: {e}")
+            return changed + self._full_refresh(conn, index)
+        changed += index.drop_guids(row['guid'] for row in deleted)
+        index.highest_usn = max([highest_usn] + [row['usn'] for row in deleted])
+        index.mode = 'usn'
+        return changed
+
+    def _full_refresh(self, conn, index):
+        """讀整個區域 (complete=True，沒出現的節點會被移除)，但只重新解碼有變動的節點"""
+        rows = [_entry_row(entry) for entry in paged_search(conn, index.zone_dn, '(objectClass=dnsNode)',
+                                                             attributes=NODE_ATTRIBUTES, max_results=0)]
+        index.mode = 'full'
+        changed = index.apply_rows(rows, complete=True)
+        index.highest_usn = max((row['usn'] for row in rows), default=0)
+        return changed
+
+
+dns_index = DnsIndex()
@@ -0,0 +1,99 @@
+# app/fanout.py
+# 並行執行互不相依的目錄查詢：每個查詢在工作執行緒各借一條池化連線，
+# 各自有逾時，某一塊失敗或逾時只影響自己，其餘結果照常回傳
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from flask import current_app, copy_current_request_context, g, has_request_context
+from app.ldap_metrics import ldap_metrics
+
+
+class FanoutExecutor:
+    """
+    共用的查詢執行緒池 (整個行程一個)
+    - 工作執行緒帶著目前請求的 Session 執行，但有自己的 app context，
+      因此 get_ad_connection() 會各自從連線池借連線，結束時自動歸還
+    - 工作執行緒的 LDAP 操作會併入原請求的統計 (Server-Timing)
+    """
+
+    def __init__(self, max_workers=8, timeout=10):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 執行緒池的工作執行緒不會跟著 fork 複製，子行程第一次使用時重新建立
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_workers = app.config.get('DASHBOARD_FANOUT_WORKERS', self.max_workers)
+        self.timeout = app.config.get('DASHBOARD_QUERY_TIMEOUT', self.timeout)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='fanout')
+            return self._executor
+
+    @staticmethod
+    def in_worker():
+        """目前是否在 fanout 工作執行緒上 (巢狀呼叫 run() 會佔住工作執行緒等待同一個池，可能互相卡死)"""
+        return threading.current_thread().name.startswith('fanout')
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _wrap(func):
+        def run():
+            g._ldap_totals = {}
+            started = time.perf_counter()
+            value = func()
+            return value, g._ldap_totals, time.perf_counter() - started
+
+        if has_request_context():
+            return copy_current_request_context(run)
+        app = current_app._get_current_object()
+
+        def run_in_app():
+            with app.app_context():
+                return run()
+        return run_in_app
+
+    def run(self, calls, timeout=None):
+        """
+        並行執行 calls ({名稱: 無參數函式})，最多等待 timeout 秒 (預設 DASHBOARD_QUERY_TIMEOUT)
+        回傳 (results, errors, timings)：成功的結果、失敗或逾時的錯誤訊息、各查詢毫秒數
+        """
+        timeout = self.timeout if timeout is None else timeout
+        executor = self._get_executor()
+        futures = {executor.submit(self._wrap(func)): name for name, func in calls.items()}
+        done, pending = wait(futures, timeout=timeout)
+
+        results, errors, timings = {}, {}, {}
+        for future in done:
+            name = futures[future]
+            try:
+                value, totals, seconds = future.result()
+            except Exception as e:
+                errors[name] = str(e)
+                continue
+            results[name] = value
+            timings[name] = round(seconds * 1000, 1)
+            ldap_metrics.merge_request_totals(totals)
+        for future in pending:
+            # 已經送出的 LDAP 查詢無法中斷，讓它在背景跑完 (連線會自行歸還)
+            future.cancel()
+            errors[futures[future]] = f"查詢逾時 (超過 {timeout} 秒)"
+        return results, errors, timings
+
+
+fanout = FanoutExecutor()
@@ -0,0 +1,408 @@
+# app/group_graph.py
+# 巢狀群組關係圖：一次分頁讀入所有群組的 member，有效成員 / 使用者所屬群組 / 「X 為什麼在 Y 裡」都在記憶體中回答
+import os
+import threading
+import time
+from collections import deque
+from ldap3.core.results import RESULT_SIZE_LIMIT_EXCEEDED
+from ldap3.utils.dn import parse_dn
+from app.ad_ops import get_ad_connection, paged_search, get_ranged_values, find_dn_by_name, log, _get_domain_root
+from app.dc_locator import dc_locator
+from app.dir_sync import SHOW_DELETED_OID
+
+GROUP_ATTRIBUTES = ['cn', 'member', 'objectGUID', 'uSNChanged']
+
+
+def _rdn_value(dn):
+    """CN=bob,CN=Users,... -> bob (解析失敗時回傳原 DN)"""
+    try:
+        return parse_dn(dn)[0][1]
+    except Exception:
+        return dn
+
+
+def _entry_row(conn, entry):
+    members = list(entry.member.values) if 'member' in entry else []
+    if any(';range=' in name for name in entry.entry_raw_attributes):
+        # auto_range 沒有合併完的超大群組，逐段補讀
+        members = get_ranged_values(conn, entry.entry_dn, 'member')
+    guid = entry.objectGUID.raw_values[0].hex() if 'objectGUID' in entry and entry.objectGUID.raw_values else None
+    usn = entry.uSNChanged.value if 'uSNChanged' in entry else None
+    return {
+        'dn': entry.entry_dn,
+        'name': str(entry.cn.value) if 'cn' in entry and entry.cn.value else _rdn_value(entry.entry_dn),
+        'guid': guid,
+        'members': members,
+        'usn': int(usn) if usn is not None else 0,
+    }
+
+
+class GroupGraph:
+    """
+    群組 -> 成員的有向圖 (key 一律為小寫 DN)
+    - members / parents：直接成員與反向邊 (成員 -> 直接所屬群組)
+    - 有效成員 (遞移閉包) 依群組第一次查詢時以 BFS 計算並記住 {成員: (深度, 上一層群組)}，
+      同一棵 BFS 樹也能還原「為什麼在裡面」的最短路徑
+    - 某個群組的 member 變動時，只丟掉它與所有上層群組的閉包，以及它上下游節點的「所屬群組」快取
+    - 循環 (A ∈ B ∈ A) 以 Tarjan 強連通分量找出；BFS 以 visited 集合處理，不會無限展開
+    - primaryGroupID (例如 Domain Users) 不在 member 屬性中，不列入
+    """
+
+    def __init__(self, refresh_interval=60, full_refresh_interval=3600):
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _reset(self):
+        self.groups = {}      # 群組 key -> {'dn', 'name', 'guid'}
+        self.members = {}     # 群組 key -> {成員 key}
+        self.parents = {}     # 成員 key -> {群組 key}
+        self.dns = {}         # key -> 原始大小寫的 DN
+        self.guids = {}       # objectGUID -> 群組 key
+        self.by_name = {}     # 小寫 cn -> 群組 key
+        self.highest_usn = 0
+        self.dc = None
+        self.refreshed_at = 0.0
+        self.loaded_at = 0.0
+        self.stale = True
+        self._closure = {}    # 群組 key -> {成員 key: (深度, 上一層群組 key)}
+        self._ancestors = {}  # 成員 key -> {群組 key: (深度, 下一層 key)}
+        self._cycles = None
+        self.lock = threading.RLock()
+
+    def _after_fork(self):
+        # 鎖可能在 fork 當下被持有：子行程丟掉整張圖，第一次查詢時重新載入
+        self._reset()
+
+    def init_app(self, app):
+        self.refresh_interval = app.config.get('GROUP_GRAPH_REFRESH', self.refresh_interval)
+        self.full_refresh_interval = app.config.get('GROUP_GRAPH_FULL_REFRESH', self.full_refresh_interval)
+
+    def mark_stale(self):
+        self.stale = True
+
+    # --- 載入 / 增量更新 ---
+
+    def ensure_fresh(self):
+        """過期時先更新 (需在 app context 內呼叫)"""
+        with self.lock:
+            now = time.monotonic()
+            if not self.loaded_at or now - self.loaded_at >= self.full_refresh_interval:
+                self._full_load()
+            elif self.stale or now - self.refreshed_at >= self.refresh_interval:
+                self._incremental_load()
+
+    def _full_load(self):
+        # 群組被刪除時 AD 會移除成員的反向連結，但不一定改動每個相關群組的 uSNChanged，所以定期完整重建
+        started = time.monotonic()
+        conn = get_ad_connection()
+        rows = [_entry_row(conn, entry) for entry in
+                paged_search(conn, _get_domain_root(), '(objectClass=group)', attributes=GROUP_ATTRIBUTES,
+                             max_results=0)]
+        self._reset_graph()
+        self.dc = dc_locator.host_of(conn)
+        for row in rows:
+            self._put(row)
+        self.highest_usn = max((row['usn'] for row in rows), default=0)
+        self.loaded_at = self.refreshed_at = time.monotonic()
+        self.stale = False
+        log(f"群組關係圖載入 {len(self.groups)} 個群組、{sum(len(m) for m in self.members.values())} 條成員關係，"
+            f"{(time.monotonic() - started) * 1000:.1f}ms")
+
+    def _reset_graph(self):
+        self.groups, self.members, self.parents = {}, {}, {}
+        self.dns, self.guids, self.by_name = {}, {}, {}
+        self._closure, self._ancestors, self._cycles = {}, {}, None
+
+    def _incremental_load(self):
+        conn = get_ad_connection()
+        if dc_locator.host_of(conn) != self.dc or not self.highest_usn:
+            # uSNChanged 是每台 DC 各自的計數器，換了 DC 只能重新完整載入
+            self._full_load()
+            return
+        low = self.highest_usn + 1
+        # 不套用 LDAP_MAX_RESULTS：水位會前進到讀到的最大 USN，被截掉的群組之後就再也不會讀到
+        rows = [_entry_row(conn, entry) for entry in
+                paged_search(conn, _get_domain_root(), f'(&(objectClass=group)(uSNChanged>={low}))',
+                             attributes=GROUP_ATTRIBUTES, max_results=0)]
+        if (conn.result or {}).get('result') == RESULT_SIZE_LIMIT_EXCEEDED:
+            log("群組關係圖的異動查詢被截斷，改為完整載入")
+            self._full_load()
+            return
+        try:
+            deleted = [(entry.objectGUID.raw_values[0].hex(), int(entry.uSNChanged.value or 0))
+                       for entry in paged_search(conn, _get_domain_root(),
+                                                 f'(&(isDeleted=TRUE)(objectClass=group)(uSNChanged>={low}))',
+                                                 attributes=['objectGUID', 'uSNChanged'], max_results=0,
+                                                 controls=[(SHOW_DELETED_OID, True, None)])
+                       if 'objectGUID' in entry and entry.objectGUID.raw_values]
+            if (conn.result or {}).get('result') == RESULT_SIZE_LIMIT_EXCEEDED:
+                raise RuntimeError("查詢結果被截斷")
+        except Exception as e:
+            log(f"群組關係圖無法查詢已刪除的群組，改為完整載入: {e}")
+            self._full_load()
+            return
+
+        changed = [self.guids.get(row['guid']) or row['dn'].lower() for row in rows]
+        changed += [self.guids[guid] for guid, _ in deleted if guid in self.guids]
+        self._invalidate_around(changed)
+        for row in rows:
+            self._put(row)
+        for guid, _ in deleted:
+            if guid in self.guids:
+                self._drop(self.guids[guid])
+        self._invalidate_around([row['dn'].lower() for row in rows])
+        self.highest_usn = max([self.highest_usn] + [row['usn'] for row in rows] + [usn for _, usn in deleted])
+        self.refreshed_at = time.monotonic()
+        self.stale = False
+        if rows or deleted:
+            log(f"群組關係圖更新 {len(rows)} 個群組、刪除 {len(deleted)} 個")
+
+    def _put(self, row):
+        key = row['dn'].lower()
+        old_key = self.guids.get(row['guid']) if row['guid'] else None
+        if old_key and old_key != key:
+            self._rename(old_key, key, row['dn'])
+        previous = self.groups.get(key)
+        if previous and previous['name'].lower() != row['name'].lower():
+            self.by_name.pop(previous['name'].lower(), None)
+        self.groups[key] = {'dn': row['dn'], 'name': row['name'], 'guid': row['guid']}
+        self.dns[key] = row['dn']
+        self.by_name[row['name'].lower()] = key
+        if row['guid']:
+            self.guids[row['guid']] = key
+
+        new_members = {dn.lower() for dn in row['members']}
+        for member in self.members.get(key, set()) - new_members:
+            self._unlink(key, member)
+        for dn in row['members']:
+            member = dn.lower()
+            self.dns.setdefault(member, dn)
+            self.parents.setdefault(member, set()).add(key)
+        self.members[key] = new_members
+
+    def _unlink(self, group, member):
+        parents = self.parents.get(member)
+        if parents is not None:
+            parents.discard(group)
+            if not parents:
+                del self.parents[member]
+
+    def _drop(self, key):
+        group = self.groups.pop(key, None)
+        if group is None:
+            return
+        self.guids.pop(group['guid'], None)
+        if self.by_name.get(group['name'].lower()) == key:
+            del self.by_name[group['name'].lower()]
+        for member in self.members.pop(key, set()):
+            self._unlink(key, member)
+        for parent in self.parents.pop(key, set()):
+            self.members.get(parent, set()).discard(key)
+
+    def _rename(self, old_key, new_key, new_dn):
+        """群組改名 / 搬移：DN 變了但 objectGUID 不變，把指向舊 DN 的邊改到新 DN"""
+        self._invalidate_around([old_key])
+        group = self.groups.pop(old_key, None)
+        if group and self.by_name.get(group['name'].lower()) == old_key:
+            del self.by_name[group['name'].lower()]
+        self.members[new_key] = self.members.pop(old_key, set())
+        for member in self.members[new_key]:
+            parents = self.parents.get(member)
+            if parents is not None:
+                parents.discard(old_key)
+                parents.add(new_key)
+        parents = self.parents.pop(old_key, set())
+        for parent in parents:
+            self.members.get(parent, set()).discard(old_key)
+            self.members.setdefault(parent, set()).add(new_key)
+        self.parents.setdefault(new_key, set()).update(parents)
+        self.dns[new_key] = new_dn
+
+    # --- 閉包維護 ---
+
+    def _reach(self, start, edges):
+        seen = set()
+        queue = deque(start)
+        while queue:
+            node = queue.popleft()
+            for nxt in edges.get(node, ()):
+                if nxt not in seen:
+                    seen.add(nxt)
+                    queue.append(nxt)
+        return seen
+
+    def _invalidate_around(self, keys):
+        """keys 的成員即將 (或剛剛) 改變：上層群組的閉包、下游節點的所屬群組都要重算"""
+        keys = set(keys)
+        if not keys:
+            return
+        for key in keys | self._reach(keys, self.parents):
+            self._closure.pop(key, None)
+        for key in keys | self._reach(keys, self.members):
+            self._ancestors.pop(key, None)
+        self._cycles = None
+
+    def _closure_of(self, group):
+        tree = self._closure.get(group)
+        if tree is None:
+            tree = {}
+            queue = deque([(group, 0)])
+            while queue:
+                node, depth = queue.popleft()
+                for member in self.members.get(node, ()):
+                    if member not in tree:
+                        tree[member] = (depth + 1, node)
+                        queue.append((member, depth + 1))
+            self._closure[group] = tree
+        return tree
+
+    def _ancestors_of(self, member):
+        tree = self._ancestors.get(member)
+        if tree is None:
+            tree = {}
+            queue = deque([(member, 0)])
+            while queue:
+                node, depth = queue.popleft()
+                for parent in self.parents.get(node, ()):
+                    if parent not in tree:
+                        tree[parent] = (depth + 1, node)
+                        queue.append((parent, depth + 1))
+            self._ancestors[member] = tree
+        return tree
+
+    def _find_cycles(self):
+        """Tarjan 強連通分量 (迭代版，不受遞迴深度限制)：大小 > 1 或自我包含的分量就是循環"""
+        index, low, on_stack, stack, cycles = {}, {}, set(), [], []
+        counter = 0
+        for root in self.groups:
+            if root in index:
+                continue
+            work = [(root, iter(self.members.get(root, ())))]
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                advanced = False
+                for child in children:
+                    if child not in self.groups:
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.members.get(child, ()))))
+                        advanced = True
+                        break
+                    if child in on_stack:
+                        low[node] = min(low[node], index[child])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in self.members.get(node, ()):
+                        cycles.append(sorted(component))
+        return cycles
+
+    # --- 查詢 (需在 app context 內呼叫，過期時先更新) ---
+
+    def resolve_member(self, name):
+        """成員名稱 -> DN：先找群組 (cn)，再以 sAMAccountName 查使用者"""
+        self.ensure_fresh()
+        key = self.resolve_group(name)
+        if key is not None:
+            return self.dns[key]
+        return find_dn_by_name(get_ad_connection(), name, 'user')
+
+    def resolve_group(self, name_or_dn):
+        key = (name_or_dn or '').strip().lower()
+        if key in self.groups:
+            return key
+        return self.by_name.get(key)
+
+    def display_name(self, key):
+        group = self.groups.get(key)
+        return group['name'] if group else _rdn_value(self.dns.get(key, key))
+
+    def _node(self, key, depth, via):
+        return {
+            'name': self.display_name(key),
+            'dn': self.dns.get(key, key),
+            'is_group': key in self.groups,
+            'depth': depth,
+            'via': self.display_name(via) if depth > 1 else None,
+        }
+
+    def effective_members(self, group_name, include_groups=True):
+        """群組的有效成員 (含巢狀)：[{name, dn, is_group, depth, via}]，via 是最短路徑上的直接上層群組"""
+        self.ensure_fresh()
+        key = self.resolve_group(group_name)
+        if key is None:
+            return None
+        with self.lock:
+            tree = self._closure_of(key)
+            items = [self._node(member, depth, parent) for member, (depth, parent) in tree.items()
+                     if member != key and (include_groups or member not in self.groups)]
+        return sorted(items, key=lambda item: (item['depth'], item['name'].lower()))
+
+    def groups_of(self, member_dn):
+        """成員直接與間接所屬的群組：[{name, dn, is_group, depth, via}]，via 是往下一層的群組"""
+        self.ensure_fresh()
+        with self.lock:
+            tree = self._ancestors_of(member_dn.lower())
+            items = [self._node(group, depth, child) for group, (depth, child) in tree.items()
+                     if group != member_dn.lower()]
+        return sorted(items, key=lambda item: (item['depth'], item['name'].lower()))
+
+    def explain(self, member_dn, group_name):
+        """「為什麼 member 在 group 裡」：回傳最短路徑 [群組, 子群組, ..., 成員]，不在其中時回傳 None"""
+        self.ensure_fresh()
+        key = self.resolve_group(group_name)
+        member = member_dn.lower()
+        if key is None:
+            return None
+        with self.lock:
+            tree = self._closure_of(key)
+            if member not in tree:
+                return None
+            path = [member]
+            node = member
+            while node != key:
+                node = tree[node][1]
+                path.append(node)
+        return [{'name': self.display_name(node), 'dn': self.dns.get(node, node), 'is_group': node in self.groups}
+                for node in reversed(path)]
+
+    def cycles(self):
+        self.ensure_fresh()
+        with self.lock:
+            if self._cycles is None:
+                self._cycles = self._find_cycles()
+            return [[self.display_name(key) for key in component] for component in self._cycles]
+
+    def stats(self):
+        return {
+            'groups': len(self.groups),
+            'edges': sum(len(m) for m in self.members.values()),
+            'cached_closures': len(self._closure),
+            'highest_usn': self.highest_usn,
+            'dc': self.dc,
+        }
+
+
+group_graph = GroupGraph()
@@ -0,0 +1,380 @@
+# app/jobs.py
+# 背景工作佇列：批次匯入等長時間的目錄操作不在 HTTP 請求內執行，
+# 請求只負責提交並立即回傳工作編號，前端輪詢進度；web worker 執行緒不會被佔住
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from flask import g, session, has_request_context
+from app.ad_ops import log, _get_bind_credentials, _authz_controls
+from app.dc_locator import dc_locator
+
+JOB_STATE_VERSION = 1
+ACTIVE_STATES = ('queued', 'running')
+# 已結束的狀態；interrupted = 行程重啟時還沒跑完 (帳密只保存在記憶體，無法自動接續)
+FINISHED_STATES = ('succeeded', 'failed', 'cancelled', 'interrupted')
+PROGRESS_SAVE_INTERVAL = 1.0  # 進度寫入磁碟的最短間隔秒數 (其他 worker 行程讀得到)
+
+
+class JobCancelled(Exception):
+    """工作被使用者取消 (處理函式可在適當的地方丟出，提前結束)"""
+
+
+class Job:
+    """
+    一個背景工作
+    - 狀態、進度與結果會寫入磁碟 (每個工作一個 JSON 檔)
+    - 提交者的連線身分 (含 user 模式的密碼) 與輸入資料只留在記憶體，不寫入磁碟
+    """
+
+    def __init__(self, kind, label, owner, dc, payload=None, identity=None, controls=()):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.dc = dc
+        self.state = 'queued'
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = 0
+        self.total = 0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.pid = os.getpid()
+        self._payload = payload
+        self._identity = identity
+        self._controls = controls
+        self._cancel = threading.Event()
+        self._saved_at = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def set_total(self, total, message=None):
+        self.total = total
+        if message is not None:
+            self.message = message
+
+    def advance(self, count=1):
+        """處理函式每完成一個單位呼叫一次 (可由多條工作線同時呼叫)"""
+        with _progress_lock:
+            self.done += count
+        job_queue._save_progress(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'label': self.label,
+            'owner': self.owner,
+            'dc': self.dc,
+            'state': self.state,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'done': self.done,
+            'total': self.total,
+            'percent': round(self.done * 100 / self.total, 1) if self.total else None,
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'cancel_requested': self.cancelled,
+            'pid': self.pid,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['kind'], data['label'], data['owner'], data['dc'])
+        for key in ('id', 'state', 'created_at', 'started_at', 'finished_at', 'done', 'total',
+                    'message', 'result', 'error', 'pid'):
+            setattr(job, key, data.get(key))
+        if data.get('cancel_requested'):
+            job._cancel.set()
+        return job
+
+
+_progress_lock = threading.Lock()
+
+
+class JobQueue:
+    """
+    行程內的背景工作排程 (整個行程一個)
+    - 固定數量的工作執行緒 (JOB_WORKERS)，工作依提交順序執行
+    - 同一台 DC 同時執行的工作不超過 JOB_PER_DC_LIMIT；其他 DC 的工作不受影響，照常往前排
+    - 工作狀態寫入 JOB_STATE_DIR，重啟後仍查得到結果；多個 gunicorn worker 共用同一個目錄時，
+      查詢也看得到其他 worker 的工作 (但只有執行中的 worker 能取消它)
+    """
+
+    def __init__(self, max_workers=2, per_dc_limit=1, retention=86400):
+        self.max_workers = max_workers
+        self.per_dc_limit = per_dc_limit
+        self.retention = retention
+        self.state_dir = None
+        self._app = None
+        self._handlers = {}
+        self._jobs = OrderedDict()  # id -> Job (提交順序)
+        self._running = {}          # DC -> 執行中的工作數
+        self._threads = []
+        self._cond = threading.Condition()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 工作執行緒不會跟著 fork 複製；父行程 (preload) 不會有執行中的工作，重建鎖即可
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = {}
+
+    def init_app(self, app):
+        self._app = app
+        self.max_workers = app.config.get('JOB_WORKERS', self.max_workers)
+        self.per_dc_limit = app.config.get('JOB_PER_DC_LIMIT', self.per_dc_limit)
+        self.retention = app.config.get('JOB_RETENTION', self.retention)
+        self.state_dir = app.config.get('JOB_STATE_DIR')
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+            self._load_state()
+
+    def register(self, kind, handler):
+        """handler(job, payload) 在工作執行緒的 app context 內執行，回傳值存為工作結果"""
+        self._handlers[kind] = handler
+
+    # --- 提交 / 查詢 / 取消 ---
+
+    def submit(self, kind, payload, label=''):
+        """
+        提交工作 (需在請求內呼叫)：記下提交者的連線身分與目標 DC，立即回傳 Job
+        多台 DC 時以目前寫入路由的第一順位 DC 作為並行限制的單位
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"不支援的工作類型: {kind}")
+        identity = _get_bind_credentials()
+        owner = session.get('ad_user_account') if has_request_context() else None
+        dc = dc_locator.candidates('write')[0] if dc_locator.multiple else identity[0]
+        job = Job(kind, label, owner, dc, payload=payload, identity=identity, controls=_authz_controls())
+        with self._cond:
+            self._jobs[job.id] = job
+            self._save(job)
+            self._ensure_workers()
+            self._cond.notify_all()
+        log(f"已提交背景工作 {job.id} ({kind}: {label})，目標 DC {dc}")
+        return job
+
+    def get(self, job_id):
+        """目前行程的工作直接回傳；否則從磁碟讀取 (其他 worker 行程或重啟前的工作)"""
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        return self._read(job_id)
+
+    def list(self, owner=None, limit=50):
+        jobs = {job.id: job for job in self._read_all()}
+        jobs.update(self._jobs)
+        visible = [job for job in jobs.values() if owner is None or job.owner == owner]
+        visible.sort(key=lambda job: job.created_at, reverse=True)
+        return visible[:limit]
+
+    def cancel(self, job_id):
+        """
+        取消工作，回傳 (成功與否, 訊息)
+        排隊中的工作直接取消；執行中的工作要等處理函式看到取消旗標 (目前這一筆處理完) 才結束
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False, "工作不在這個行程執行，或已經結束"
+            if job.state not in ACTIVE_STATES:
+                return False, f"工作已經結束 ({job.state})"
+            job._cancel.set()
+            if job.state == 'queued':
+                self._finish_locked(job, 'cancelled', message="已取消 (尚未開始)")
+            else:
+                job.message = "正在取消..."
+                self._save(job)
+        return True, "已送出取消要求"
+
+    # --- 排程 ---
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_runnable_locked(self):
+        """依提交順序找第一個目標 DC 還有名額的排隊工作"""
+        for job in self._jobs.values():
+            if job.state == 'queued' and self._running.get(job.dc, 0) < self.per_dc_limit:
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._cond.wait_for(self._next_runnable_locked)
+                job.state = 'running'
+                job.started_at = time.time()
+                self._running[job.dc] = self._running.get(job.dc, 0) + 1
+                self._save(job)
+            try:
+                self._execute(job)
+            finally:
+                with self._cond:
+                    self._running[job.dc] -= 1
+                    if not self._running[job.dc]:
+                        del self._running[job.dc]
+                    self._cond.notify_all()
+
+    def _execute(self, job):
+        handler = self._handlers[job.kind]
+        with self._app.app_context():
+            # 工作執行緒沒有 Session：以提交時記下的身分連線 (ad_ops 會優先使用 g 上的身分)
+            g._ldap_identity = job._identity
+            g._ldap_authz_controls = job._controls
+            try:
+                result = handler(job, job._payload)
+            except JobCancelled:
+                result, state, error = None, 'cancelled', None
+            except Exception as e:
+                log(f"背景工作 {job.id} 失敗: {e}")
+                result, state, error = None, 'failed', str(e)
+            else:
+                state, error = ('cancelled' if job.cancelled else 'succeeded'), None
+        with self._cond:
+            job.result = result
+            job.error = error
+            self._finish_locked(job, state)
+        log(f"背景工作 {job.id} 結束: {state} ({job.done}/{job.total})")
+
+    def _finish_locked(self, job, state, message=None):
+        job.state = state
+        job.finished_at = time.time()
+        if message is not None:
+            job.message = message
+        elif state == 'cancelled':
+            job.message = "已取消"
+        elif state == 'succeeded':
+            job.message = "完成"
+        # 結束後不再需要輸入資料與帳密
+        job._payload = None
+        job._identity = None
+        job._controls = ()
+        self._save(job)
+        self._prune_locked()
+
+    def _save_progress(self, job):
+        """回報進度時呼叫：限制寫入頻率，其他 worker 行程輪詢時也看得到進度"""
+        now = time.monotonic()
+        if now - job._saved_at >= PROGRESS_SAVE_INTERVAL:
+            self._save(job)
+
+    # --- 持久化 (每個工作一個檔案，寫入暫存檔後 rename，不會讀到寫一半的內容) ---
+
+    def _path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        job._saved_at = time.monotonic()
+        if not self.state_dir:
+            return
+        path = self._path(job.id)
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'version': JOB_STATE_VERSION, 'job': job.to_dict()}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            log(f"寫入工作狀態失敗 ({job.id}): {e}")
+
+    def _read(self, job_id):
+        if not self.state_dir or not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != JOB_STATE_VERSION:
+            return None
+        return Job.from_dict(data['job'])
+
+    def _read_all(self):
+        if not self.state_dir:
+            return []
+        jobs = []
+        for name in os.listdir(self.state_dir):
+            if name.endswith('.json'):
+                job = self._read(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _load_state(self):
+        """啟動時：執行行程已經不在的未完成工作標記為 interrupted，並清掉過期的紀錄"""
+        for job in self._read_all():
+            if job.state in ACTIVE_STATES and (job.pid == os.getpid() or not _pid_alive(job.pid)):
+                job.state = 'interrupted'
+                job.finished_at = time.time()
+                job.message = "服務重新啟動，工作中斷 (請重新提交)"
+                self._save(job)
+        with self._cond:
+            self._prune_locked()
+
+    def _prune_locked(self):
+        if not self.retention:
+            return
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.state in FINISHED_STATES and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+        for job in self._read_all():
+            if job.state in FINISHED_STATES and (job.finished_at or 0) < cutoff:
+                try:
+                    os.remove(self._path(job.id))
+                except OSError:
+                    pass
+
+    def status(self):
+        with self._cond:
+            states = {}
+            for job in self._jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {'workers': self.max_workers, 'per_dc_limit': self.per_dc_limit,
+                    'running_per_dc': dict(self._running), 'jobs': states}
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+job_queue = JobQueue()
+
+
+# --- 工作類型 ---
+
+def _import_users_job(job, payload):
+    from app.bulk_ops import import_users
+    job.set_total(len(payload['rows']), "驗證中...")
+    return import_users(payload['rows'], job=job)
+
+def _import_zone_job(job, payload):
+    from app.dns_bulk import import_zone
+    job.message = "比對區域紀錄中..."
+    return import_zone(payload['zone_dn'], payload['records'], prune=payload['prune'], job=job)
+
+job_queue.register('import_users', _import_users_job)
+job_queue.register('import_zone', _import_zone_job)
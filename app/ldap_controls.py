@@ -0,0 +1,170 @@
+# app/ldap_controls.py
+# ldap3 沒有內建的 LDAP 控制項 (Server-Side Sort / VLV) 編碼與解碼
+from pyasn1.type.univ import OctetString, Integer, Boolean, Enumerated, Sequence, SequenceOf, Choice
+from pyasn1.type.namedtype import NamedTypes, NamedType, OptionalNamedType, DefaultedNamedType
+from pyasn1.type.tag import Tag, tagClassContext, tagFormatSimple, tagFormatConstructed
+from pyasn1.codec.ber import encoder, decoder
+from ldap3 import BASE
+
+SORT_REQUEST_OID = '1.2.840.113556.1.4.473'   # RFC 2891 Server-Side Sort
+SORT_RESPONSE_OID = '1.2.840.113556.1.4.474'
+VLV_REQUEST_OID = '2.16.840.1.113730.3.4.9'   # Virtual List View
+VLV_RESPONSE_OID = '2.16.840.1.113730.3.4.10'
+PROXIED_AUTHZ_OID = '2.16.840.1.113730.3.4.18'  # RFC 4370 Proxied Authorization
+
+
+# --- RFC 2891 Server-Side Sort ---
+
+class SortKey(Sequence):
+    # SortKey ::= SEQUENCE {
+    #     attributeType   AttributeDescription,
+    #     orderingRule    [0] MatchingRuleId OPTIONAL,
+    #     reverseOrder    [1] BOOLEAN DEFAULT FALSE }
+    componentType = NamedTypes(
+        NamedType('attributeType', OctetString()),
+        OptionalNamedType('orderingRule', OctetString().subtype(implicitTag=Tag(tagClassContext, tagFormatSimple, 0))),
+        DefaultedNamedType('reverseOrder', Boolean(False).subtype(implicitTag=Tag(tagClassContext, tagFormatSimple, 1)))
+    )
+
+
+class SortKeyList(SequenceOf):
+    componentType = SortKey()
+
+
+class SortResult(Sequence):
+    # SortResult ::= SEQUENCE {
+    #     sortResult  ENUMERATED,
+    #     attributeType [0] AttributeDescription OPTIONAL }
+    componentType = NamedTypes(
+        NamedType('sortResult', Enumerated()),
+        OptionalNamedType('attributeType', OctetString().subtype(implicitTag=Tag(tagClassContext, tagFormatSimple, 0)))
+    )
+
+
+def sort_control(sort_keys, criticality=True):
+    """
+    建立 Server-Side Sort 控制項
+    sort_keys: [(attribute, reverse), ...]
+    """
+    key_list = SortKeyList()
+    for idx, (attribute, reverse) in enumerate(sort_keys):
+        key = SortKey()
+        key.setComponentByName('attributeType', attribute)
+        if reverse:
+            key.setComponentByName('reverseOrder', True)
+        key_list.setComponentByPosition(idx, key)
+    return (SORT_REQUEST_OID, criticality, encoder.encode(key_list))
+
+
+# --- Virtual List View (draft-ietf-ldapext-ldapv3-vlv) ---
+
+class ByOffset(Sequence):
+    componentType = NamedTypes(
+        NamedType('offset', Integer()),
+        NamedType('contentCount', Integer())
+    )
+
+
+class VLVTarget(Choice):
+    componentType = NamedTypes(
+        NamedType('byOffset', ByOffset().subtype(implicitTag=Tag(tagClassContext, tagFormatConstructed, 0))),
+        NamedType('greaterThanOrEqual', OctetString().subtype(implicitTag=Tag(tagClassContext, tagFormatSimple, 1)))
+    )
+
+
+class VirtualListViewRequest(Sequence):
+    componentType = NamedTypes(
+        NamedType('beforeCount', Integer()),
+        NamedType('afterCount', Integer()),
+        NamedType('target', VLVTarget()),
+        OptionalNamedType('contextID', OctetString())
+    )
+
+
+class VirtualListViewResponse(Sequence):
+    componentType = NamedTypes(
+        NamedType('targetPosition', Integer()),
+        NamedType('contentCount', Integer()),
+        NamedType('virtualListViewResult', Enumerated()),
+        OptionalNamedType('contextID', OctetString())
+    )
+
+
+def vlv_control(offset, before_count=0, after_count=0, content_count=0, context_id=None, criticality=True):
+    """
+    建立 VLV 控制項 (以 offset 定位，offset 從 1 開始)
+    必須搭配 Server-Side Sort 控制項一起送出
+    """
+    by_offset = VLVTarget().getComponentByName('byOffset').clone()
+    by_offset.setComponentByName('offset', offset)
+    by_offset.setComponentByName('contentCount', content_count)
+
+    request = VirtualListViewRequest()
+    request.setComponentByName('beforeCount', before_count)
+    request.setComponentByName('afterCount', after_count)
+    request.getComponentByName('target').setComponentByName('byOffset', by_offset)
+    if context_id:
+        request.setComponentByName('contextID', context_id)
+    return (VLV_REQUEST_OID, criticality, encoder.encode(request))
+
+
+def _raw_response_control(result, oid):
+    controls = (result or {}).get('controls') or {}
+    control = controls.get(oid)
+    if not control:
+        return None
+    return control.get('value')
+
+
+def decode_sort_response(result):
+    """回傳 sortResult 代碼 (0 = 成功)，沒有回應控制項時回傳 None"""
+    raw = _raw_response_control(result, SORT_RESPONSE_OID)
+    if not raw:
+        return None
+    decoded, _ = decoder.decode(raw, asn1Spec=SortResult())
+    return int(decoded['sortResult'])
+
+
+def decode_vlv_response(result):
+    """回傳 {'target_position', 'content_count', 'result', 'context_id'}，沒有回應控制項時回傳 None"""
+    raw = _raw_response_control(result, VLV_RESPONSE_OID)
+    if not raw:
+        return None
+    decoded, _ = decoder.decode(raw, asn1Spec=VirtualListViewResponse())
+    context_id = decoded['contextID']
+    return {
+        'target_position': int(decoded['targetPosition']),
+        'content_count': int(decoded['contentCount']),
+        'result': int(decoded['virtualListViewResult']),
+        'context_id': bytes(context_id) if context_id.isValue else None
+    }
+
+
+# --- RFC 4370 Proxied Authorization ---
+
+def proxied_authorization_control(authz_id):
+    """
+    以服務帳號連線，但讓伺服器以 authz_id (例如 u:alice 或 dn:CN=...) 的身分套用 ACL
+    controlValue 直接是 authzId 字串 (不經 BER 編碼)；RFC 規定必須標為 critical，
+    伺服器不支援時會回 unavailableCriticalExtension，而不是默默以服務帳號身分執行
+    """
+    return (PROXIED_AUTHZ_OID, True, authz_id.encode('utf-8'))
+
+
+# --- RootDSE 支援的控制項 ---
+
+_supported_controls = {}
+
+def get_supported_controls(conn):
+    """讀取 RootDSE 的 supportedControl (每台伺服器只讀一次)"""
+    key = conn.server.name
+    if key not in _supported_controls:
+        controls = set()
+        try:
+            conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['supportedControl'])
+            if conn.entries and 'supportedControl' in conn.entries[0]:
+                controls = set(str(oid) for oid in conn.entries[0].supportedControl.values)
+        except Exception:
+            pass
+        _supported_controls[key] = controls
+    return _supported_controls[key]
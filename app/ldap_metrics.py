@@ -0,0 +1,316 @@
+# app/ldap_metrics.py
+# LDAP 操作量測：每次 bind / search / add / modify / delete 記錄耗時、筆數與回應大小，
+# 依 Flask 請求彙總 (Server-Timing)，並以 Prometheus 文字格式輸出 (/metrics)
+import hashlib
+import os
+import re
+import threading
+import time
+from flask import g, has_app_context, request
+from ldap3 import Connection, SUBTREE, BASE, LEVEL
+
+# 秒數 bucket (LDAP 操作 / HTTP 請求共用)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每個請求的 LDAP 操作數
+OPS_PER_REQUEST_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SCOPE_NAMES = {BASE: 'base', LEVEL: 'one', SUBTREE: 'sub'}
+# filter 比對值 (= / >= / <= / ~= 之後到右括號) ，寫 log 時換成 ?
+_FILTER_VALUE = re.compile(r'(=)[^()]*(?=\))')
+SLOW_OP_FILTER_MAX = 200
+
+
+def filter_fingerprint(search_filter):
+    """
+    寫 log 用的 filter 摘要：只留結構 (比對值換成 ?，過長時截斷) 加上完整 filter 的雜湊，
+    帳號名稱等值不會寫進 log，相同的 filter 仍可用雜湊對起來
+    """
+    if not search_filter:
+        return search_filter
+    shape = _FILTER_VALUE.sub(r'\1?', search_filter)
+    if len(shape) > SLOW_OP_FILTER_MAX:
+        shape = shape[:SLOW_OP_FILTER_MAX] + '...'
+    digest = hashlib.sha256(search_filter.encode('utf-8')).hexdigest()[:12]
+    return f"{shape} #{digest}"
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'total', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.total)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _response_size(response):
+    """估算搜尋回應大小 (DN + 屬性原始值的位元組數)"""
+    size = 0
+    for item in response or ():
+        size += len(item.get('dn') or '')
+        for values in (item.get('raw_attributes') or {}).values():
+            for value in values:
+                size += len(value)
+    return size
+
+
+class LDAPMetrics:
+    """
+    LDAP 操作與 HTTP 請求的統計 (整個行程共用)
+    - 全域：各操作的次數 / 失敗數 / 筆數 / 位元組 / 耗時分佈
+    - 每個請求：操作數與耗時彙總在 g，回應時附上 Server-Timing 標頭
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.server_timing = True
+        self.slow_op_ms = 0
+        self._lock = threading.Lock()
+        self._op_durations = {}    # op -> _Histogram
+        self._op_counts = {}       # (op, result) -> 次數
+        self._op_entries = {}      # op -> 回傳筆數
+        self._op_bytes = {}        # op -> 回應位元組數
+        self._request_durations = {}   # (endpoint, method) -> _Histogram
+        self._request_ops = {}         # endpoint -> _Histogram
+        self._started = time.time()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # 各 worker 各自統計 (Prometheus 以 instance 區分)：重建鎖，不沿用父行程的數字
+        self._lock = threading.Lock()
+        self._op_durations = {}
+        self._op_counts = {}
+        self._op_entries = {}
+        self._op_bytes = {}
+        self._request_durations = {}
+        self._request_ops = {}
+        self._started = time.time()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('LDAP_METRICS_ENABLED', self.enabled)
+        self.server_timing = app.config.get('LDAP_SERVER_TIMING', self.server_timing)
+        self.slow_op_ms = app.config.get('LDAP_SLOW_OP_MS', self.slow_op_ms)
+        if self.enabled:
+            app.before_request(self._start_request)
+            app.after_request(self._finish_request)
+
+    # --- LDAP 操作 ---
+
+    def record(self, op, seconds, success, entries=0, size=0, base=None, search_filter=None, scope=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._op_durations.get(op)
+            if histogram is None:
+                histogram = self._op_durations[op] = _Histogram(DURATION_BUCKETS)
+            histogram.observe(seconds)
+            key = (op, 'success' if success else 'error')
+            self._op_counts[key] = self._op_counts.get(key, 0) + 1
+            if op == 'search':
+                self._op_entries[op] = self._op_entries.get(op, 0) + entries
+                self._op_bytes[op] = self._op_bytes.get(op, 0) + size
+
+        # 背景執行緒 (批次匯入的工作線、鏡像同步) 沒有 app context，只計入全域統計
+        if has_app_context():
+            totals = g.get('_ldap_totals')
+            if totals is not None:
+                current = totals.setdefault(op, [0, 0.0, 0, 0])
+                current[0] += 1
+                current[1] += seconds
+                current[2] += entries
+                current[3] += size
+
+        if self.slow_op_ms and seconds * 1000 >= self.slow_op_ms:
+            from app.ad_ops import log
+            log(f"LDAP 慢操作 {op} {seconds * 1000:.1f}ms base={base} scope={scope} "
+                f"filter={filter_fingerprint(search_filter)} 筆數={entries} 位元組={size}")
+
+    # --- 每個請求 ---
+
+    def _start_request(self):
+        g._ldap_totals = {}
+        g._request_started = time.perf_counter()
+
+    def _finish_request(self, response):
+        started = g.get('_request_started')
+        totals = g.get('_ldap_totals')
+        if started is None or totals is None:
+            return response
+        elapsed = time.perf_counter() - started
+        ops = sum(t[0] for t in totals.values())
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            key = (endpoint, request.method)
+            if key not in self._request_durations:
+                self._request_durations[key] = _Histogram(DURATION_BUCKETS)
+            self._request_durations[key].observe(elapsed)
+            if endpoint not in self._request_ops:
+                self._request_ops[endpoint] = _Histogram(OPS_PER_REQUEST_BUCKETS)
+            self._request_ops[endpoint].observe(ops)
+
+        if self.server_timing:
+            # 串流回應 (匯出) 在這裡還沒真正查詢，只會記到已發生的部分
+            parts = [f'ldap;desc="{ops} ops, {sum(t[2] for t in totals.values())} entries";'
+                     f'dur={sum(t[1] for t in totals.values()) * 1000:.1f}']
+            parts += [f'ldap-{op};desc="{t[0]}";dur={t[1] * 1000:.1f}' for op, t in sorted(totals.items())]
+            parts.append(f'app;dur={elapsed * 1000:.1f}')
+            response.headers.add('Server-Timing', ', '.join(parts))
+        return response
+
+    def merge_request_totals(self, totals):
+        """把工作執行緒 (fanout) 的 LDAP 彙總併入目前請求"""
+        current = g.get('_ldap_totals') if has_app_context() else None
+        if current is None or not totals:
+            return
+        for op, (count, seconds, entries, size) in totals.items():
+            merged = current.setdefault(op, [0, 0.0, 0, 0])
+            merged[0] += count
+            merged[1] += seconds
+            merged[2] += entries
+            merged[3] += size
+
+    def request_summary(self):
+        """目前請求的 LDAP 彙總：{op: {'count', 'ms', 'entries', 'bytes'}}"""
+        totals = g.get('_ldap_totals') or {}
+        return {op: {'count': t[0], 'ms': round(t[1] * 1000, 3), 'entries': t[2], 'bytes': t[3]}
+                for op, t in totals.items()}
+
+    # --- Prometheus ---
+
+    def render_prometheus(self):
+        with self._lock:
+            lines = [
+                '# HELP ad_manager_ldap_operations_total LDAP operations by type and result.',
+                '# TYPE ad_manager_ldap_operations_total counter',
+            ]
+            lines += [f'ad_manager_ldap_operations_total{_labels([("op", op), ("result", result)])} {count}'
+                      for (op, result), count in sorted(self._op_counts.items())]
+            lines += [
+                '# HELP ad_manager_ldap_entries_total Entries returned by LDAP searches.',
+                '# TYPE ad_manager_ldap_entries_total counter',
+            ]
+            lines += [f'ad_manager_ldap_entries_total{_labels([("op", op)])} {count}'
+                      for op, count in sorted(self._op_entries.items())]
+            lines += [
+                '# HELP ad_manager_ldap_response_bytes_total Approximate size of LDAP search responses.',
+                '# TYPE ad_manager_ldap_response_bytes_total counter',
+            ]
+            lines += [f'ad_manager_ldap_response_bytes_total{_labels([("op", op)])} {size}'
+                      for op, size in sorted(self._op_bytes.items())]
+            lines += [
+                '# HELP ad_manager_ldap_operation_duration_seconds LDAP operation wall time.',
+                '# TYPE ad_manager_ldap_operation_duration_seconds histogram',
+            ]
+            for op, histogram in sorted(self._op_durations.items()):
+                lines += histogram.lines('ad_manager_ldap_operation_duration_seconds', [('op', op)])
+            lines += [
+                '# HELP ad_manager_http_request_duration_seconds HTTP request wall time.',
+                '# TYPE ad_manager_http_request_duration_seconds histogram',
+            ]
+            for (endpoint, method), histogram in sorted(self._request_durations.items()):
+                lines += histogram.lines('ad_manager_http_request_duration_seconds',
+                                         [('endpoint', endpoint), ('method', method)])
+            lines += [
+                '# HELP ad_manager_http_request_ldap_operations LDAP operations issued per HTTP request.',
+                '# TYPE ad_manager_http_request_ldap_operations histogram',
+            ]
+            for endpoint, histogram in sorted(self._request_ops.items()):
+                lines += histogram.lines('ad_manager_http_request_ldap_operations', [('endpoint', endpoint)])
+        lines += [
+            '# HELP ad_manager_process_start_time_seconds Start time of the process since unix epoch.',
+            '# TYPE ad_manager_process_start_time_seconds gauge',
+            f'ad_manager_process_start_time_seconds {_number(self._started)}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+ldap_metrics = LDAPMetrics()
+
+
+class InstrumentedConnection(Connection):
+    """
+    記錄每次操作到 ldap_metrics 的 ldap3 Connection (由連線池建立)
+    extra_controls：借出期間每個操作都附上的控制項 (例如 Proxied Authorization)，歸還時清空
+    """
+    extra_controls = ()
+
+    def _with_controls(self, kwargs):
+        if self.extra_controls:
+            kwargs['controls'] = list(kwargs.get('controls') or []) + list(self.extra_controls)
+        return kwargs
+
+    def _timed(self, op, call, base=None, search_filter=None, scope=None):
+        started = time.perf_counter()
+        completed = False
+        try:
+            outcome = call()
+            completed = True
+            return outcome
+        finally:
+            seconds = time.perf_counter() - started
+            # search 沒有結果時也會回傳 False，以 LDAP 結果碼判斷成功與否
+            success = completed and (self.result or {}).get('result') == 0
+            entries = size = 0
+            if op == 'search':
+                entries = len(self.response or ())
+                size = _response_size(self.response)
+            ldap_metrics.record(op, seconds, success, entries, size, base, search_filter, scope)
+
+    def bind(self, *args, **kwargs):
+        return self._timed('bind', lambda: super(InstrumentedConnection, self).bind(*args, **kwargs))
+
+    def search(self, search_base, search_filter, search_scope=SUBTREE, *args, **kwargs):
+        kwargs = self._with_controls(kwargs)
+        return self._timed('search',
+                           lambda: super(InstrumentedConnection, self).search(search_base, search_filter, search_scope,
+                                                                              *args, **kwargs),
+                           base=search_base, search_filter=search_filter,
+                           scope=SCOPE_NAMES.get(search_scope, search_scope))
+
+    def add(self, dn, *args, **kwargs):
+        kwargs = self._with_controls(kwargs)
+        return self._timed('add', lambda: super(InstrumentedConnection, self).add(dn, *args, **kwargs), base=dn)
+
+    def modify(self, dn, *args, **kwargs):
+        kwargs = self._with_controls(kwargs)
+        return self._timed('modify', lambda: super(InstrumentedConnection, self).modify(dn, *args, **kwargs), base=dn)
+
+    def delete(self, dn, *args, **kwargs):
+        kwargs = self._with_controls(kwargs)
+        return self._timed('delete', lambda: super(InstrumentedConnection, self).delete(dn, *args, **kwargs), base=dn)
+
+    def modify_dn(self, dn, *args, **kwargs):
+        kwargs = self._with_controls(kwargs)
+        return self._timed('modify_dn', lambda: super(InstrumentedConnection, self).modify_dn(dn, *args, **kwargs),
+                           base=dn)
@@ -0,0 +1,252 @@
+# app/ldap_pool.py
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from flask import g
+from ldap3 import BASE
+from ldap3.core.exceptions import LDAPException
+from app.dc_locator import dc_locator
+from app.ldap_metrics import InstrumentedConnection
+
+
+class PoolExhaustedError(Exception):
+    """連線池已滿且等待逾時"""
+
+
+class _PoolSlot:
+    """單一身分 (server + bind user) 的連線集合"""
+    __slots__ = ('idle', 'size')
+
+    def __init__(self):
+        self.idle = deque()  # (conn, last_used)，右端為最近歸還的連線
+        self.size = 0        # 此身分目前存活的連線數 (閒置 + 使用中 + 建立中)
+
+
+class LDAPConnectionPool:
+    """
+    以「伺服器 + 綁定帳號 + 路由 (read / write)」為 key 的 LDAP 連線池
+    - 每個身分最多 max_size 條連線，用完歸還而不是 unbind
+    - 批次作業的工作線 (lane=True) 另用一組名額 (最多 lane_max_size 條)，
+      大量匯入時不會佔滿同一個登入者網頁請求要用的連線
+    - 閒置超過 idle_timeout 的連線會被回收 (需小於 AD 的 MaxConnIdleTime，預設 900 秒)
+    - 閒置超過 health_check_interval 的連線在借出前先做一次 RootDSE 探測，失敗則重新綁定
+    """
+
+    def __init__(self, max_size=5, idle_timeout=300, acquire_timeout=10, health_check_interval=60, lane_max_size=4):
+        self.max_size = max_size
+        self.lane_max_size = lane_max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._slots = {}
+        self._checked_out = {}  # id(conn) -> key
+        self._cond = threading.Condition()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('LDAP_POOL_MAX_SIZE', self.max_size)
+        self.idle_timeout = app.config.get('LDAP_POOL_IDLE_TIMEOUT', self.idle_timeout)
+        self.acquire_timeout = app.config.get('LDAP_POOL_ACQUIRE_TIMEOUT', self.acquire_timeout)
+        self.health_check_interval = app.config.get('LDAP_POOL_HEALTH_CHECK_INTERVAL', self.health_check_interval)
+        self.lane_max_size = app.config.get('BULK_IMPORT_WORKERS', self.lane_max_size)
+        app.teardown_appcontext(self._release_request_connections)
+        atexit.register(self.close_all)
+
+    def _after_fork(self):
+        # gunicorn preload 時 worker 由 fork 產生：父行程的 socket 不能共用，也不能 unbind (會斷掉父行程的連線)，
+        # 直接丟掉引用重新開始
+        self._slots = {}
+        self._checked_out = {}
+        self._cond = threading.Condition()
+
+    # --- 建立連線 ---
+
+    def _open(self, server_addr, bind_user, bind_pass, route='read'):
+        # 多台 DC 時是依路由排序的 ServerPool (讀取找最近的 DC、寫入優先 PDC)，連不上的 DC 自動跳過
+        server = dc_locator.server_for(server_addr, route)
+        # 每次操作的耗時 / 筆數記到 ldap_metrics (/metrics、Server-Timing)
+        conn = InstrumentedConnection(server, user=bind_user, password=bind_pass, authentication='SIMPLE',
+                                      auto_bind=True, receive_timeout=dc_locator.receive_timeout)
+        dc_locator.connected(server, conn)
+        if dc_locator.needs_pdc():
+            dc_locator.resolve_pdc(conn)
+        return conn
+
+    # --- 健康檢查 ---
+
+    def _is_healthy(self, conn, bind_pass, idle_for):
+        if conn.password != bind_pass:
+            # 密碼已變更 (例如使用者重新登入)，舊連線不能再沿用
+            return False
+        if conn.closed or not conn.bound:
+            return self._rebind(conn)
+        if idle_for < self.health_check_interval:
+            return True
+        try:
+            # 讀取 RootDSE：最便宜的往返，只要伺服器有回應就代表連線仍可用
+            conn.search('', '(objectClass=*)', search_scope=BASE, attributes=['1.1'])
+            return True
+        except LDAPException:
+            return self._rebind(conn)
+
+    @staticmethod
+    def _rebind(conn):
+        try:
+            if not conn.closed:
+                conn.unbind()
+            conn.open()
+            return conn.bind()
+        except LDAPException:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    def _sweep_locked(self, now):
+        """移除閒置過久的連線，回傳需在鎖外關閉的連線"""
+        expired = []
+        for key in list(self._slots):
+            slot = self._slots[key]
+            while slot.idle and now - slot.idle[0][1] > self.idle_timeout:
+                expired.append(slot.idle.popleft()[0])
+                slot.size -= 1
+            if slot.size == 0:
+                del self._slots[key]
+        return expired
+
+    # --- 借出 / 歸還 ---
+
+    @staticmethod
+    def _key(server_addr, bind_user, route, lane):
+        return (server_addr, (bind_user or '').lower(), dc_locator.route_key(route), lane)
+
+    def available(self, server_addr, bind_user, route='read', lane=False):
+        """此身分目前不必等待就能借到的連線數 (閒置 + 尚未用完的名額)"""
+        key = self._key(server_addr, bind_user, route, lane)
+        limit = self.lane_max_size if lane else self.max_size
+        with self._cond:
+            slot = self._slots.get(key)
+            if slot is None:
+                return limit
+            return len(slot.idle) + max(limit - slot.size, 0)
+
+    def acquire(self, server_addr, bind_user, bind_pass, fresh=False, route='read', lane=False):
+        """
+        借出一條已綁定的連線
+        fresh=True 時一定重新建立並綁定 (用於登入時驗證密碼)
+        route='write' 時連到寫入用的 DC (PDC 優先)；只有一台 DC 時與讀取共用
+        lane=True 時從批次工作線的名額借出，與網頁請求的連線分開計算
+        """
+        route = dc_locator.route_key(route)
+        key = self._key(server_addr, bind_user, route, lane)
+        limit = self.lane_max_size if lane else self.max_size
+        deadline = time.monotonic() + self.acquire_timeout
+        reused = None
+        expired = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                expired.extend(self._sweep_locked(now))
+                slot = self._slots.setdefault(key, _PoolSlot())
+                if slot.idle and not fresh:
+                    reused = slot.idle.pop()
+                    break
+                if slot.size < limit:
+                    slot.size += 1
+                    break
+                if fresh and slot.idle:
+                    # 已達上限但有閒置連線：丟掉最舊的一條，空出名額給新連線
+                    expired.append(slot.idle.popleft()[0])
+                    break
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"LDAP 連線池已滿 ({limit})：{bind_user}")
+                self._cond.wait(remaining)
+
+        for old in expired:
+            self._close(old)
+
+        if reused is not None:
+            conn, last_used = reused
+            if self._is_healthy(conn, bind_pass, time.monotonic() - last_used):
+                self._checked_out[id(conn)] = key
+                return conn
+            self._close(conn)
+
+        try:
+            conn = self._open(server_addr, bind_user, bind_pass, route)
+        except Exception:
+            with self._cond:
+                slot = self._slots.get(key)
+                if slot is not None:
+                    slot.size -= 1
+                    if slot.size == 0 and not slot.idle:
+                        del self._slots[key]
+                self._cond.notify()
+            raise
+        self._checked_out[id(conn)] = key
+        return conn
+
+    def release(self, conn, discard=False):
+        key = self._checked_out.pop(id(conn), None)
+        if getattr(conn, 'extra_controls', None):
+            # 借出者附加的控制項 (代理授權身分) 不能留給下一個借用者
+            conn.extra_controls = ()
+        if key is None:
+            self._close(conn)
+            return
+        discard = discard or conn.closed or not conn.bound
+        with self._cond:
+            slot = self._slots.setdefault(key, _PoolSlot())
+            if discard:
+                slot.size -= 1
+            else:
+                slot.idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard:
+            self._close(conn)
+
+    def close_all(self):
+        with self._cond:
+            conns = [conn for slot in self._slots.values() for conn, _ in slot.idle]
+            self._slots.clear()
+            self._checked_out.clear()
+            self._cond.notify_all()
+        for conn in conns:
+            self._close(conn)
+
+    # --- 與 Flask 請求綁定 ---
+
+    def connection_for_request(self, server_addr, bind_user, bind_pass, route='read'):
+        """
+        同一個請求 (app context) 內共用一條連線 (讀、寫各一條)，請求結束時自動歸還
+        """
+        conns = g.setdefault('_ldap_connections', {})
+        route = dc_locator.route_key(route)
+        key = (server_addr, (bind_user or '').lower(), route)
+        conn = conns.get(key)
+        if conn is not None and conn.password == bind_pass:
+            return conn
+        if conn is not None:
+            self.release(conn)
+        conn = self.acquire(server_addr, bind_user, bind_pass, route=route)
+        conns[key] = conn
+        return conn
+
+    def _release_request_connections(self, exc=None):
+        conns = g.pop('_ldap_connections', None)
+        if not conns:
+            return
+        for conn in conns.values():
+            # LDAP 例外後連線狀態不明，直接丟棄
+            self.release(conn, discard=isinstance(exc, LDAPException))
+
+
+ldap_pool = LDAPConnectionPool()
@@ -0,0 +1,145 @@
+# app/reports.py
+# 清理用報表：久未登入的使用者 / 電腦、已停用帳號、密碼永不過期
+# 條件全部推到 LDAP filter (lastLogonTimestamp<=、userAccountControl 位元比對規則)，
+# DC 只回傳符合的物件；結果整份放入快取，翻頁只是切片
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from app.ad_ops import DIRECTORY_LISTINGS, get_ad_connection, paged_search, _cache_key
+from app.cache import directory_cache
+from app.uac import UF_ACCOUNTDISABLE, UF_DONT_EXPIRE_PASSWORD, decode_uac, is_enabled, uac_filter
+
+FILETIME_EPOCH_OFFSET = 11644473600  # 1601-01-01 到 1970-01-01 的秒數
+FILETIME_NEVER = (0, 0x7FFFFFFFFFFFFFFF)
+
+
+def _to_filetime(moment):
+    return int((moment.timestamp() + FILETIME_EPOCH_OFFSET) * 10 ** 7)
+
+
+def _from_filetime(raw):
+    value = int(raw)
+    if value in FILETIME_NEVER:
+        return None
+    return datetime.fromtimestamp(value / 10 ** 7 - FILETIME_EPOCH_OFFSET, tz=timezone.utc)
+
+
+def _from_generalized_time(raw):
+    return datetime.strptime(raw[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+
+def _raw(entry, attribute):
+    """取原始字串值 (不依賴 schema：沒有載入 schema 時 .value 不會轉成 datetime)"""
+    if attribute not in entry or not entry[attribute].raw_values:
+        return None
+    raw = entry[attribute].raw_values[0]
+    return raw.decode('utf-8') if isinstance(raw, bytes) else str(raw)
+
+
+def _stale_filter(base_filter, cutoff):
+    """
+    已啟用、且 lastLogonTimestamp 早於 cutoff；從未登入 (沒有 lastLogonTimestamp) 的帳號以建立時間判斷，
+    避免剛建立的帳號被列入
+    """
+    return (f"(&{base_filter}{uac_filter(UF_ACCOUNTDISABLE, False)}"
+            f"(|(lastLogonTimestamp<={_to_filetime(cutoff)})"
+            f"(&(!(lastLogonTimestamp=*))(whenCreated<={cutoff.strftime('%Y%m%d%H%M%S')}.0Z))))")
+
+
+# 報表定義：kind 決定 base filter 與快取失效標籤；stale 的報表需要天數 (依最後登入時間由舊到新排序)
+REPORTS = {
+    'stale_users': {'kind': 'users', 'stale': True, 'label': '久未登入的使用者'},
+    'stale_computers': {'kind': 'computers', 'stale': True, 'label': '久未登入的電腦'},
+    'disabled_users': {'kind': 'users', 'flag': UF_ACCOUNTDISABLE, 'label': '已停用的使用者'},
+    'disabled_computers': {'kind': 'computers', 'flag': UF_ACCOUNTDISABLE, 'label': '已停用的電腦'},
+    'password_never_expires': {'kind': 'users', 'flag': UF_DONT_EXPIRE_PASSWORD, 'label': '密碼永不過期的使用者'},
+}
+REPORT_ATTRIBUTES = {
+    'users': ['sAMAccountName', 'displayName'],
+    'computers': ['cn', 'operatingSystem'],
+}
+TIMESTAMP_ATTRIBUTES = ['userAccountControl', 'lastLogonTimestamp', 'pwdLastSet', 'whenCreated']
+
+
+def _report_filter(report, cutoff):
+    base_filter = DIRECTORY_LISTINGS[report['kind']]['filter']
+    if report.get('stale'):
+        return _stale_filter(base_filter, cutoff)
+    return f"(&{base_filter}{uac_filter(report['flag'])})"
+
+
+def _report_row(kind, entry, now):
+    name_attr, detail_attr = REPORT_ATTRIBUTES[kind]
+    uac = int(_raw(entry, 'userAccountControl') or 0)
+    last_logon = _from_filetime(_raw(entry, 'lastLogonTimestamp') or 0)
+    pwd_last_set = _from_filetime(_raw(entry, 'pwdLastSet') or 0)
+    created = _raw(entry, 'whenCreated')
+    created = _from_generalized_time(created) if created else None
+    return {
+        'name': _raw(entry, name_attr),
+        detail_attr: _raw(entry, detail_attr),
+        'dn': entry.entry_dn,
+        'enabled': is_enabled(uac),
+        'flags': list(decode_uac(uac)),
+        'last_logon': last_logon.isoformat() if last_logon else None,
+        'inactive_days': (now - (last_logon or created)).days if (last_logon or created) else None,
+        'pwd_last_set': pwd_last_set.isoformat() if pwd_last_set else None,
+        'created': created.isoformat() if created else None,
+    }
+
+
+def _run_report(name, days):
+    report = REPORTS[name]
+    kind = report['kind']
+    now = datetime.now(timezone.utc)
+    # cutoff 取到當天 00:00 (UTC)：同一天內同樣的天數共用一份快取
+    cutoff = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days) if days else None
+    conn = get_ad_connection()
+    base_dn = current_app.config.get('AD_BASEDN')
+    started = time.perf_counter()
+    # 報表要完整：不套用 LDAP_MAX_RESULTS
+    rows = [_report_row(kind, entry, now)
+            for entry in paged_search(conn, base_dn, _report_filter(report, cutoff),
+                                      attributes=REPORT_ATTRIBUTES[kind] + TIMESTAMP_ATTRIBUTES, max_results=0)]
+    if report.get('stale'):
+        # 從未登入的排最前面，其餘依最後登入時間由舊到新
+        rows.sort(key=lambda r: (r['last_logon'] is not None, r['last_logon'] or '', (r['name'] or '').lower()))
+    else:
+        rows.sort(key=lambda r: (r['name'] or '').lower())
+    return {
+        'items': rows,
+        'generated_at': now.isoformat(),
+        'cutoff': cutoff.isoformat() if cutoff else None,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def run_report(name, days=None, page=1, per_page=None):
+    """
+    取得報表的一頁 (報表名稱見 REPORTS)
+    - stale_* 報表的 days 預設 REPORT_STALE_DAYS；lastLogonTimestamp 在 DC 之間最多延遲約 14 天複寫，
+      天數太小時結果不準
+    - 整份結果快取 REPORT_CACHE_TTL 秒，對應的使用者 / 電腦有寫入時失效
+    """
+    report = REPORTS[name]
+    days = max(int(days or current_app.config.get('REPORT_STALE_DAYS', 90)), 1) if report.get('stale') else None
+    per_page = min(max(int(per_page or current_app.config.get('DASHBOARD_PAGE_SIZE', 50)), 1), 500)
+    page = max(int(page or 1), 1)
+    result = directory_cache.get_or_load(
+        _cache_key('report', name, days), lambda: _run_report(name, days),
+        tags=(report['kind'], 'reports'), ttl=current_app.config.get('REPORT_CACHE_TTL', 300))
+    total = len(result['items'])
+    start = (page - 1) * per_page
+    return {
+        'report': name,
+        'label': report['label'],
+        'days': days,
+        'items': result['items'][start:start + per_page],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': max((total + per_page - 1) // per_page, 1),
+        'generated_at': result['generated_at'],
+        'cutoff': result['cutoff'],
+        'seconds': result['seconds'],
+    }
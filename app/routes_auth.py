@@ -1,5 +1,6 @@
 # app/routes_auth.py
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session # <--- 新增 session
+import time
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app # <--- 新增 session
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
 from ldap3.utils.conv import escape_filter_chars
 from app.ad_ops import verify_ad_login
@@ -23,7 +24,10 @@ def login():
             user = User(id=username)
             login_user(user)
             session['ad_user_account'] = username
-            session['ad_user_password'] = password
+            session['authz_checked_at'] = time.time()
+            # service 模式由服務帳號連線，Session 不需要 (也不應該) 保存密碼
+            if current_app.config.get('AD_BIND_MODE', 'user') != 'service':
+                session['ad_user_password'] = password
             return redirect(url_for('dashboard.index'))
         else:
             # 如果是權限不足，msg 會顯示 "權限不足：您不具備 Domain Admins 權限"
@@ -37,5 +41,6 @@ def logout():
     # 登出時務必清除 Session 中的敏感資料
     session.pop('ad_user_account', None)
     session.pop('ad_user_password', None)
+    session.pop('authz_checked_at', None)
     logout_user()
     return redirect(url_for('auth.login'))
\ No newline at end of file
@@ -1,55 +1,286 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, session
+import io
+import time
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, session, jsonify, Response, stream_with_context
 # 引入 ad_ops 所有功能 (包含我們剛修好的 DNS 功能)
 from app.ad_ops import *
-from flask_login import login_required  # <--- 必須有這一行
+from flask_login import login_required, logout_user  # <--- 必須有這一行
 
 bp = Blueprint('dashboard', __name__, url_prefix='/dashboard')
 
+@bp.before_request
+def recheck_authorization():
+    """
+    service 模式下授權只在登入時檢查，這裡每 AUTHZ_RECHECK_INTERVAL 秒以服務帳號重新確認一次
+    使用者被移出 Domain Admins 後，最慢在一個間隔內失去存取權
+    """
+    if current_app.config.get('AD_BIND_MODE', 'user') != 'service' or 'ad_user_account' not in session:
+        return None
+    interval = current_app.config.get('AUTHZ_RECHECK_INTERVAL', 300)
+    if not interval or time.time() - session.get('authz_checked_at', 0) < interval:
+        return None
+    try:
+        allowed = check_user_authorization(session['ad_user_account'])
+    except Exception as e:
+        # DC 暫時無法連線時不踢出使用者，下一個請求再試
+        log(f"授權複查失敗: {e}")
+        return None
+    if allowed:
+        session['authz_checked_at'] = time.time()
+        return None
+    log(f"授權複查：使用者 {session['ad_user_account']} 已不具備權限，強制登出")
+    session.pop('ad_user_account', None)
+    session.pop('authz_checked_at', None)
+    logout_user()
+    if request.path.startswith(bp.url_prefix + '/api/'):
+        return jsonify({'error': "權限不足：您已不具備 Domain Admins 權限"}), 403
+    flash("權限不足：您已不具備 Domain Admins 權限", 'danger')
+    return redirect(url_for('auth.login'))
+
 @bp.route('/')
 @login_required
 def index():
-    # 改從 session 讀取，URL 參數僅作為 fallback (可視需求移除)
-    selected_group_name = session.get('selected_group')
-    selected_zone_dn = session.get('selected_zone')
-    
-    # 初始化變數
-    group_members = []
-    dns_records = []  # <--- [新增]
-    users, groups, computers, zones = [], [], [], [] # <--- [新增] zones 初始化
+    # 只回傳頁面框架 (不做任何 LDAP 查詢)，各分頁籤的資料由前端透過 /dashboard/api/* 按需載入
+    return render_template('dashboard.html',
+                            selected_group=session.get('selected_group'),
+                            selected_zone=session.get('selected_zone'))
+
+# --- JSON API (每個分頁籤一個端點) ---
+
+def _api_error(e):
+    return jsonify({'error': f"讀取 AD 資料失敗: {str(e)}"}), 502
 
-    #group_members = get_group_members_with_details(selected_group_name) if selected_group_name else []
-    #dns_records = get_dns_records(selected_zone_dn) if selected_zone_dn else []
+def _listing_args():
+    """讀取列表參數 (page / per_page / sort / desc / q)"""
+    return {
+        'page': request.args.get('page', 1, type=int),
+        'per_page': request.args.get('per_page', type=int),
+        'sort': request.args.get('sort'),
+        'desc': request.args.get('desc') == '1',
+        'q': request.args.get('q', '').strip(),
+    }
 
+@bp.route('/api/users')
+@login_required
+def api_users():
     try:
-        # 讀取基本資料
-        users = get_all_users()
-        groups = get_all_groups()
-        computers = get_all_computers()
-        zones = get_dns_zones() # <--- [關鍵修正] 呼叫後端抓取 DNS 區域！
-        
-        # 2. 如果有選取群組，就去抓成員
-        if selected_group_name:
-            group_members = get_group_members_with_details(selected_group_name)
-            
-        # 3. [新增] 如果有選取 DNS 區域，就去抓紀錄
-        if selected_zone_dn:
-            dns_records = get_dns_records(selected_zone_dn)
-            
+        return jsonify(query_directory_page('users', **_listing_args()))
     except Exception as e:
-        flash(f"讀取 AD 資料失敗: {str(e)}", "danger")
-        # 發生錯誤時保持空陣列，避免頁面崩潰
-        users, groups, computers, zones = [], [], [], []
-        
-    # 4. 把資料傳給前端
-    return render_template('dashboard.html', 
-                            users=users, 
-                            groups=groups, 
-                            computers=computers,
-                            zones=zones,
-                            group_members=group_members,
-                            selected_group=selected_group_name,
-                            selected_zone=selected_zone_dn,
-                            dns_records=dns_records)
+        return _api_error(e)
+
+@bp.route('/api/groups')
+@login_required
+def api_groups():
+    try:
+        return jsonify(query_directory_page('groups', **_listing_args()))
+    except Exception as e:
+        return _api_error(e)
+
+@bp.route('/api/computers')
+@login_required
+def api_computers():
+    try:
+        return jsonify(query_directory_page('computers', **_listing_args()))
+    except Exception as e:
+        return _api_error(e)
+
+@bp.route('/api/zones')
+@login_required
+def api_zones():
+    try:
+        return jsonify({'items': get_dns_zones()})
+    except Exception as e:
+        return _api_error(e)
+
+@bp.route('/api/group_members')
+@login_required
+def api_group_members():
+    group_name = request.args.get('group', '').strip()
+    if not group_name:
+        return jsonify({'error': '缺少群組名稱'}), 400
+    # 記住選取的群組，操作後導回儀表板時可自動還原
+    session['selected_group'] = group_name
+    try:
+        return jsonify({'group': group_name, 'items': get_group_members_with_details(group_name)})
+    except Exception as e:
+        return _api_error(e)
+
+@bp.route('/api/dns_records')
+@login_required
+def api_dns_records():
+    zone_dn = request.args.get('zone', '').strip()
+    if not zone_dn:
+        return jsonify({'error': '缺少 DNS 區域'}), 400
+    session['selected_zone'] = zone_dn
+    try:
+        return jsonify({'zone': zone_dn, 'items': get_dns_records(zone_dn)})
+    except Exception as e:
+        return _api_error(e)
+
+# 首次載入用的批次端點：一次回傳多個區塊，後端並行查詢 (延遲取最慢的一塊，而不是全部相加)
+BATCH_PARTS = ('users', 'groups', 'computers', 'zones', 'group_members', 'dns_records')
+
+@bp.route('/api/batch')
+@login_required
+def api_batch():
+    parts = [p for p in request.args.get('parts', '').split(',') if p]
+    unknown = [p for p in parts if p not in BATCH_PARTS]
+    if not parts or unknown:
+        return jsonify({'error': f"不支援的區塊: {', '.join(unknown) or '(未指定)'}"}), 400
+    group_name = request.args.get('group', '').strip()
+    zone_dn = request.args.get('zone', '').strip()
+
+    calls = {}
+    for part in parts:
+        if part in DIRECTORY_LISTINGS:
+            calls[part] = lambda kind=part: query_directory_page(kind)
+        elif part == 'zones':
+            calls[part] = lambda: {'items': get_dns_zones()}
+        elif part == 'group_members' and group_name:
+            calls[part] = lambda: {'group': group_name, 'items': get_group_members_with_details(group_name)}
+        elif part == 'dns_records' and zone_dn:
+            calls[part] = lambda: {'zone': zone_dn, 'items': get_dns_records(zone_dn)}
+
+    from app.fanout import fanout
+    started = time.perf_counter()
+    results, errors, timings = fanout.run(calls)
+    return jsonify({
+        'results': results,
+        'errors': {part: f"讀取 AD 資料失敗: {msg}" for part, msg in errors.items()},
+        'timings': timings,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    })
+
+@bp.route('/api/dns_search')
+@login_required
+def api_dns_search():
+    # 以記憶體中的反查索引回答「誰用了 10.1.2.3」「web-* 有哪些名稱」，不必重掃整個區域
+    zone_dn = request.args.get('zone', '').strip()
+    q = request.args.get('q', '').strip()
+    if not zone_dn or not q:
+        return jsonify({'error': '缺少 DNS 區域或搜尋條件'}), 400
+    from app.dns_index import dns_index
+    try:
+        result = dns_index.search(zone_dn, q, request.args.get('limit', type=int))
+    except Exception as e:
+        return _api_error(e)
+    return jsonify(dict(result, zone=zone_dn, q=q))
+
+# --- 巢狀群組 (記憶體中的群組關係圖) ---
+
+@bp.route('/api/group_effective')
+@login_required
+def api_group_effective():
+    group_name = request.args.get('group', '').strip()
+    if not group_name:
+        return jsonify({'error': '缺少群組名稱'}), 400
+    from app.group_graph import group_graph
+    try:
+        items = group_graph.effective_members(group_name, include_groups=request.args.get('groups') != '0')
+    except Exception as e:
+        return _api_error(e)
+    if items is None:
+        return jsonify({'error': f"找不到群組 {group_name}"}), 404
+    return jsonify({'group': group_name, 'items': items, 'total': len(items), 'graph': group_graph.stats()})
+
+@bp.route('/api/group_path')
+@login_required
+def api_group_path():
+    # 「X 為什麼在 Y 裡」：回傳最短的群組巢狀路徑
+    group_name = request.args.get('group', '').strip()
+    member = request.args.get('member', '').strip()
+    if not group_name or not member:
+        return jsonify({'error': '缺少群組或成員名稱'}), 400
+    from app.group_graph import group_graph
+    try:
+        member_dn = group_graph.resolve_member(member)
+        path = group_graph.explain(member_dn, group_name) if member_dn else None
+    except Exception as e:
+        return _api_error(e)
+    if member_dn is None:
+        return jsonify({'error': f"找不到使用者或群組 {member}"}), 404
+    return jsonify({'group': group_name, 'member': member, 'is_member': path is not None, 'path': path or []})
+
+@bp.route('/api/member_groups')
+@login_required
+def api_member_groups():
+    # 使用者 (或群組) 直接與間接所屬的群組
+    member = request.args.get('member', '').strip()
+    if not member:
+        return jsonify({'error': '缺少使用者或群組名稱'}), 400
+    from app.group_graph import group_graph
+    try:
+        member_dn = group_graph.resolve_member(member)
+        items = group_graph.groups_of(member_dn) if member_dn else None
+    except Exception as e:
+        return _api_error(e)
+    if items is None:
+        return jsonify({'error': f"找不到使用者或群組 {member}"}), 404
+    return jsonify({'member': member, 'dn': member_dn, 'items': items, 'total': len(items)})
+
+@bp.route('/api/group_cycles')
+@login_required
+def api_group_cycles():
+    from app.group_graph import group_graph
+    try:
+        return jsonify({'cycles': group_graph.cycles(), 'graph': group_graph.stats()})
+    except Exception as e:
+        return _api_error(e)
+
+@bp.route('/api/reports/<name>')
+@login_required
+def api_report(name):
+    from app.reports import REPORTS, run_report
+    if name not in REPORTS:
+        return jsonify({'error': f"不支援的報表: {name}"}), 400
+    try:
+        return jsonify(run_report(name, days=request.args.get('days', type=int),
+                                  page=request.args.get('page', 1, type=int),
+                                  per_page=request.args.get('per_page', type=int)))
+    except Exception as e:
+        return _api_error(e)
+
+# --- 背景工作 (提交由各匯入端點負責，這裡查詢進度 / 取消) ---
+
+def _visible_job(job_id):
+    """只看得到自己提交的工作"""
+    from app.jobs import job_queue
+    job = job_queue.get(job_id)
+    if job is None or job.owner != session.get('ad_user_account'):
+        return None
+    return job
+
+@bp.route('/api/jobs')
+@login_required
+def api_jobs():
+    from app.jobs import job_queue
+    items = [dict(job.to_dict(), result=None) for job in job_queue.list(owner=session.get('ad_user_account'))]
+    return jsonify({'items': items, 'queue': job_queue.status()})
+
+@bp.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'error': "找不到工作"}), 404
+    return jsonify(job.to_dict())
+
+@bp.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    from app.jobs import job_queue
+    job = _visible_job(job_id)
+    if job is None:
+        return jsonify({'error': "找不到工作"}), 404
+    ok, msg = job_queue.cancel(job_id)
+    if not ok:
+        return jsonify({'error': msg}), 409
+    return jsonify(dict(job.to_dict(), message=msg))
+
+@bp.route('/api/sync_status')
+@login_required
+def api_sync_status():
+    from app.dir_sync import directory_mirror
+    return jsonify(directory_mirror.status())
 
 # --- 使用者操作 ---
 @bp.route('/user/add', methods=['POST'])
@@ -63,6 +294,34 @@ def add_user():
     flash(msg, "success" if success else "danger")
     return redirect(url_for('dashboard.index'))
 
+@bp.route('/user/import', methods=['POST'])
+@login_required
+def import_users_file():
+    """
+    批次匯入使用者 (CSV / JSONL)
+    只驗證時直接回傳結果；實際寫入交給背景工作，回傳 202 與工作編號 (由 /api/jobs/<id> 輪詢進度與結果)
+    """
+    from app.bulk_ops import BulkImportError, parse_user_rows, import_users, detect_format
+    from app.jobs import job_queue
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': "請選擇要匯入的檔案"}), 400
+    fmt = request.form.get('format') or detect_format(upload.filename)
+    dry_run = request.form.get('dry_run') == '1'
+    try:
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        rows = parse_user_rows(stream, fmt)
+    except (BulkImportError, UnicodeDecodeError) as e:
+        return jsonify({'error': f"匯入檔格式錯誤: {str(e)}"}), 400
+    if not dry_run:
+        job = job_queue.submit('import_users', {'rows': rows}, label=f"匯入使用者 {upload.filename} ({len(rows)} 列)")
+        return jsonify({'job': job.to_dict()}), 202
+    try:
+        report = import_users(rows, dry_run=True)
+    except Exception as e:
+        return _api_error(e)
+    return jsonify(report), (400 if report['errors'] else 200)
+
 @bp.route('/object/delete', methods=['POST'])
 def delete_object():
     dn = request.form.get('dn')
@@ -128,6 +387,65 @@ def delete_dns():
 
     return redirect(url_for('dashboard.index') + '#dns')
 
+@bp.route('/dns/export')
+@login_required
+def export_dns_zone():
+    """串流匯出區域紀錄 (format=bind 或 csv)"""
+    from app.dns_bulk import export_zone, zone_name_from_dn, ZONE_FILE_FORMATS
+    zone_dn = request.args.get('zone', '').strip()
+    fmt = request.args.get('format', 'bind')
+    if not zone_dn or fmt not in ZONE_FILE_FORMATS:
+        return jsonify({'error': "缺少區域或格式不正確"}), 400
+    filename = f"{zone_name_from_dn(zone_dn)}.{'csv' if fmt == 'csv' else 'zone'}"
+    return Response(stream_with_context(export_zone(zone_dn, fmt)),
+                    mimetype='text/csv' if fmt == 'csv' else 'text/plain',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@bp.route('/export/<kind>')
+@login_required
+def export_directory_objects(kind):
+    """串流匯出使用者 / 群組 (含成員) / 電腦 (format=csv 或 jsonl，q 與列表搜尋相同)"""
+    from app.directory_export import export_directory, EXPORT_KINDS, EXPORT_FORMATS
+    fmt = request.args.get('format', 'csv')
+    if kind not in EXPORT_KINDS or fmt not in EXPORT_FORMATS:
+        return jsonify({'error': "不支援的匯出類型或格式"}), 400
+    q = request.args.get('q', '').strip()
+    return Response(stream_with_context(export_directory(kind, fmt, q)),
+                    mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename="{kind}.{fmt}"',
+                             'X-Accel-Buffering': 'no'})  # 反向代理 (nginx) 不要先緩衝整個回應
+
+@bp.route('/dns/import', methods=['POST'])
+@login_required
+def import_dns_zone():
+    """以差異方式匯入區域紀錄 (BIND zone file 或 CSV)；只列出變更時直接回傳，實際寫入交給背景工作 (回傳 202)"""
+    from app.dns_bulk import ZoneFileError, parse_zone_file, import_zone, zone_name_from_dn, detect_zone_format
+    from app.jobs import job_queue
+    zone_dn = request.form.get('zone_dn', '').strip()
+    upload = request.files.get('file')
+    if not zone_dn or not upload or not upload.filename:
+        return jsonify({'error': "請選擇區域與要匯入的檔案"}), 400
+    fmt = request.form.get('format') or detect_zone_format(upload.filename)
+    session['selected_zone'] = zone_dn
+    try:
+        stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        records, errors, skipped = parse_zone_file(stream, zone_name_from_dn(zone_dn), fmt)
+    except (ZoneFileError, UnicodeDecodeError) as e:
+        return jsonify({'error': f"匯入檔格式錯誤: {str(e)}"}), 400
+    if errors:
+        return jsonify({'errors': errors, 'skipped': skipped}), 400
+    prune = request.form.get('prune') == '1'
+    if request.form.get('dry_run') != '1':
+        job = job_queue.submit('import_zone', {'zone_dn': zone_dn, 'records': records, 'prune': prune},
+                               label=f"匯入 DNS {zone_name_from_dn(zone_dn)} ({upload.filename})")
+        return jsonify({'job': job.to_dict(), 'skipped': skipped}), 202
+    try:
+        report = import_zone(zone_dn, records, prune=prune, dry_run=True)
+    except Exception as e:
+        return _api_error(e)
+    report['skipped'] = skipped
+    return jsonify(report), (400 if report['errors'] else 200)
+
 @bp.route('/user/reset_password', methods=['POST'])
 @login_required # 確保只有登入者能操作
 def reset_password():
@@ -1,4 +1,7 @@
-from flask import Blueprint, redirect, url_for, current_app
+import hmac
+import ipaddress
+from flask import Blueprint, redirect, url_for, current_app, request, Response, abort
+from app.ldap_metrics import ldap_metrics
 
 bp = Blueprint('main', __name__)
 
@@ -11,4 +14,22 @@ def index():
     # 2. 如果沒有設定 -> 導向初始化精靈
         
     # 3. 如果有設定 -> 導向 Dashboard (會觸發 Login 驗證)
-    return redirect(url_for('auth.login'))
\ No newline at end of file
+    return redirect(url_for('auth.login'))
+
+def _is_loopback(addr):
+    try:
+        return ipaddress.ip_address(addr or '').is_loopback
+    except ValueError:
+        return False
+
+@bp.route('/metrics')
+def metrics():
+    # Prometheus 抓取端點 (不走登入流程)：
+    # 設定 METRICS_TOKEN 時需帶 Bearer token；沒有 token 時只接受本機連線，METRICS_ALLOW_REMOTE=true 才對外開放
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            abort(401)
+    elif not current_app.config.get('METRICS_ALLOW_REMOTE') and not _is_loopback(request.remote_addr):
+        abort(403)
+    return Response(ldap_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,220 @@
+# app/session_store.py
+# Server-side Session 後端 (SESSION_BACKEND)：
+# - memory：行程內 LRU (預設)，Session 讀寫不碰磁碟
+# - redis：多個 worker / 容器共用 (需安裝 redis 套件，任何 Redis 相容服務皆可)；
+#   SESSION_REDIS_URL=memory:// 改用行程內的 MemoryRedis，不需 redis 套件 (開發 / 測試用)
+# - filesystem：舊行為，寫在 flask_session 目錄
+# memory 與 redis 都走 Flask-Session 的 cachelib 介面：Session 一律以 msgpack 序列化，
+# 並套用同樣的大小上限 (SESSION_MAX_BYTES)
+import logging
+import time
+from datetime import timedelta
+from fnmatch import fnmatchcase
+import msgspec
+from cachelib.base import BaseCache
+from flask_session import Session
+from app.cache import TTLCache
+
+SESSION_BACKENDS = ('memory', 'redis', 'filesystem')
+log = logging.getLogger(__name__)
+
+
+class SessionTooLargeError(RuntimeError):
+    """Session 序列化後超過 SESSION_MAX_BYTES，無法寫入"""
+
+
+class _SweepMixin:
+    """每 sweep_interval 秒順便清掉 self._cache 裡過期的項目 (平常只在讀到時才清)"""
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self._cache.sweep()
+
+
+class _SerializedStore(BaseCache):
+    """
+    Session 儲存的共用部分 (cachelib 介面)
+    - 存 msgpack 序列化後的 bytes：佔用小，也不會和請求中的 dict 互相影響
+    - 序列化後超過 max_bytes 的 Session 不寫入：記 warning 並丟出 SessionTooLargeError，
+      讓這個請求以錯誤結束，而不是默默丟掉 Session 的變更 (看起來像被登出或訊息消失)；0 = 不限制
+    - 子類別實作 _get_raw / _set_raw / delete / has / clear
+    """
+
+    def __init__(self, default_timeout=28800, max_bytes=16384):
+        super().__init__(default_timeout=default_timeout)
+        self._encoder = msgspec.msgpack.Encoder()
+        self._decoder = msgspec.msgpack.Decoder()
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        data = self._get_raw(key)
+        return self._decoder.decode(data) if data is not None else None
+
+    def set(self, key, value, timeout=None):
+        data = self._encoder.encode(value)
+        if self.max_bytes and len(data) > self.max_bytes:
+            log.warning("Session %s 序列化後 %d bytes，超過上限 %d，不寫入", key, len(data), self.max_bytes)
+            raise SessionTooLargeError(f"Session 大小 {len(data)} bytes 超過上限 {self.max_bytes} (SESSION_MAX_BYTES)")
+        # cachelib 的 0 代表永不過期，這裡以預設壽命為上限避免無限累積
+        self._set_raw(key, data, self._normalize_timeout(timeout) or self.default_timeout)
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout)
+
+
+class MemorySessionStore(_SweepMixin, _SerializedStore):
+    """
+    行程內的 Session 儲存
+    - 超過 max_entries 時淘汰最久未使用的 Session；每 sweep_interval 秒順便清掉過期項目
+    - 只在單一行程內有效，多個 gunicorn worker 或多個容器請改用 redis
+    """
+
+    def __init__(self, max_entries=10000, default_timeout=28800, sweep_interval=60, max_bytes=16384):
+        super().__init__(default_timeout=default_timeout, max_bytes=max_bytes)
+        self._cache = TTLCache(max_entries=max_entries, ttl=default_timeout)
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    def _get_raw(self, key):
+        return self._cache.get(key)
+
+    def _set_raw(self, key, data, timeout):
+        self._maybe_sweep()
+        self._cache.set(key, data, ttl=timeout)
+
+    def delete(self, key):
+        return self._cache.delete(key)
+
+    def has(self, key):
+        return self._cache.get(key) is not None
+
+    def clear(self):
+        self._cache.clear()
+        return True
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class RedisSessionStore(_SerializedStore):
+    """
+    以 Redis 相容服務儲存 Session (client 為 redis.Redis 或 MemoryRedis)
+    - 過期交給 Redis 的 EX 處理，不需要自己清理
+    - clear() 只刪除 key_prefix 開頭的 key，不影響同一個 DB 裡的其他資料
+    """
+
+    def __init__(self, client, default_timeout=28800, max_bytes=16384, key_prefix='ad-manager:'):
+        super().__init__(default_timeout=default_timeout, max_bytes=max_bytes)
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def _get_raw(self, key):
+        return self.client.get(self.key_prefix + key)
+
+    def _set_raw(self, key, data, timeout):
+        self.client.set(self.key_prefix + key, data, ex=int(timeout))
+
+    def delete(self, key):
+        return bool(self.client.delete(self.key_prefix + key))
+
+    def has(self, key):
+        return bool(self.client.exists(self.key_prefix + key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.key_prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+        return True
+
+
+class MemoryRedis(_SweepMixin):
+    """
+    行程內的 Redis 替身 (只實作 RedisSessionStore 用到的指令及幾個輔助指令)
+    - SESSION_REDIS_URL=memory:// 時使用，開發或測試 redis 後端時不需要真的 Redis 服務
+    - 值一律存成 bytes，和 redis-py 的回傳型別一致；沒有 ex / px 的 key 以 default_ttl 為上限
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=28800, sweep_interval=60):
+        self._cache = TTLCache(max_entries=max_entries, ttl=default_ttl)
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _bytes(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def ping(self):
+        return True
+
+    def get(self, name):
+        return self._cache.get(name)
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        self._maybe_sweep()
+        exists = self.exists(name)
+        if (nx and exists) or (xx and not exists):
+            return None
+        ttl = ex.total_seconds() if isinstance(ex, timedelta) else ex
+        if px is not None:
+            ttl = px / 1000
+        self._cache.set(name, self._bytes(value), ttl=ttl or self.default_ttl)
+        return True
+
+    def delete(self, *names):
+        return sum(1 for name in names if self._cache.delete(name))
+
+    def exists(self, *names):
+        return sum(1 for name in names if self._cache.get(name) is not None)
+
+    def scan_iter(self, match='*'):
+        for name in list(self._cache._data):
+            if fnmatchcase(name, match) and self._cache.get(name) is not None:
+                yield name
+
+    def flushdb(self):
+        self._cache.clear()
+        return True
+
+    def dbsize(self):
+        return len(self._cache)
+
+
+def _redis_client(app, lifetime):
+    url = app.config.get('SESSION_REDIS_URL') or 'redis://localhost:6379/0'
+    if url.startswith('memory://'):
+        return MemoryRedis(max_entries=app.config.get('SESSION_MAX_ENTRIES', 10000), default_ttl=lifetime)
+    try:
+        import redis
+    except ImportError:
+        raise RuntimeError("SESSION_BACKEND=redis 需要安裝 redis 套件 (pip install redis)")
+    return redis.Redis.from_url(url)
+
+
+def init_session(app):
+    """依 SESSION_BACKEND 設定 Flask-Session 並掛到 app 上"""
+    backend = app.config.get('SESSION_BACKEND', 'memory')
+    lifetime = app.config.get('SESSION_LIFETIME', 28800)
+    max_bytes = app.config.get('SESSION_MAX_BYTES', 16384)
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(seconds=lifetime)
+
+    if backend == 'memory':
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = MemorySessionStore(
+            max_entries=app.config.get('SESSION_MAX_ENTRIES', 10000), default_timeout=lifetime, max_bytes=max_bytes)
+    elif backend == 'redis':
+        app.config['SESSION_TYPE'] = 'cachelib'
+        app.config['SESSION_CACHELIB'] = RedisSessionStore(
+            _redis_client(app, lifetime), default_timeout=lifetime, max_bytes=max_bytes)
+    elif backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+    else:
+        raise RuntimeError(f"不支援的 SESSION_BACKEND: {backend} (可用: {', '.join(SESSION_BACKENDS)})")
+    Session(app)
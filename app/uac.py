@@ -0,0 +1,49 @@
+# app/uac.py
+# userAccountControl 旗標 (MS-ADTS 2.2.16) 與相關的 filter / 解碼，報表與匯出共用
+from functools import lru_cache
+
+UAC_FLAGS = (
+    (0x0000001, 'SCRIPT'),
+    (0x0000002, 'ACCOUNTDISABLE'),
+    (0x0000008, 'HOMEDIR_REQUIRED'),
+    (0x0000010, 'LOCKOUT'),
+    (0x0000020, 'PASSWD_NOTREQD'),
+    (0x0000040, 'PASSWD_CANT_CHANGE'),
+    (0x0000080, 'ENCRYPTED_TEXT_PWD_ALLOWED'),
+    (0x0000200, 'NORMAL_ACCOUNT'),
+    (0x0000800, 'INTERDOMAIN_TRUST_ACCOUNT'),
+    (0x0001000, 'WORKSTATION_TRUST_ACCOUNT'),
+    (0x0002000, 'SERVER_TRUST_ACCOUNT'),
+    (0x0010000, 'DONT_EXPIRE_PASSWORD'),
+    (0x0040000, 'SMARTCARD_REQUIRED'),
+    (0x0080000, 'TRUSTED_FOR_DELEGATION'),
+    (0x0100000, 'NOT_DELEGATED'),
+    (0x0200000, 'USE_DES_KEY_ONLY'),
+    (0x0400000, 'DONT_REQ_PREAUTH'),
+    (0x0800000, 'PASSWORD_EXPIRED'),
+    (0x1000000, 'TRUSTED_TO_AUTH_FOR_DELEGATION'),
+)
+UF_ACCOUNTDISABLE = 0x2
+UF_DONT_EXPIRE_PASSWORD = 0x10000
+LDAP_MATCHING_RULE_BIT_AND = '1.2.840.113556.1.4.803'
+
+
+def uac_filter(flag, present=True):
+    """userAccountControl 含 (或不含) 指定旗標的 filter (AD 的位元 AND 比對規則)"""
+    term = f'(userAccountControl:{LDAP_MATCHING_RULE_BIT_AND}:={flag})'
+    return term if present else f'(!{term})'
+
+
+@lru_cache(maxsize=1024)
+def decode_uac(value):
+    """
+    userAccountControl -> 旗標名稱 tuple
+    同一網域裡實際出現的 UAC 值只有少數幾種 (512、514、66048、4096...)，
+    以值為 key 快取，整份報表只對每個不同的值解碼一次
+    """
+    return tuple(name for bit, name in UAC_FLAGS if value & bit)
+
+
+def is_enabled(value):
+    """userAccountControl -> 帳號是否啟用，沒有值時回傳 None"""
+    return None if value is None else not int(value) & UF_ACCOUNTDISABLE
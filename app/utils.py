@@ -1,13 +1,9 @@
 # app/utils.py
 import os
 import json
-from dotenv import load_dotenv # 確保 requirements.txt 有 python-dotenv
 
-# 明確指定 .env 路徑 (避免它找不到)
+# .env 已在 app/__init__.py 載入 (匯入 app.utils 前一定會先執行)，這裡不再重複載入
 basedir = os.path.abspath(os.path.dirname(__file__))
-# 假設 .env 在 app/ 的上一層 (專案根目錄)
-env_path = os.path.join(basedir, '..', '.env')
-load_dotenv(env_path)
 
 def load_config():
     """
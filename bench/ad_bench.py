@@ -0,0 +1,376 @@
+# bench/ad_bench.py
+# 離線效能基準：以 ldap3 的 MOCK_SYNC 建立合成目錄，不需要真正的 DC
+#
+#   python bench/ad_bench.py                                     # 預設 small (1 萬使用者、2 萬筆 DNS)，結果輸出到 stdout
+#   python bench/ad_bench.py --size large -o bench/baseline.json
+#   python bench/ad_bench.py --baseline bench/baseline.json      # 與上次結果比較，退步時 exit 1
+#
+# 每個情境會量測延遲 (ms) 與 LDAP 來回次數 (search / add / modify / delete)，
+# 結果以 JSON 輸出，方便 CI 比對來回次數與延遲是否退步
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASE_DN = 'DC=bench,DC=local'
+DOMAIN = 'bench.local'
+USERS_DN = f'CN=Users,{BASE_DN}'
+ADMIN_DN = f'CN=bench-admin,{USERS_DN}'
+ADMIN_PASSWORD = 'bench-password'
+ZONE_DN = f'DC={DOMAIN},CN=MicrosoftDNS,DC=DomainDnsZones,{BASE_DN}'
+BIG_GROUP = 'Bench Big Group'
+
+SIZES = {
+    'small': {'users': 10000, 'groups': 50, 'group_size': 2000, 'computers': 1000, 'dns_records': 20000, 'bulk': 200},
+    'large': {'users': 100000, 'groups': 200, 'group_size': 20000, 'computers': 5000, 'dns_records': 20000, 'bulk': 1000},
+}
+
+# 停用本機鏡像，所有情境都直接打到 (mock) DC；Session 放記憶體；load_dotenv 不會覆寫這裡設定的值
+os.environ.update({
+    'AD_SERVER': 'bench-dc', 'AD_DOMAIN': DOMAIN, 'AD_BASEDN': BASE_DN,
+    'AD_USER': ADMIN_DN, 'AD_PASSWORD': ADMIN_PASSWORD, 'SECRET_KEY': 'bench',
+    'DIRECTORY_MIRROR_ENABLED': 'false', 'SESSION_BACKEND': 'memory',
+})
+
+from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_AD_2012_R2  # noqa: E402
+from app.ldap_metrics import InstrumentedConnection  # noqa: E402
+
+
+class OpStats:
+    """統計 LDAP 操作次數 / 回傳筆數 / 耗時 (整個行程共用，每輪量測前歸零)"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ops = Counter()
+        self.entries = 0
+        self.ldap_seconds = 0.0
+
+    def record(self, op, started, entries=0):
+        self.ops[op] += 1
+        self.entries += entries
+        self.ldap_seconds += time.perf_counter() - started
+
+
+STATS = OpStats()
+
+
+class CountingConnection(InstrumentedConnection):
+    """MOCK_SYNC 連線，每次操作都記到 STATS (同時經過 app 的 LDAP 量測)"""
+
+    def search(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().search(*args, **kwargs)
+        finally:
+            STATS.record('search', started, len(self.response or []))
+
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().add(*args, **kwargs)
+        finally:
+            STATS.record('add', started)
+
+    def modify(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().modify(*args, **kwargs)
+        finally:
+            STATS.record('modify', started)
+
+    def delete(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            STATS.record('delete', started)
+
+    def bind(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().bind(*args, **kwargs)
+        finally:
+            STATS.record('bind', started)
+
+
+# --- 合成目錄 ---
+
+def build_directory(server, sizes):
+    """在 mock DIT 建立合成資料，回傳 seed 連線"""
+    from app.dns_codec import encode_record
+    seed = Connection(server, user=ADMIN_DN, password=ADMIN_PASSWORD, client_strategy=MOCK_SYNC)
+    add = seed.strategy.add_entry
+
+    add(BASE_DN, {'objectClass': ['top', 'domain'], 'dc': 'bench', 'distinguishedName': BASE_DN})
+    for cn in ('Users', 'Computers'):
+        dn = f'CN={cn},{BASE_DN}'
+        add(dn, {'objectClass': ['top', 'container'], 'cn': cn, 'distinguishedName': dn})
+
+    big_dn = f'CN={BIG_GROUP},{USERS_DN}'
+    group_dns = [f'CN=Bench Group {i:04d},{USERS_DN}' for i in range(sizes['groups'])]
+    members = {dn: [] for dn in group_dns}
+    members[big_dn] = []
+
+    add(ADMIN_DN, {'objectClass': ['top', 'person', 'organizationalPerson', 'user'], 'cn': 'bench-admin',
+                   'sAMAccountName': 'bench-admin', 'userPrincipalName': f'bench-admin@{DOMAIN}',
+                   'userPassword': ADMIN_PASSWORD, 'userAccountControl': 512, 'distinguishedName': ADMIN_DN})
+    for i in range(sizes['users']):
+        name = f'user{i:06d}'
+        dn = f'CN={name},{USERS_DN}'
+        member_of = [group_dns[i % len(group_dns)]] if group_dns else []
+        if i < sizes['group_size']:
+            member_of.append(big_dn)
+        for group_dn in member_of:
+            members[group_dn].append(dn)
+        add(dn, {'objectClass': ['top', 'person', 'organizationalPerson', 'user'], 'cn': name,
+                 'sAMAccountName': name, 'displayName': f'Bench User {i}', 'userPrincipalName': f'{name}@{DOMAIN}',
+                 'userAccountControl': 512, 'memberOf': member_of, 'distinguishedName': dn})
+
+    for dn, member_dns in members.items():
+        cn = dn.split(',', 1)[0][3:]
+        add(dn, {'objectClass': ['top', 'group'], 'cn': cn, 'sAMAccountName': cn, 'description': f'{cn} (bench)',
+                 'member': member_dns, 'distinguishedName': dn})
+
+    for i in range(sizes['computers']):
+        name = f'PC{i:06d}'
+        dn = f'CN={name},CN=Computers,{BASE_DN}'
+        add(dn, {'objectClass': ['top', 'person', 'organizationalPerson', 'user', 'computer'], 'cn': name,
+                 'sAMAccountName': f'{name}$', 'operatingSystem': 'Windows 11 Enterprise', 'distinguishedName': dn})
+
+    for dn in (f'DC=DomainDnsZones,{BASE_DN}', f'CN=MicrosoftDNS,DC=DomainDnsZones,{BASE_DN}'):
+        add(dn, {'objectClass': ['top', 'container'], 'distinguishedName': dn})
+    add(ZONE_DN, {'objectClass': ['top', 'dnsZone'], 'dc': DOMAIN, 'distinguishedName': ZONE_DN})
+    for i in range(sizes['dns_records']):
+        name = f'host{i:06d}'
+        if i % 10 == 9:
+            records = [encode_record('CNAME', f'host{i - 1:06d}.{DOMAIN}.')]
+        else:
+            records = [encode_record('A', f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}')]
+        dn = f'DC={name},{ZONE_DN}'
+        add(dn, {'objectClass': ['top', 'dnsNode'], 'dc': name, 'name': name, 'dNSTombstoned': 'FALSE',
+                 'dnsRecord': records, 'distinguishedName': dn})
+    return seed
+
+
+def create_bench_app(server):
+    from app import create_app
+    from app.ldap_pool import ldap_pool
+    from app import ad_ops
+
+    def _open(server_addr, bind_user, bind_pass, route='read'):
+        # 所有身分都以合成的管理員帳號 bind 到 mock DIT
+        conn = CountingConnection(server, user=ADMIN_DN, password=ADMIN_PASSWORD, client_strategy=MOCK_SYNC)
+        conn.bind()
+        return conn
+
+    ldap_pool._open = _open
+    app = create_app()
+    app.config['WTF_CSRF_ENABLED'] = False
+    # mock DIT 不會計算 tokenGroups，授權檢查不在量測範圍內
+    ad_ops.is_domain_admin = lambda conn, username: True
+    return app
+
+
+def login(client):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = 'bench-admin'
+        sess['_fresh'] = True
+        sess['ad_user_account'] = ADMIN_DN
+        sess['ad_user_password'] = ADMIN_PASSWORD
+
+
+# --- 情境 ---
+
+def _get(client, url, **params):
+    response = client.get(url, query_string=params)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} 回傳 {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def scenario_dashboard(ctx):
+    """首頁框架 + 使用者分頁第一頁"""
+    _get(ctx['client'], '/dashboard/')
+    _get(ctx['client'], '/dashboard/api/users')
+
+
+def scenario_users_search(ctx):
+    _get(ctx['client'], '/dashboard/api/users', q='user0001', sort='displayName', page=2)
+
+
+def scenario_group_members(ctx):
+    data = _get(ctx['client'], '/dashboard/api/group_members', group=BIG_GROUP).get_json()
+    if len(data['items']) != ctx['sizes']['group_size']:
+        raise RuntimeError(f"群組成員數不符: {len(data['items'])}")
+
+
+def scenario_batch(ctx):
+    """首次載入的批次端點：群組列表 + 大群組成員 + DNS 區域與紀錄並行查詢"""
+    data = _get(ctx['client'], '/dashboard/api/batch', parts='groups,group_members,zones,dns_records',
+                group=BIG_GROUP, zone=ZONE_DN).get_json()
+    if data['errors']:
+        raise RuntimeError(f"批次查詢失敗: {data['errors']}")
+
+
+def scenario_dns_listing(ctx):
+    _get(ctx['client'], '/dashboard/api/dns_records', zone=ZONE_DN)
+
+
+def scenario_dns_search(ctx):
+    _get(ctx['client'], '/dashboard/api/dns_search', zone=ZONE_DN, q='10.0.1.5')
+    _get(ctx['client'], '/dashboard/api/dns_search', zone=ZONE_DN, q='host0001*')
+
+
+def scenario_bulk_add(ctx):
+    from app.bulk_ops import import_users
+    ctx['bulk_round'] = ctx.get('bulk_round', 0) + 1
+    prefix = f"b{ctx['bulk_round']:02d}"
+    rows = [{'row': i + 2, 'username': f'{prefix}u{i:05d}', 'password': 'P@ssw0rd!', 'firstname': 'Bulk',
+             'lastname': str(i), 'groups': ['Bench Group 0000'] if ctx['sizes']['groups'] else []}
+            for i in range(ctx['sizes']['bulk'])]
+    with ctx['app'].app_context():
+        report = import_users(rows)
+    if report['errors'] or report['failed']:
+        raise RuntimeError(f"批次建立失敗: {report['errors'][:3] or report['results'][:3]}")
+
+
+SCENARIOS = {
+    'dashboard': scenario_dashboard,
+    'users_search': scenario_users_search,
+    'group_members': scenario_group_members,
+    'dns_listing': scenario_dns_listing,
+    'dns_search': scenario_dns_search,
+    'batch': scenario_batch,
+    'bulk_add': scenario_bulk_add,
+}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_scenario(name, ctx, repeat, warm):
+    from app.cache import directory_cache
+    func = SCENARIOS[name]
+    timings, ops, entries, ldap_ms = [], Counter(), 0, 0.0
+    for _ in range(repeat):
+        if not warm:
+            directory_cache.clear()
+        STATS.reset()
+        started = time.perf_counter()
+        func(ctx)
+        timings.append((time.perf_counter() - started) * 1000)
+        ops, entries, ldap_ms = STATS.ops.copy(), STATS.entries, STATS.ldap_seconds * 1000
+    return {
+        'scenario': name,
+        'iterations': repeat,
+        'cache': 'warm' if warm else 'cold',
+        'ms': {
+            'min': round(min(timings), 3),
+            'median': round(statistics.median(timings), 3),
+            'p95': round(_percentile(timings, 95), 3),
+            'max': round(max(timings), 3),
+            'mean': round(statistics.fmean(timings), 3),
+        },
+        # 以最後一輪為準 (來回次數每輪應該相同，只有延遲會浮動)
+        'ldap_ops': dict(ops),
+        'ldap_round_trips': sum(n for op, n in ops.items() if op != 'bind'),
+        'ldap_entries': entries,
+        'ldap_ms': round(ldap_ms, 3),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """與基準結果比較：來回次數增加，或延遲中位數超過 (1 + tolerance) 倍即視為退步"""
+    previous = {r['scenario']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        old = previous.get(result['scenario'])
+        if old is None:
+            continue
+        if result['ldap_round_trips'] > old['ldap_round_trips']:
+            regressions.append(f"{result['scenario']}: LDAP 來回 {old['ldap_round_trips']} -> {result['ldap_round_trips']}")
+        if result['ms']['median'] > old['ms']['median'] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: 中位數 {old['ms']['median']}ms -> {result['ms']['median']}ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AD Manager 離線效能基準 (ldap3 MOCK_SYNC)")
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    for key in SIZES['small']:
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=int, default=None, help=f"覆寫 {key}")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="只跑指定情境 (可重複)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warm', action='store_true', help="不在每輪前清空目錄快取")
+    parser.add_argument('--output', '-o', help="JSON 結果檔 (預設 stdout)")
+    parser.add_argument('--baseline', help="上次的 JSON 結果，用來偵測退步")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="延遲容許的退步比例 (預設 0.25)")
+    args = parser.parse_args(argv)
+
+    sizes = dict(SIZES[args.size])
+    sizes.update({key: getattr(args, key) for key in sizes if getattr(args, key) is not None})
+
+    started = time.perf_counter()
+    server = Server('bench-dc', get_info=OFFLINE_AD_2012_R2)
+    build_directory(server, sizes)
+    build_seconds = time.perf_counter() - started
+    sys.stderr.write(f"合成目錄建立完成 ({len(server.dit)} 筆，{build_seconds:.1f} 秒)\n")
+
+    app = create_bench_app(server)
+    client = app.test_client()
+    login(client)
+    ctx = {'app': app, 'client': client, 'sizes': sizes}
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, ctx, args.repeat, args.warm)
+        results.append(result)
+        sys.stderr.write(f"{name:<14} 中位數 {result['ms']['median']:>10.2f}ms  p95 {result['ms']['p95']:>10.2f}ms  "
+                         f"LDAP 來回 {result['ldap_round_trips']:>5}  筆數 {result['ldap_entries']}\n")
+
+    import ldap3
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'ldap3': ldap3.__version__,
+            'size': args.size,
+            'sizes': sizes,
+            'repeat': args.repeat,
+            'cache': 'warm' if args.warm else 'cold',
+            'build_seconds': round(build_seconds, 3),
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    for line in regressions:
+        sys.stderr.write(f"[退步] {line}\n")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
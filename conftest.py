@@ -0,0 +1,2 @@
+# conftest.py
+# 放在專案根目錄：pytest 會把這裡加進 sys.path，tests/ 可以直接 import app
@@ -0,0 +1,26 @@
+# gunicorn.conf.py
+# 正式環境的 WSGI 設定：gunicorn -c gunicorn.conf.py run:app
+# 數值都可以用環境變數覆寫 (docker-compose 的 env_file 會帶入 .env)
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# LDAP 查詢多半在等 DC 回應，以「少量 worker + 多執行緒」為主
+# 預設 memory Session 只存在單一行程內，要開多個 worker 請同時設定 SESSION_BACKEND=redis
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))          # 反向代理後方可調高 (需小於代理的 idle timeout)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))            # 批次匯入 / 區域匯出可能較久
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))    # 0 = 不定期重啟 worker
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# preload 時 create_app 只在 master 執行一次再 fork；LDAP 連線池、目錄鏡像、執行緒池
+# 都有註冊 os.register_at_fork，在 worker 內自動重建，不會共用父行程的 socket 或執行緒
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
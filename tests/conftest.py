@@ -0,0 +1,56 @@
+# tests/conftest.py
+import time
+import pytest
+
+
+class FakeClock:
+    """可手動推進的 time.monotonic，測試 TTL / 過期清理時不必真的等待"""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(time, 'monotonic', fake)
+    return fake
+
+
+@pytest.fixture
+def app_ctx():
+    """只帶設定的 Flask app context (paged_search 等函式會讀 current_app.config)"""
+    from flask import Flask
+    app = Flask(__name__)
+    app.config.update(AD_BASEDN='DC=corp,DC=local', LDAP_PAGE_SIZE=500, LDAP_MAX_RESULTS=0)
+    with app.app_context():
+        yield app
+
+
+class MockDirectory:
+    """ldap3 MOCK_SYNC 的合成目錄 (使用離線 AD schema)，add() 建立物件，conn 為已繫結的連線"""
+
+    def __init__(self):
+        from ldap3 import Server, Connection, MOCK_SYNC, OFFLINE_AD_2012_R2
+        server = Server('mock-dc', get_info=OFFLINE_AD_2012_R2)
+        self.conn = Connection(server, user='CN=admin,DC=corp,DC=local', password='pw', client_strategy=MOCK_SYNC)
+        self.add('CN=admin,DC=corp,DC=local', objectClass=['top', 'person'], userPassword='pw')
+        self.conn.bind()
+
+    def add(self, dn, **attrs):
+        attrs.setdefault('distinguishedName', dn)
+        self.conn.strategy.add_entry(dn, attrs)
+
+    def remove(self, dn):
+        self.conn.strategy.remove_entry(dn)
+
+
+@pytest.fixture
+def directory():
+    return MockDirectory()
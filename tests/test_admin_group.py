@@ -0,0 +1,57 @@
+# tests/test_admin_group.py
+import struct
+from types import SimpleNamespace
+import pytest
+from app.ad_ops import _get_admin_group, _sid_to_str
+from app.cache import directory_cache
+
+DOMAIN = 'DC=corp,DC=local'
+# S-1-5-21-1-2-3
+DOMAIN_SID = bytes([1, 4]) + (5).to_bytes(6, 'big') + struct.pack('<4I', 21, 1, 2, 3)
+ADMINS_DN = 'CN=Domain Admins,CN=Users,DC=corp,DC=local'
+
+
+class SidConn:
+    """回應網域根目錄的 objectSid 與以 SID 找群組兩種查詢，記錄查詢次數"""
+
+    def __init__(self):
+        self.searches = []
+        self.entries = []
+
+    def search(self, base, search_filter, **kwargs):
+        self.searches.append(search_filter)
+        if search_filter == '(objectClass=*)':
+            self.entries = [SimpleNamespace(entry_raw_attributes={'objectSid': [DOMAIN_SID]})]
+        else:
+            self.entries = [SimpleNamespace(entry_dn=ADMINS_DN)]
+        return True
+
+
+@pytest.fixture
+def cache(app_ctx):
+    app_ctx.config['ADMIN_GROUP_REFRESH'] = 60
+    directory_cache.clear()
+    yield directory_cache
+    directory_cache.clear()
+
+
+def test_admin_group_is_resolved_once_per_refresh(cache, clock):
+    conn = SidConn()
+    admin_dn, admin_sid = _get_admin_group(conn, DOMAIN)
+    assert admin_dn == ADMINS_DN
+    assert _sid_to_str(admin_sid) == 'S-1-5-21-1-2-3-512'
+    assert conn.searches[-1] == '(objectSid=S-1-5-21-1-2-3-512)'
+
+    assert _get_admin_group(conn, DOMAIN.upper()) == (admin_dn, admin_sid)
+    assert len(conn.searches) == 2
+    clock.advance(61)
+    _get_admin_group(conn, DOMAIN)
+    assert len(conn.searches) == 4
+
+
+def test_admin_group_cache_is_shared_directory_cache(cache):
+    conn = SidConn()
+    _get_admin_group(conn, DOMAIN)
+    cache.clear()
+    _get_admin_group(conn, DOMAIN)
+    assert len(conn.searches) == 4
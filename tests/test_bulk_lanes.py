@@ -0,0 +1,46 @@
+# tests/test_bulk_lanes.py
+from types import SimpleNamespace
+import pytest
+import app.bulk_ops as bulk_ops
+from app.ldap_pool import LDAPConnectionPool, PoolExhaustedError
+
+CREDENTIALS = ('dc1', 'CN=alice,DC=corp,DC=local', 'pw')
+
+
+@pytest.fixture
+def pool(monkeypatch, app_ctx):
+    # 網頁請求只有一條連線名額，工作線另有兩條
+    pool = LDAPConnectionPool(max_size=1, acquire_timeout=0, lane_max_size=2)
+    monkeypatch.setattr(pool, '_open', lambda server, user, password, route='read':
+                        SimpleNamespace(closed=False, bound=True, password=password))
+    monkeypatch.setattr(bulk_ops, 'ldap_pool', pool)
+    monkeypatch.setattr(bulk_ops, '_get_bind_credentials', lambda: CREDENTIALS)
+    monkeypatch.setattr(bulk_ops, '_authz_controls', lambda: ())
+    return pool
+
+
+def _tasks(count):
+    return [{'ident': {'row': i}} for i in range(count)]
+
+
+def test_lanes_do_not_use_request_connections(pool):
+    # 發起匯入的請求已經佔住唯一一條網頁請求連線
+    request_conn = pool.acquire(*CREDENTIALS, route='write')
+    results, workers = bulk_ops.run_in_lanes(_tasks(5), lambda conn, task: dict(task['ident'], success=True), workers=4)
+    assert workers == 2
+    assert [r['row'] for r in results] == [0, 1, 2, 3, 4]
+    assert all(r['success'] for r in results)
+    # 匯入期間 / 之後，網頁請求的名額不受工作線影響
+    with pytest.raises(PoolExhaustedError):
+        pool.acquire(*CREDENTIALS, route='write')
+    pool.release(request_conn)
+    assert pool.available(*CREDENTIALS[:2], route='write') == 1
+
+
+def test_lanes_sized_from_free_lane_slots(pool):
+    held = pool.acquire(*CREDENTIALS, route='write', lane=True)
+    assert pool.available(*CREDENTIALS[:2], route='write', lane=True) == 1
+    _, workers = bulk_ops.run_in_lanes(_tasks(5), lambda conn, task: dict(task['ident'], success=True), workers=4)
+    assert workers == 1
+    pool.release(held)
+    assert pool.available(*CREDENTIALS[:2], route='write', lane=True) == 2
@@ -0,0 +1,139 @@
+# tests/test_cache.py
+import pytest
+from app.cache import TTLCache
+
+
+def test_get_set_and_default():
+    cache = TTLCache()
+    assert cache.get('missing') is None
+    assert cache.get('missing', 'dflt') == 'dflt'
+    cache.set('k', 0)
+    assert cache.get('k', 'dflt') == 0  # 假值也算命中
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('default', 1)
+    cache.set('short', 2, ttl=2)
+    clock.advance(3)
+    assert cache.get('short') is None
+    assert cache.get('default') == 1
+    clock.advance(8)
+    assert cache.get('default') is None
+    assert len(cache) == 0
+
+
+def test_sweep_drops_only_expired(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1, ttl=1, tags=('t',))
+    cache.set('b', 2, ttl=1)
+    cache.set('c', 3)
+    clock.advance(2)
+    assert len(cache) == 3
+    assert cache.sweep() == 2
+    assert len(cache) == 1
+    assert cache._tags == {}
+
+
+def test_lru_eviction_respects_recent_reads():
+    cache = TTLCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_invalidate_by_tag():
+    cache = TTLCache()
+    cache.set('users:1', 1, tags=('users',))
+    cache.set('users:2', 2, tags=('users', 'groups'))
+    cache.set('dns', 3, tags=('dns',))
+    cache.invalidate('groups')
+    assert cache.get('users:2') is None
+    assert cache.get('users:1') == 1
+    cache.invalidate('users', 'unknown')
+    assert cache.get('users:1') is None
+    assert cache.get('dns') == 3
+    assert set(cache._tags) == {'dns'}
+
+
+def test_overwrite_replaces_tags():
+    cache = TTLCache()
+    cache.set('k', 1, tags=('old',))
+    cache.set('k', 2, tags=('new',))
+    cache.invalidate('old')
+    assert cache.get('k') == 2
+    cache.invalidate('new')
+    assert cache.get('k') is None
+
+
+def test_get_or_load_calls_loader_once():
+    cache = TTLCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return None  # None 也要快取
+
+    assert cache.get_or_load('k', loader) is None
+    assert cache.get_or_load('k', loader) is None
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('invalidate', [
+    lambda cache: cache.invalidate('users'),
+    lambda cache: cache.delete('k'),
+    lambda cache: cache.clear(),
+], ids=['tag', 'delete', 'clear'])
+def test_get_or_load_skips_store_after_concurrent_invalidation(invalidate):
+    cache = TTLCache()
+
+    def loader():
+        # loader 讀到舊資料之後，另一個請求寫入並讓快取失效
+        invalidate(cache)
+        return 'stale'
+
+    assert cache.get_or_load('k', loader, tags=('users',)) == 'stale'
+    assert cache.get('k') is None
+    assert cache.get_or_load('k', lambda: 'fresh', tags=('users',)) == 'fresh'
+    assert cache.get('k') == 'fresh'
+
+
+def test_get_or_load_ignores_unrelated_tags():
+    cache = TTLCache()
+
+    def loader():
+        cache.invalidate('groups')
+        return 'value'
+
+    cache.get_or_load('k', loader, tags=('users',))
+    assert cache.get('k') == 'value'
+
+
+def test_disabled_cache_stores_nothing():
+    for cache in (TTLCache(ttl=0), TTLCache(max_entries=0)):
+        assert not cache.enabled
+        cache.set('k', 1)
+        assert cache.get('k') is None
+        assert cache.get_or_load('k', lambda: 5) == 5
+
+
+def test_delete_and_clear():
+    cache = TTLCache()
+    cache.set('k', 1, tags=('t',))
+    assert cache.delete('k')
+    assert not cache.delete('k')
+    cache.set('a', 1, tags=('t',))
+    cache.clear()
+    assert len(cache) == 0 and cache._tags == {}
+
+
+def test_init_app_reads_prefixed_config():
+    class App:
+        config = {'AUTHZ_CACHE_TTL': 5, 'AUTHZ_CACHE_MAX_ENTRIES': 7}
+    cache = TTLCache()
+    cache.init_app(App, prefix='AUTHZ_CACHE')
+    assert (cache.ttl, cache.max_entries) == (5, 7)
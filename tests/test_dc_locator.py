@@ -0,0 +1,79 @@
+# tests/test_dc_locator.py
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from ldap3 import ServerPool
+from app.dc_locator import DomainControllerLocator, _split_host
+
+
+def _locator(hosts='dc1,dc2,dc3', **config):
+    app = Flask(__name__)
+    # DC_PROBE_INTERVAL=0：不啟動背景量測，延遲與離線狀態由測試直接設定
+    app.config.update(AD_SERVER=hosts, AD_BASEDN='DC=corp,DC=local', DC_PROBE_INTERVAL=0, DC_DOWN_TIME=60, **config)
+    locator = DomainControllerLocator()
+    locator.init_app(app)
+    return locator
+
+
+@pytest.mark.parametrize('address, expected', [
+    ('dc1.corp.local', ('dc1.corp.local', 636)),
+    ('dc1.corp.local:389', ('dc1.corp.local', 389)),
+    ('[::1]', ('[::1]', 636)),
+])
+def test_split_host(address, expected):
+    assert _split_host(address) == expected
+
+
+def test_latency_order_puts_unmeasured_hosts_last():
+    locator = _locator(AD_DC_SELECTION='latency')
+    locator._latency = {'dc3': 0.001, 'dc2': 0.010}
+    assert locator.candidates() == ['dc3', 'dc2', 'dc1']
+
+
+def test_round_robin_rotates_up_hosts():
+    locator = _locator(AD_DC_SELECTION='round_robin')
+    first = [locator.candidates()[0] for _ in range(3)]
+    assert sorted(first) == ['dc1', 'dc2', 'dc3']
+
+
+def test_down_hosts_go_last_until_down_time_expires(clock):
+    locator = _locator(AD_DC_SELECTION='first')
+    locator.mark_down('dc1')
+    assert locator.candidates() == ['dc2', 'dc3', 'dc1']
+    clock.advance(61)
+    assert locator.candidates() == ['dc1', 'dc2', 'dc3']
+
+
+def test_write_route_puts_pdc_first():
+    locator = _locator(AD_DC_SELECTION='first', AD_PDC='DC3')
+    assert locator.candidates('write') == ['dc3', 'dc1', 'dc2']
+    assert locator.candidates('read') == ['dc1', 'dc2', 'dc3']
+
+
+def test_write_route_skips_pdc_that_is_down(clock):
+    locator = _locator(AD_DC_SELECTION='first', AD_PDC='dc3')
+    locator.mark_down('dc3')
+    assert locator.candidates('write') == ['dc1', 'dc2', 'dc3']
+
+
+def test_write_route_ignores_pdc_outside_host_list():
+    locator = _locator(AD_DC_SELECTION='first', AD_PDC='dc9')
+    assert locator.candidates('write') == ['dc1', 'dc2', 'dc3']
+
+
+def test_connected_marks_skipped_candidates_down():
+    locator = _locator(AD_DC_SELECTION='first')
+    pool = locator.server_for('dc1,dc2,dc3')
+    assert isinstance(pool, ServerPool)
+    conn = SimpleNamespace(server=pool.servers[2])
+    locator.connected(pool, conn)
+    assert locator.host_of(conn) == 'dc3'
+    assert [s['host'] for s in locator.status() if s['down']] == ['dc1', 'dc2']
+    assert locator.candidates() == ['dc3', 'dc1', 'dc2']
+
+
+def test_single_host_uses_plain_server_and_shared_route():
+    locator = _locator('dc1')
+    assert not locator.multiple
+    assert not isinstance(locator.server_for('dc1', route='write'), ServerPool)
+    assert locator.route_key('write') == 'read'
@@ -0,0 +1,128 @@
+# tests/test_dir_sync.py
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from app.ad_ops import read_forest_root
+from app.dir_sync import DirectoryMirror
+
+
+class RootDSEConn:
+    """只回應 rootDSE 查詢的假連線"""
+
+    def __init__(self, forest=None, error=None):
+        self.forest = forest
+        self.error = error
+        self.entries = []
+
+    def search(self, base, search_filter, search_scope=None, attributes=None):
+        if self.error:
+            raise self.error
+        attrs = {'rootDomainNamingContext': SimpleNamespace(value=self.forest)} if self.forest else {}
+        self.entries = [_Entry(attrs)]
+        return True
+
+
+class _Entry:
+    def __init__(self, attrs):
+        self._attrs = attrs
+
+    def __contains__(self, name):
+        return name in self._attrs
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_attrs'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def test_read_forest_root():
+    assert read_forest_root(RootDSEConn('DC=corp,DC=local')) == 'DC=corp,DC=local'
+    assert read_forest_root(RootDSEConn()) is None
+    assert read_forest_root(RootDSEConn(error=RuntimeError('no rootDSE'))) is None
+
+
+def _mirror(base_dn):
+    app = Flask(__name__)
+    app.config.update(AD_BASEDN=base_dn, DIRECTORY_MIRROR_ENABLED=False)
+    mirror = DirectoryMirror()
+    mirror.init_app(app)
+    return mirror
+
+
+def test_forest_dns_zones_use_forest_root():
+    mirror = _mirror('OU=Staff,DC=child,DC=corp,DC=local')
+    assert 'DC=ForestDnsZones,DC=child,DC=corp,DC=local' in mirror._naming_contexts()
+    mirror._forest_root = 'DC=corp,DC=local'
+    assert mirror._search_bases('dns_nodes') == [
+        'DC=DomainDnsZones,DC=child,DC=corp,DC=local',
+        'DC=ForestDnsZones,DC=corp,DC=local',
+        'CN=MicrosoftDNS,CN=System,DC=child,DC=corp,DC=local',
+    ]
+    assert mirror._naming_contexts() == [
+        'DC=child,DC=corp,DC=local',
+        'DC=DomainDnsZones,DC=child,DC=corp,DC=local',
+        'DC=ForestDnsZones,DC=corp,DC=local',
+    ]
+    assert mirror._search_bases('users') == ['OU=Staff,DC=child,DC=corp,DC=local']
+
+
+class PagedConn:
+    """
+    假的 paged_search 連線：results = {base: (結果碼, [entry, ...])}，沒列出的 base 回傳 noSuchObject
+    tombstone 查詢 (isDeleted=TRUE) 一律沒有結果
+    和 ldap3 的 paged_search(generator=True) 一樣，非 0 結果碼不丟例外，只留在 conn.result
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.result = None
+        self.extend = SimpleNamespace(standard=SimpleNamespace(paged_search=self._paged_search))
+
+    def _paged_search(self, base, search_filter, **kwargs):
+        code, entries = self.results.get(base, (32, []))
+        self.result = {'result': code, 'description': {0: 'success', 32: 'noSuchObject'}.get(code, 'busy')}
+        if 'isDeleted' not in search_filter:
+            yield from entries
+
+
+def _user_entry(guid, name, base='DC=corp,DC=local'):
+    dn = f'CN={name},{base}'
+    return {'type': 'searchResEntry', 'dn': dn,
+            'attributes': {'sAMAccountName': name, 'userAccountControl': 512},
+            'raw_attributes': {'objectGUID': [bytes.fromhex(guid)]}}
+
+
+def test_full_sync_skips_missing_partition():
+    mirror = _mirror('DC=corp,DC=local')
+    conn = PagedConn({'DC=corp,DC=local': (0, [_user_entry('01', 'alice')])})
+    mirror._full_sync(conn, 100, 'abc')
+    assert mirror.highest_usn == 100
+    assert mirror._objects['users']['01']['sAMAccountName'] == 'alice'
+
+
+def test_full_sync_error_keeps_previous_mirror():
+    mirror = _mirror('DC=corp,DC=local')
+    mirror._full_sync(PagedConn({'DC=corp,DC=local': (0, [_user_entry('01', 'alice')])}), 100, 'abc')
+    busy = PagedConn({'DC=corp,DC=local': (0, []), 'DC=DomainDnsZones,DC=corp,DC=local': (51, [])})
+    with pytest.raises(RuntimeError):
+        mirror._full_sync(busy, 200, 'def')
+    assert mirror.highest_usn == 100
+    assert mirror.invocation_id == 'abc'
+    assert '01' in mirror._objects['users']
+
+
+def test_incremental_sync_error_keeps_watermark():
+    mirror = _mirror('DC=corp,DC=local')
+    mirror._full_sync(PagedConn({'DC=corp,DC=local': (0, [_user_entry('01', 'alice')])}), 100, 'abc')
+    # 使用者的變動讀到了，但 DNS 分割區逾時：整輪作廢，下一輪從同一個 USN 重讀
+    partial = PagedConn({'DC=corp,DC=local': (0, [_user_entry('02', 'bob')]),
+                         'DC=DomainDnsZones,DC=corp,DC=local': (3, [])})
+    with pytest.raises(RuntimeError):
+        mirror._incremental_sync(partial, 150)
+    assert mirror.highest_usn == 100
+    assert '02' not in mirror._objects['users']
+
+    mirror._incremental_sync(PagedConn({'DC=corp,DC=local': (0, [_user_entry('02', 'bob')])}), 150)
+    assert mirror.highest_usn == 150
+    assert mirror._objects['users']['02']['sAMAccountName'] == 'bob'
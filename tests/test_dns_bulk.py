@@ -0,0 +1,135 @@
+# tests/test_dns_bulk.py
+import io
+import pytest
+from app.dns_bulk import ZoneFileError, parse_zone_file, plan_zone_import
+from app.dns_codec import encode_record, decode_record
+
+ZONE = 'corp.local'
+ZONE_DN = 'DC=corp.local,CN=MicrosoftDNS,DC=DomainDnsZones,DC=corp,DC=local'
+
+
+def parse(text, fmt='bind'):
+    return parse_zone_file(io.StringIO(text), ZONE, fmt)
+
+
+def summary(records):
+    return [(r['name'], r['type'], r['ttl'], r['value']) for r in records]
+
+
+def test_parse_bind_directives_and_defaults():
+    records, errors, skipped = parse(
+        "$TTL 600\n"
+        "web        IN A     10.0.0.1 ; comment\n"
+        "           300 AAAA 2001:db8::1\n"
+        "mail.corp.local. MX 10 mx1\n"
+        "$ORIGIN sub\n"
+        "app        CNAME web.corp.local.\n"
+        "txt        TXT   \"a;b\" \"c d\"\n"
+        "srv.tcp    SRV   0 100 389 dc1\n"
+        "@          SOA   dc1 hostmaster 1 2 3 4 5\n"
+        "host       HINFO x86 linux\n")
+    assert errors == []
+    assert skipped == 2  # SOA 與 HINFO 不屬於可匯入的類型
+    assert summary(records) == [
+        ('web', 'A', 600, '10.0.0.1'),
+        ('web', 'AAAA', 300, '2001:db8::1'),
+        ('mail', 'MX', 600, '10 mx1.corp.local'),
+        ('app.sub', 'CNAME', 600, 'web.corp.local'),
+        ('txt.sub', 'TXT', 600, '"a;b" "c d"'),
+        ('srv.tcp.sub', 'SRV', 600, '0 100 389 dc1.sub.corp.local'),
+    ]
+    assert records[0]['line'] == 2
+
+
+def test_parse_bind_reports_errors_by_line():
+    records, errors, _ = parse(
+        "$TTL abc\n"
+        "$INCLUDE other.zone\n"
+        "  A 10.0.0.1\n"
+        "www.example.com. A 10.0.0.1\n"
+        "@ A 10.0.0.1\n"
+        "_ldap._tcp SRV 0 0 389 dc1\n"
+        "bad_name A 10.0.0.1\n"
+        "web A 10.0.0.999\n"
+        "web 99999999999 A 10.0.0.1\n"
+        "web A\n"
+        "ok A 10.0.0.2\n")
+    assert summary(records) == [('ok', 'A', 3600, '10.0.0.2')]
+    assert [e.split(':', 1)[0] for e in errors] == [f"第 {n} 行" for n in range(1, 11)]
+
+
+def test_parse_csv():
+    records, errors, skipped = parse(
+        "Name,Type,TTL,Value\n"
+        "web,A,,10.0.0.1\n"
+        "web,a,120,10.0.0.2\n"
+        "mail,MX,300,10 mx1.corp.local.\n"
+        ",,,\n"
+        "x,SOA,,dc1 hm 1 2 3 4 5\n"
+        "y,A,abc,10.0.0.3\n", fmt='csv')
+    assert summary(records) == [
+        ('web', 'A', 3600, '10.0.0.1'), ('web', 'A', 120, '10.0.0.2'), ('mail', 'MX', 300, '10 mx1.corp.local')]
+    assert skipped == 1
+    assert len(errors) == 1 and 'abc' in errors[0]
+
+
+@pytest.mark.parametrize('text', ['', 'name,type\nweb,A\n'])
+def test_parse_csv_rejects_bad_header(text):
+    with pytest.raises(ZoneFileError):
+        parse(text, fmt='csv')
+
+
+def node(directory, name, *records):
+    directory.add(f'DC={name},{ZONE_DN}', objectClass=['top', 'dnsNode'], name=name, dc=name,
+                  dNSTombstoned='FALSE', dnsRecord=[encode_record(*r) for r in records])
+
+
+@pytest.fixture
+def zone(directory):
+    directory.add(ZONE_DN, objectClass=['top', 'dnsZone'], dc=ZONE)
+    node(directory, '@', ('SOA', 'dc1.corp.local hostmaster.corp.local 1 2 3 4 5'))
+    node(directory, 'web', ('A', '10.0.0.1'), ('A', '10.0.0.2'))
+    node(directory, 'mail', ('MX', '10 mx1.corp.local'), ('A', '10.0.0.9', 60))
+    node(directory, 'old', ('A', '10.0.0.3'))
+    node(directory, 'mixed', ('A', '10.0.0.4'), ('SOA', 'dc1.corp.local hm.corp.local 1 2 3 4 5'))
+    return directory
+
+
+def plan(zone, text, prune=False):
+    records, errors, _ = parse(text)
+    assert errors == []
+    return {c['ident']['name']: c for c in plan_zone_import(zone.conn, ZONE_DN, records, prune=prune)}
+
+
+def test_plan_only_sends_differences(zone, app_ctx):
+    changes = plan(zone, "web A 10.0.0.1\n"
+                         "web A 10.0.0.5\n"
+                         "mail MX 10 mx1.corp.local.\n"
+                         "mail 300 A 10.0.0.9\n"
+                         "new TXT hello\n")
+    assert sorted(changes) == ['mail', 'new', 'web']
+    web = changes['web']
+    assert web['ident']['action'] == 'update'
+    assert web['added'] == ['A 10.0.0.5 (TTL 3600)']
+    assert web['removed'] == ['A 10.0.0.2 (TTL 3600)']
+    assert decode_record(web['delete_values'][0]).rdata == '10.0.0.2'
+    # TTL 不同視為替換
+    assert changes['mail']['added'] == ['A 10.0.0.9 (TTL 300)']
+    assert changes['mail']['removed'] == ['A 10.0.0.9 (TTL 60)']
+    assert changes['new']['ident']['action'] == 'add'
+    assert changes['new']['dn'] == f'DC=new,{ZONE_DN}'
+    assert decode_record(changes['new']['add_values'][0]).rdata == ('hello',)
+
+
+def test_plan_without_changes_is_empty(zone, app_ctx):
+    assert plan(zone, "web A 10.0.0.2\nweb A 10.0.0.1\n") == {}
+
+
+def test_plan_prune(zone, app_ctx):
+    changes = plan(zone, "web A 10.0.0.1\nweb A 10.0.0.2\n", prune=True)
+    assert sorted(changes) == ['mail', 'mixed', 'old']
+    assert changes['old']['ident']['action'] == 'delete'
+    assert changes['mail']['ident']['action'] == 'delete'
+    # 節點上還有不可管理的值 (SOA)，只移除 A，不刪節點
+    assert changes['mixed']['ident']['action'] == 'update'
+    assert changes['mixed']['removed'] == ['A 10.0.0.4 (TTL 3600)']
@@ -0,0 +1,126 @@
+# tests/test_dns_codec.py
+import random
+import pytest
+from app.dns_codec import (
+    DnsCodecError, DnsRecord, HEADER_SIZE, RECORD_TYPES, MXData, SRVData, SOAData,
+    decode_record, decode_records, encode_record, make_record, parse_rdata,
+)
+
+ORIGIN = 'corp.local'
+
+
+@pytest.mark.parametrize('rtype, text, rdata, value', [
+    ('A', '10.0.0.1', '10.0.0.1', '10.0.0.1'),
+    ('AAAA', '2001:0db8:0:0:0:0:0:1', '2001:db8::1', '2001:db8::1'),
+    ('CNAME', 'web', 'web.corp.local', 'web.corp.local'),
+    ('CNAME', 'www.example.com.', 'www.example.com', 'www.example.com'),
+    ('MX', '10 mail', MXData(10, 'mail.corp.local'), '10 mail.corp.local'),
+    ('TXT', '"v=spf1 -all" "second string" plain', ('v=spf1 -all', 'second string', 'plain'),
+     '"v=spf1 -all" "second string" "plain"'),
+    ('SRV', '0 100 389 dc1', SRVData(0, 100, 389, 'dc1.corp.local'), '0 100 389 dc1.corp.local'),
+    ('PTR', 'host1.corp.local.', 'host1.corp.local', 'host1.corp.local'),
+    ('NS', 'dc1', 'dc1.corp.local', 'dc1.corp.local'),
+    ('SOA', 'dc1 hostmaster 42 900 600 86400 3600',
+     SOAData(42, 900, 600, 86400, 3600, 'dc1.corp.local', 'hostmaster.corp.local'),
+     'dc1.corp.local hostmaster.corp.local 42 900 600 86400 3600'),
+])
+def test_round_trip(rtype, text, rdata, value):
+    blob = encode_record(rtype, text, ttl=300, origin=ORIGIN)
+    record = decode_record(blob)
+    assert record.type == rtype
+    assert record.type_id == RECORD_TYPES[rtype]
+    assert record.rdata == rdata
+    assert record.ttl == 300
+    assert record.is_static and record.aged_at is None
+    assert record.to_text() == value
+    assert record.encode() == blob
+    # 文字表示再解析一次，結果不變 (匯出的 zone file 可以重新匯入)
+    assert parse_rdata(rtype, record.to_text(absolute=True)) == rdata
+
+
+def test_decode_accepts_memoryview_and_keeps_header_fields():
+    record = DnsRecord(1, '192.168.1.1', ttl=60, serial=7, timestamp=3_600_000, flags=0)
+    decoded = decode_record(memoryview(record.encode()))
+    assert (decoded.serial, decoded.timestamp, decoded.ttl) == (7, 3_600_000, 60)
+    assert not decoded.is_static
+    assert decoded.to_dict()['timestamp'].startswith('2011-')
+
+
+def test_txt_escapes_quotes():
+    record = make_record('TXT', r'"say \"hi\"" back\\slash')
+    assert record.rdata == ('say "hi"', 'back\\slash')
+    assert parse_rdata('TXT', record.to_text()) == record.rdata
+
+
+def test_unknown_type_is_kept_raw():
+    record = DnsRecord(99, b'\x01\x02\x03')
+    decoded = decode_record(record.encode())
+    assert decoded.type == 'TYPE99'
+    assert decoded.rdata == b'\x01\x02\x03'
+    assert decoded.to_text() == '\\# 3 010203'
+
+
+@pytest.mark.parametrize('rtype, text', [
+    ('A', '10.0.0.300'),
+    ('AAAA', '10.0.0.1'),
+    ('MX', 'mail'),
+    ('MX', '70000 mail'),
+    ('SRV', '0 100 dc1'),
+    ('SOA', 'dc1 hostmaster 1 2'),
+    ('TXT', '"unterminated'),
+    ('CNAME', 'x' * 64),
+    ('HINFO', 'x86 linux'),
+])
+def test_invalid_text_is_rejected(rtype, text):
+    with pytest.raises(DnsCodecError):
+        encode_record(rtype, text, origin=ORIGIN)
+
+
+@pytest.mark.parametrize('rtype, text', [
+    ('A', '10.0.0.1'),
+    ('AAAA', '2001:db8::1'),
+    ('CNAME', 'web.corp.local'),
+    ('MX', '10 mail.corp.local'),
+    ('TXT', '"one" "two"'),
+    ('SRV', '0 100 389 dc1.corp.local'),
+    ('SOA', 'dc1.corp.local hostmaster.corp.local 1 2 3 4 5'),
+])
+def test_truncated_buffers_raise(rtype, text):
+    blob = encode_record(rtype, text)
+    for size in range(len(blob)):
+        with pytest.raises(DnsCodecError):
+            decode_record(blob[:size])
+
+
+def test_short_rdata_with_consistent_length_raises():
+    # DataLength 與實際長度一致，但 RDATA 對該類型來說太短
+    blob = bytearray(encode_record('AAAA', '2001:db8::1'))
+    blob[0:2] = (4).to_bytes(2, 'little')
+    with pytest.raises(DnsCodecError):
+        decode_record(bytes(blob[:HEADER_SIZE + 4]))
+
+
+def test_garbage_buffers_only_raise_codec_errors():
+    rnd = random.Random(1234)
+    header = encode_record('A', '10.0.0.1')[:HEADER_SIZE]
+    for _ in range(2000):
+        body = bytes(rnd.randrange(256) for _ in range(rnd.randrange(40)))
+        blob = bytearray(header + body)
+        blob[0:2] = len(body).to_bytes(2, 'little')
+        blob[2:4] = rnd.choice(list(RECORD_TYPES.values())).to_bytes(2, 'little')
+        try:
+            decode_record(bytes(blob))
+        except DnsCodecError:
+            pass
+    for _ in range(500):
+        try:
+            decode_record(bytes(rnd.randrange(256) for _ in range(rnd.randrange(64))))
+        except DnsCodecError:
+            pass
+
+
+def test_decode_records_skips_bad_values():
+    good = encode_record('A', '10.0.0.1')
+    records = decode_records([b'', good[:10], good, b'\xff' * 40])
+    assert [r.to_text() for r in records] == ['10.0.0.1']
+    assert decode_records(None) == []
@@ -0,0 +1,223 @@
+# tests/test_dns_index.py
+import pytest
+from app.dns_codec import encode_record
+from app.dns_index import NameTrie, ZoneIndex, _partition_root
+
+ZONE_DN = 'DC=corp.local,CN=MicrosoftDNS,DC=DomainDnsZones,DC=corp,DC=local'
+
+
+def test_trie_prefix_is_sorted_and_limited():
+    trie = NameTrie()
+    for name in ('web-02', 'web-01', 'web', 'mail', 'web-10.sub'):
+        trie.insert(name)
+    assert trie.with_prefix('web') == ['web', 'web-01', 'web-02', 'web-10.sub']
+    assert trie.with_prefix('web-', limit=2) == ['web-01', 'web-02']
+    assert trie.with_prefix('x') == []
+    assert trie.with_prefix('') == ['mail', 'web', 'web-01', 'web-02', 'web-10.sub']
+
+
+def test_trie_remove_prunes_unused_nodes():
+    trie = NameTrie()
+    trie.insert('web')
+    trie.insert('web-01')
+    trie.remove('web-01')
+    assert trie.with_prefix('web') == ['web']
+    assert 'w' in trie._root.children and not trie._root.children['w'].children['e'].children['b'].children
+    trie.remove('web')
+    trie.remove('missing')
+    assert trie._root.children == {}
+
+
+def row(name, *records, guid=None, tombstoned=False):
+    return {'name': name, 'dn': f'DC={name},{ZONE_DN}', 'guid': guid or name,
+            'dnsRecord': [encode_record(*r) for r in records], 'tombstoned': tombstoned}
+
+
+@pytest.fixture
+def index():
+    index = ZoneIndex(ZONE_DN)
+    index.apply_rows([
+        row('web-01', ('A', '10.0.0.1')),
+        row('web-02', ('A', '10.0.0.2'), ('AAAA', '2001:db8::2')),
+        row('db', ('A', '10.0.0.1')),
+        row('www', ('CNAME', 'web-01.corp.local')),
+        row('@', ('MX', '10 mail.corp.local'), ('NS', 'dc1.corp.local')),
+        row('mail', ('A', '10.0.0.25')),
+        row('_ldap._tcp', ('SRV', '0 100 389 dc1.corp.local')),
+    ], complete=True)
+    return index
+
+
+def keys(items):
+    return [(item['name'], item['match']) for item in items]
+
+
+def test_search_by_address(index):
+    kind, items = index.search('10.0.0.1')
+    assert kind == 'address'
+    assert keys(items) == [('db', 'address'), ('web-01', 'address')]
+    # IPv6 以標準寫法比對
+    assert keys(index.search('2001:0db8:0:0::2')[1]) == [('web-02', 'address')]
+    assert index.search('10.9.9.9')[1] == []
+
+
+def test_search_by_prefix(index):
+    kind, items = index.search('web-*')
+    assert kind == 'prefix'
+    assert [item['name'] for item in items] == ['web-01', 'web-02']
+    # FQDN 寫法先去掉區域名稱再比對
+    assert [item['name'] for item in index.search('WEB-01.corp.local*')[1]] == ['web-01']
+    assert [item['name'] for item in index.search('web-*', limit=1)[1]] == ['web-01']
+
+
+def test_search_by_name_includes_referrers(index):
+    kind, items = index.search('web-01.corp.local.')
+    assert kind == 'name'
+    assert keys(items) == [('web-01', 'name'), ('www', 'CNAME')]
+    assert keys(index.search('dc1')[1]) == [('@', 'NS'), ('_ldap._tcp', 'SRV')]
+    assert keys(index.search('mail')[1]) == [('mail', 'name'), ('@', 'MX')]
+
+
+def test_update_rebuilds_only_changed_nodes(index):
+    before = index.nodes['db']
+    changed = index.apply_rows([
+        row('db', ('A', '10.0.0.1')),
+        row('web-01', ('A', '10.0.0.9')),
+    ], complete=False)
+    assert changed == 1
+    assert index.nodes['db'] is before
+    assert keys(index.search('10.0.0.1')[1]) == [('db', 'address')]
+    assert keys(index.search('10.0.0.9')[1]) == [('web-01', 'address')]
+
+
+def test_tombstones_and_complete_rows_drop_nodes(index):
+    assert index.apply_rows([row('www', tombstoned=True)], complete=False) == 1
+    assert keys(index.search('web-01')[1]) == [('web-01', 'name')]
+    assert index.drop_guids(['db', 'unknown']) == 1
+    assert keys(index.search('10.0.0.1')[1]) == [('web-01', 'address')]
+    index.apply_rows([row('web-01', ('A', '10.0.0.1'))], complete=True)
+    assert list(index.nodes) == ['web-01']
+    assert index.search('web-02*')[1] == []
+    assert index.by_target == {}
+    assert index.stats()['addresses'] == 1
+
+
+@pytest.mark.parametrize('zone_dn, root', [
+    (ZONE_DN, 'DC=DomainDnsZones,DC=corp,DC=local'),
+    ('DC=corp.local,CN=MicrosoftDNS,CN=System,DC=corp,DC=local', 'DC=corp,DC=local'),
+])
+def test_partition_root(zone_dn, root):
+    assert _partition_root(zone_dn) == root
+
+
+class FakeConn:
+    def __init__(self):
+        self.result = {'result': 0}
+
+
+class FakeEntry:
+    """只提供 _entry_row 用到的部分"""
+
+    class _Attr:
+        def __init__(self, values):
+            self.raw_values = values
+            self.value = values[0] if values else None
+
+    def __init__(self, name, usn, records=(), guid=None, deleted=False):
+        self.entry_dn = f'DC={name},{ZONE_DN}'
+        self._attrs = {'objectGUID': [(guid or name).encode()], 'uSNChanged': [usn]}
+        if not deleted:
+            self._attrs.update(name=[name], dnsRecord=[encode_record(*r) for r in records])
+
+    def __contains__(self, attr):
+        return attr in self._attrs
+
+    def __getattr__(self, attr):
+        if attr in self.__dict__.get('_attrs', {}):
+            return self._Attr(self._attrs[attr])
+        raise AttributeError(attr)
+
+
+class FakeDirectory:
+    """以 filter 區分三種查詢：完整讀取、uSNChanged 增量、tombstone"""
+
+    def __init__(self, monkeypatch):
+        import app.dns_index as module
+        self.conn = FakeConn()
+        self.nodes = []
+        self.tombstones = []
+        self.tombstone_result = 0
+        self.tombstone_error = None
+        self.calls = []
+        self.max_results = []
+        monkeypatch.setattr(module, 'get_ad_connection', lambda: self.conn)
+        monkeypatch.setattr(module.dc_locator, 'host_of', lambda conn: 'dc1')
+        monkeypatch.setattr(module, 'paged_search', self.paged_search)
+
+    def paged_search(self, conn, base, search_filter, attributes=None, max_results=None, controls=None):
+        self.calls.append((base, search_filter, controls))
+        self.max_results.append(max_results)
+        conn.result = {'result': 0}
+        if 'isDeleted' in search_filter:
+            if self.tombstone_error:
+                raise self.tombstone_error
+            conn.result = {'result': self.tombstone_result}
+            return iter(self.tombstones)
+        if 'uSNChanged>=' in search_filter:
+            low = int(search_filter.split('uSNChanged>=')[1].rstrip(')'))
+            return iter([n for n in self.nodes if n._attrs['uSNChanged'][0] >= low])
+        return iter(self.nodes)
+
+
+@pytest.fixture
+def dc(monkeypatch):
+    directory = FakeDirectory(monkeypatch)
+    directory.nodes = [FakeEntry('web', 10, [('A', '10.0.0.1')]), FakeEntry('db', 11, [('A', '10.0.0.2')])]
+    return directory
+
+
+def refresh(dc):
+    from app.dns_index import DnsIndex
+    dns = DnsIndex()
+    index = ZoneIndex(ZONE_DN)
+    dns._refresh_from_dc(index)
+    assert (index.mode, index.highest_usn) == ('full', 11)
+    dc.calls.clear()
+    return dns, index
+
+
+def test_incremental_refresh_pages_tombstones_with_show_deleted(dc):
+    from app.dir_sync import SHOW_DELETED_OID
+    dns, index = refresh(dc)
+    dc.nodes = [FakeEntry('web', 12, [('A', '10.0.0.9')])]
+    dc.tombstones = [FakeEntry('db', 13, guid='db', deleted=True)]
+    assert dns._refresh_from_dc(index) == 2
+    assert (index.mode, index.highest_usn) == ('usn', 13)
+    assert sorted(index.nodes) == ['web']
+    base, _, controls = dc.calls[-1]
+    assert base == 'DC=DomainDnsZones,DC=corp,DC=local'
+    assert controls == [(SHOW_DELETED_OID, True, None)]
+
+
+@pytest.mark.parametrize('failure', ['truncated', 'error'])
+def test_incomplete_tombstone_query_falls_back_to_full_refresh(dc, failure):
+    dns, index = refresh(dc)
+    dc.nodes = [FakeEntry('web', 12, [('A', '10.0.0.1')])]  # db 已刪除
+    if failure == 'truncated':
+        dc.tombstone_result = 4  # sizeLimitExceeded
+    else:
+        dc.tombstone_error = TypeError('controls not supported')
+    dns._refresh_from_dc(index)
+    assert index.mode == 'full'
+    assert sorted(index.nodes) == ['web']
+    assert index.highest_usn == 12
+    assert '(objectClass=dnsNode)' == dc.calls[-1][1]
+
+
+def test_refresh_reads_are_not_capped_by_max_results(dc):
+    # 水位會前進到讀到的最大 USN，任何一個查詢套用 LDAP_MAX_RESULTS 都會永久漏掉節點
+    dns, index = refresh(dc)
+    dc.nodes = [FakeEntry('web', 12, [('A', '10.0.0.9')])]
+    dns._refresh_from_dc(index)
+    assert index.mode == 'usn'
+    assert set(dc.max_results) == {0}
@@ -0,0 +1,76 @@
+# tests/test_fanout.py
+import sys
+import threading
+import time
+import pytest
+from flask import Flask, g, session
+from app.fanout import FanoutExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = FanoutExecutor(max_workers=2, timeout=5)
+    yield executor
+    executor.shutdown()
+
+
+def failing():
+    raise RuntimeError('DC 無回應')
+
+
+def test_failures_only_affect_their_own_block(executor, app_ctx):
+    results, errors, timings = executor.run({'users': lambda: 3, 'groups': failing})
+    assert results == {'users': 3}
+    assert errors == {'groups': 'DC 無回應'}
+    assert set(timings) == {'users'}
+
+
+def test_timeout_returns_partial_results(executor, app_ctx):
+    release = threading.Event()
+    results, errors, _ = executor.run({'fast': lambda: 'ok', 'slow': lambda: release.wait(5)}, timeout=0.1)
+    release.set()
+    assert results == {'fast': 'ok'}
+    assert errors == {'slow': '查詢逾時 (超過 0.1 秒)'}
+
+
+def test_workers_merge_ldap_totals_into_request(executor, app_ctx):
+    def query():
+        assert executor.in_worker()
+        g._ldap_totals['search'] = [1, 0.5, 10, 100]
+        return True
+
+    g._ldap_totals = {'search': [1, 0.25, 1, 10]}
+    results, _, _ = executor.run({'a': query, 'b': query})
+    assert results == {'a': True, 'b': True}
+    assert g._ldap_totals['search'] == [3, 1.25, 21, 210]
+    assert not executor.in_worker()
+
+
+def test_workers_see_request_session(executor):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    with app.test_request_context():
+        session['ad_user_account'] = 'alice'
+        results, errors, _ = executor.run({'who': lambda: session.get('ad_user_account')})
+    assert (results, errors) == ({'who': 'alice'}, {})
+
+
+def test_nested_zone_searches_do_not_wait_on_the_same_pool(monkeypatch, app_ctx):
+    # 只有一條工作執行緒：巢狀使用同一個池會卡到逾時，改為在工作執行緒上依序查詢
+    import app.ad_ops as ad_ops
+    single = FanoutExecutor(max_workers=1, timeout=2)
+    # app 套件的 fanout 屬性是執行器本身 (app/__init__.py 匯入時覆蓋)，要改模組上的單例
+    monkeypatch.setattr(sys.modules['app.fanout'], 'fanout', single)
+    monkeypatch.setattr(ad_ops, '_search_zone_container',
+                        lambda base, search_filter, attributes, size_limit=0: ([base], 'dc1'))
+    bases = [('DomainDnsZones', 'DC=DomainDnsZones'), ('System', 'CN=System')]
+    filters = {partition: '(objectClass=dnsZone)' for partition, _ in bases}
+
+    started = time.monotonic()
+    results, errors, _ = single.run({'zones': lambda: ad_ops._run_zone_searches(bases, filters, ['dc'])})
+    single.shutdown()
+    assert errors == {}
+    zone_results, zone_errors = results['zones']
+    assert zone_results == {'DomainDnsZones': (['DC=DomainDnsZones'], 'dc1'), 'System': (['CN=System'], 'dc1')}
+    assert zone_errors == {}
+    assert time.monotonic() - started < 1
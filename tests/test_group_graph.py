@@ -0,0 +1,166 @@
+# tests/test_group_graph.py
+import pytest
+from app.group_graph import GroupGraph
+
+BASE = 'DC=corp,DC=local'
+
+
+def dn(name):
+    return f'CN={name},CN=Users,{BASE}'
+
+
+def row(name, members=(), guid=None, usn=1):
+    return {'dn': dn(name), 'name': name, 'guid': guid or name.lower(), 'members': [dn(m) for m in members], 'usn': usn}
+
+
+def update(graph, *rows):
+    """和增量更新相同的順序：先失效、寫入、再失效一次"""
+    graph._invalidate_around([graph.guids.get(r['guid']) or r['dn'].lower() for r in rows])
+    for r in rows:
+        graph._put(r)
+    graph._invalidate_around([r['dn'].lower() for r in rows])
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    graph = GroupGraph()
+    monkeypatch.setattr(graph, 'ensure_fresh', lambda: None)
+    # Admins ∋ Ops ∋ Oncall ∋ alice；Admins ∋ bob；Oncall ∋ Ops (與 Ops 形成循環)
+    for r in (row('Admins', ['Ops', 'bob']), row('Ops', ['Oncall', 'carol']), row('Oncall', ['alice', 'Ops'])):
+        graph._put(r)
+    return graph
+
+
+def names(items):
+    return [(item['name'], item['depth']) for item in items]
+
+
+def test_effective_members_are_transitive_and_shortest(graph):
+    assert names(graph.effective_members('Admins')) == [
+        ('bob', 1), ('Ops', 1), ('carol', 2), ('Oncall', 2), ('alice', 3)]
+    users = graph.effective_members('admins', include_groups=False)
+    assert {item['name'] for item in users} == {'alice', 'bob', 'carol'}
+    alice = next(item for item in users if item['name'] == 'alice')
+    assert alice['via'] == 'Oncall' and not alice['is_group']
+    assert graph.effective_members('nope') is None
+
+
+def test_cycle_does_not_include_group_in_itself(graph):
+    members = {item['name'] for item in graph.effective_members('Ops')}
+    assert members == {'Oncall', 'carol', 'alice'}
+
+
+def test_groups_of_walks_parents(graph):
+    assert names(graph.groups_of(dn('alice'))) == [('Oncall', 1), ('Ops', 2), ('Admins', 3)]
+    assert names(graph.groups_of(dn('nobody'))) == []
+
+
+def test_explain_returns_shortest_path(graph):
+    path = graph.explain(dn('alice'), 'Admins')
+    assert [step['name'] for step in path] == ['Admins', 'Ops', 'Oncall', 'alice']
+    assert [step['is_group'] for step in path] == [True, True, True, False]
+    assert graph.explain(dn('alice'), 'nope') is None
+    assert graph.explain(dn('nobody'), 'Admins') is None
+
+
+def test_cycles(graph):
+    assert graph.cycles() == [['Oncall', 'Ops']]
+    update(graph, row('Solo', ['Solo']))
+    assert sorted(graph.cycles()) == [['Oncall', 'Ops'], ['Solo']]
+    update(graph, row('Oncall', ['alice']))
+    assert graph.cycles() == [['Solo']]
+
+
+def test_long_cycle_is_one_component():
+    graph = GroupGraph()
+    size = 2000  # 迭代版 Tarjan，不受遞迴深度限制
+    for i in range(size):
+        graph._put(row(f'G{i}', [f'G{(i + 1) % size}']))
+    cycles = graph._find_cycles()
+    assert len(cycles) == 1 and len(cycles[0]) == size
+
+
+def test_membership_change_invalidates_closures(graph):
+    assert 'dave' not in {item['name'] for item in graph.effective_members('Admins')}
+    assert names(graph.groups_of(dn('alice')))[-1] == ('Admins', 3)
+    update(graph, row('Oncall', ['alice', 'Ops', 'dave']))
+    assert ('dave', 3) in names(graph.effective_members('Admins'))
+    update(graph, row('Ops', ['carol']))
+    assert {item['name'] for item in graph.effective_members('Admins')} == {'bob', 'Ops', 'carol'}
+    assert names(graph.groups_of(dn('alice'))) == [('Oncall', 1)]
+
+
+def test_rename_keeps_edges(graph):
+    graph.effective_members('Admins')
+    renamed = dict(row('Operators', ['Oncall', 'carol']), guid='ops')
+    update(graph, renamed)
+    assert graph.resolve_group('ops') is None
+    assert graph.resolve_group('Operators') == dn('Operators').lower()
+    assert names(graph.effective_members('Admins'))[:2] == [('bob', 1), ('Operators', 1)]
+    assert [step['name'] for step in graph.explain(dn('alice'), 'Admins')] == ['Admins', 'Operators', 'Oncall', 'alice']
+
+
+def test_drop_removes_group_and_edges(graph):
+    graph._invalidate_around([dn('Ops').lower()])
+    graph._drop(dn('Ops').lower())
+    assert graph.resolve_group('Ops') is None
+    assert names(graph.effective_members('Admins')) == [('bob', 1)]
+    assert names(graph.groups_of(dn('alice'))) == [('Oncall', 1)]
+
+
+class FakeDirectory:
+    """以 filter 區分完整讀取、uSNChanged 增量與 tombstone 查詢；entry 直接用 row() 的 dict"""
+
+    def __init__(self, monkeypatch):
+        import app.group_graph as module
+        self.conn = type('Conn', (), {'result': {'result': 0}})()
+        self.groups = []
+        self.changed_result = 0
+        self.calls = []
+        monkeypatch.setattr(module, 'get_ad_connection', lambda: self.conn)
+        monkeypatch.setattr(module.dc_locator, 'host_of', lambda conn: 'dc1')
+        monkeypatch.setattr(module, '_get_domain_root', lambda: BASE)
+        monkeypatch.setattr(module, '_entry_row', lambda conn, entry: entry)
+        monkeypatch.setattr(module, 'paged_search', self.paged_search)
+
+    def paged_search(self, conn, base, search_filter, attributes=None, max_results=None, controls=None):
+        self.calls.append((search_filter, max_results))
+        conn.result = {'result': 0}
+        if 'isDeleted' in search_filter:
+            return iter([])
+        if 'uSNChanged>=' in search_filter:
+            conn.result = {'result': self.changed_result}
+            low = int(search_filter.split('uSNChanged>=')[1].rstrip(')'))
+            return iter([g for g in self.groups if g['usn'] >= low])
+        return iter(self.groups)
+
+
+@pytest.fixture
+def dc(monkeypatch):
+    directory = FakeDirectory(monkeypatch)
+    directory.groups = [row('Admins', ['alice'], usn=10), row('Ops', ['bob'], usn=11)]
+    return directory
+
+
+def test_incremental_load_is_not_capped_by_max_results(dc):
+    graph = GroupGraph()
+    graph._full_load()
+    assert graph.highest_usn == 11
+    dc.groups.append(row('Oncall', ['carol'], usn=12))
+    dc.calls.clear()
+    graph._incremental_load()
+    assert graph.highest_usn == 12
+    assert 'cn=oncall,cn=users,dc=corp,dc=local' in graph.groups
+    assert {max_results for _, max_results in dc.calls} == {0}
+
+
+def test_truncated_incremental_load_falls_back_to_full_load(dc):
+    graph = GroupGraph()
+    graph._full_load()
+    dc.groups.append(row('Oncall', ['carol'], usn=12))
+    dc.changed_result = 4  # sizeLimitExceeded
+    dc.calls.clear()
+    graph._incremental_load()
+    assert dc.calls[-1][0] == '(objectClass=group)'
+    assert graph.highest_usn == 12
+    assert len(graph.groups) == 3
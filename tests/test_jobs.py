@@ -0,0 +1,143 @@
+# tests/test_jobs.py
+import json
+import os
+import threading
+import time
+import pytest
+from flask import Flask
+import app.jobs as jobs
+from app.jobs import JobQueue, JOB_STATE_VERSION
+
+PASSWORD = 'S3cret-pw!'
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待逾時")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', JOB_WORKERS=3, JOB_PER_DC_LIMIT=1, JOB_STATE_DIR=str(tmp_path / 'jobs'))
+    return app
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    # 提交時的連線身分：以 server 欄位區分目標 DC (只有一台 DC 時以 AD_SERVER 為並行限制單位)
+    target = {'server': 'dc1'}
+    monkeypatch.setattr(jobs, '_get_bind_credentials', lambda: (target['server'], 'CN=alice,DC=corp,DC=local', PASSWORD))
+    monkeypatch.setattr(jobs, '_authz_controls', lambda: ())
+    queue = JobQueue()
+    queue.init_app(app)
+    queue.target = target
+    queue.gates = {}
+
+    def blocking(job, payload):
+        # 等測試放行；期間每 10ms 檢查一次取消旗標
+        gate = queue.gates.setdefault(payload['name'], threading.Event())
+        while not gate.wait(0.01):
+            if job.cancelled:
+                raise jobs.JobCancelled()
+        return {'name': payload['name']}
+
+    queue.register('blocking', blocking)
+    return queue
+
+
+def submit(queue, app, name, dc='dc1'):
+    queue.target['server'] = dc
+    with app.test_request_context():
+        return queue.submit('blocking', {'name': name, 'password': PASSWORD}, label=name)
+
+
+def release(queue, name):
+    queue.gates.setdefault(name, threading.Event()).set()
+
+
+def test_per_dc_limit_lets_other_dcs_run(queue, app):
+    first = submit(queue, app, 'a1', dc='dc1')
+    second = submit(queue, app, 'a2', dc='dc1')
+    other = submit(queue, app, 'b1', dc='dc2')
+    wait_until(lambda: first.state == 'running' and other.state == 'running')
+    assert second.state == 'queued'
+    assert queue.status()['running_per_dc'] == {'dc1': 1, 'dc2': 1}
+
+    release(queue, 'a1')
+    wait_until(lambda: second.state == 'running')
+    release(queue, 'a2')
+    release(queue, 'b1')
+    wait_until(lambda: all(job.state == 'succeeded' for job in (first, second, other)))
+    assert second.result == {'name': 'a2'}
+    assert second.started_at >= first.finished_at
+
+
+def test_cancel_queued_and_running_jobs(queue, app):
+    running = submit(queue, app, 'r', dc='dc1')
+    queued = submit(queue, app, 'q', dc='dc1')
+    wait_until(lambda: running.state == 'running')
+
+    assert queue.cancel(queued.id) == (True, "已送出取消要求")
+    assert queued.state == 'cancelled'
+    assert queue.cancel(running.id)[0]
+    wait_until(lambda: running.state == 'cancelled')
+    assert running.finished_at is not None
+    assert queue.cancel(running.id)[0] is False
+    assert queue.cancel('0' * 32) == (False, "工作不在這個行程執行，或已經結束")
+
+
+def test_state_file_never_contains_credentials(queue, app):
+    job = submit(queue, app, 'c')
+    wait_until(lambda: job.state == 'running')
+    path = queue._path(job.id)
+    with open(path) as f:
+        assert PASSWORD not in f.read()
+    release(queue, 'c')
+    wait_until(lambda: job.state == 'succeeded')
+    with open(path) as f:
+        data = f.read()
+    assert PASSWORD not in data
+    assert json.loads(data)['job']['state'] == 'succeeded'
+    # 結束後連記憶體中的帳密與輸入資料也一併丟掉
+    assert job._identity is None and job._payload is None
+
+
+def test_restart_marks_unfinished_jobs_interrupted(queue, app):
+    job = submit(queue, app, 'i')
+    wait_until(lambda: job.state == 'running')
+    # 模擬執行中的行程已經不在：狀態檔留在 running，pid 指向不存在的行程
+    with open(queue._path(job.id)) as f:
+        data = json.load(f)
+    data['job']['pid'] = 2 ** 22 + 1
+    with open(queue._path(job.id), 'w') as f:
+        json.dump(data, f)
+
+    restarted = JobQueue()
+    restarted.init_app(app)
+    recovered = restarted.get(job.id)
+    assert recovered.state == 'interrupted'
+    assert recovered.finished_at is not None
+    assert [j.id for j in restarted.list(owner=None)] == [job.id]
+    release(queue, 'i')
+
+
+def test_restart_keeps_jobs_of_live_processes_and_prunes_old_ones(app, tmp_path):
+    state_dir = app.config['JOB_STATE_DIR']
+    os.makedirs(state_dir)
+    base = {'kind': 'blocking', 'label': '', 'owner': 'alice', 'dc': 'dc1', 'created_at': time.time(),
+            'started_at': None, 'done': 0, 'total': 0, 'message': '', 'result': None, 'error': None}
+    live = dict(base, id='a' * 32, state='running', pid=os.getppid(), finished_at=None)
+    old = dict(base, id='b' * 32, state='succeeded', pid=1, finished_at=time.time() - 2 * 86400)
+    for job in (live, old):
+        with open(os.path.join(state_dir, f"{job['id']}.json"), 'w') as f:
+            json.dump({'version': JOB_STATE_VERSION, 'job': job}, f)
+
+    queue = JobQueue()
+    queue.init_app(app)
+    assert queue.get('a' * 32).state == 'running'
+    assert queue.get('b' * 32) is None
+    assert queue.get('../etc/passwd') is None
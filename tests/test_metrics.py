@@ -0,0 +1,38 @@
+# tests/test_metrics.py
+import pytest
+from flask import Flask
+from app.ldap_metrics import filter_fingerprint
+from app.routes_main import bp
+
+
+def _client(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    app.register_blueprint(bp)
+    return app.test_client()
+
+
+@pytest.mark.parametrize('config, remote, headers, status', [
+    ({}, '127.0.0.1', {}, 200),
+    ({}, '::1', {}, 200),
+    ({}, '10.0.0.5', {}, 403),
+    ({'METRICS_ALLOW_REMOTE': True}, '10.0.0.5', {}, 200),
+    ({'METRICS_TOKEN': 's3cret'}, '127.0.0.1', {}, 401),
+    ({'METRICS_TOKEN': 's3cret'}, '10.0.0.5', {'Authorization': 'Bearer wrong'}, 401),
+    ({'METRICS_TOKEN': 's3cret'}, '10.0.0.5', {'Authorization': 'Bearer s3cret'}, 200),
+])
+def test_metrics_access(config, remote, headers, status):
+    response = _client(**config).get('/metrics', headers=headers, environ_base={'REMOTE_ADDR': remote})
+    assert response.status_code == status
+
+
+def test_filter_fingerprint_hides_values():
+    fingerprint = filter_fingerprint('(&(objectClass=user)(|(sAMAccountName=alice)(mail=alice@corp.local)))')
+    assert 'alice' not in fingerprint
+    assert fingerprint.startswith('(&(objectClass=?)(|(sAMAccountName=?)(mail=?))) #')
+    assert filter_fingerprint('(uSNChanged>=100)').startswith('(uSNChanged>=?) #')
+    # 結構相同、值不同的 filter 雜湊不同
+    assert filter_fingerprint('(cn=a)') != filter_fingerprint('(cn=b)')
+    long_filter = '(|' + '(cn=x)' * 100 + ')'
+    assert len(filter_fingerprint(long_filter)) < 230
+    assert filter_fingerprint(None) is None
@@ -0,0 +1,37 @@
+# tests/test_paged_search.py
+import pytest
+from app.ad_ops import paged_search
+
+BASE = 'CN=Users,DC=corp,DC=local'
+
+
+@pytest.fixture
+def users(directory):
+    directory.add(BASE, objectClass=['top', 'container'], cn='Users')
+    for i in range(25):
+        directory.add(f'CN=u{i:02},{BASE}', objectClass=['top', 'person'], cn=f'u{i:02}')
+    return directory
+
+
+def test_reads_every_page(users, app_ctx):
+    names = [e.entry_dn for e in paged_search(users.conn, BASE, '(objectClass=person)', attributes=['cn'], page_size=10)]
+    assert len(names) == 25
+
+
+def test_max_results_stops_early(users, app_ctx):
+    found = list(paged_search(users.conn, BASE, '(objectClass=person)', attributes=['cn'], page_size=10, max_results=12))
+    assert len(found) == 12
+
+
+def test_controls_are_sent_on_every_page(users, app_ctx, monkeypatch):
+    sent = []
+    search = users.conn.search
+
+    def spy(*args, **kwargs):
+        sent.append(list(kwargs.get('controls') or []))
+        return search(*args, **kwargs)
+
+    monkeypatch.setattr(users.conn, 'search', spy)
+    assert len(list(paged_search(users.conn, BASE, '(objectClass=person)', attributes=['cn'], page_size=10,
+                                 controls=[]))) == 25
+    assert sent == [[], [], []]
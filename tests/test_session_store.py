@@ -0,0 +1,182 @@
+# tests/test_session_store.py
+import pytest
+from flask import Flask, session
+from app.session_store import MemorySessionStore, MemoryRedis, RedisSessionStore, SessionTooLargeError, init_session
+
+
+def _app(**config):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', SESSION_LIFETIME=60, **config)
+    init_session(app)
+
+    @app.route('/set/<value>')
+    def set_value(value):
+        session['value'] = value
+        return 'ok'
+
+    @app.route('/get')
+    def get_value():
+        return session.get('value', '')
+
+    return app
+
+
+@pytest.mark.parametrize('config', [
+    {'SESSION_BACKEND': 'memory'},
+    {'SESSION_BACKEND': 'redis', 'SESSION_REDIS_URL': 'memory://'},
+], ids=['memory', 'redis'])
+def test_session_round_trip(config):
+    app = _app(**config)
+    client = app.test_client()
+    client.get('/set/hello')
+    assert client.get('/get').get_data(as_text=True) == 'hello'
+    # 不同 client (沒有 cookie) 看不到別人的 Session
+    assert app.test_client().get('/get').get_data(as_text=True) == ''
+
+
+def test_backend_selection():
+    assert isinstance(_app(SESSION_BACKEND='memory').config['SESSION_CACHELIB'], MemorySessionStore)
+    store = _app(SESSION_BACKEND='redis', SESSION_REDIS_URL='memory://').config['SESSION_CACHELIB']
+    assert isinstance(store, RedisSessionStore)
+    assert isinstance(store.client, MemoryRedis)
+    with pytest.raises(RuntimeError):
+        _app(SESSION_BACKEND='nope')
+
+
+def test_memory_store_serializes_payload():
+    store = MemorySessionStore()
+    value = {'user': 'alice', 'roles': ['admin']}
+    store.set('s1', value)
+    loaded = store.get('s1')
+    assert loaded == value
+    assert loaded is not value
+    assert isinstance(store._cache.get('s1'), bytes)
+
+
+@pytest.mark.parametrize('make_store', [
+    lambda max_bytes: MemorySessionStore(max_bytes=max_bytes),
+    lambda max_bytes: RedisSessionStore(MemoryRedis(), max_bytes=max_bytes),
+], ids=['memory', 'redis'])
+def test_store_rejects_oversized_payload(make_store):
+    store = make_store(64)
+    assert store.set('small', {'a': 1})
+    with pytest.raises(SessionTooLargeError):
+        store.set('big', {'a': 'x' * 100})
+    with pytest.raises(SessionTooLargeError):
+        store.set('small', {'a': 'x' * 100})
+    assert store.get('big') is None
+    assert store.get('small') == {'a': 1}
+    # 0 = 不限制
+    assert make_store(0).set('big', {'a': 'x' * 100000})
+
+
+@pytest.mark.parametrize('config', [
+    {'SESSION_BACKEND': 'memory'},
+    {'SESSION_BACKEND': 'redis', 'SESSION_REDIS_URL': 'memory://'},
+], ids=['memory', 'redis'])
+def test_oversized_session_fails_the_request(config, caplog):
+    app = _app(SESSION_MAX_BYTES=64, **config)
+    client = app.test_client()
+    client.get('/set/hello')
+    response = client.get('/set/' + 'x' * 100)
+    assert response.status_code == 500
+    assert '超過上限' in caplog.text
+    # 先前的 Session 維持原狀，不會被截斷或清空
+    assert client.get('/get').get_data(as_text=True) == 'hello'
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_entries=2)
+    store.set('a', {'n': 1})
+    store.set('b', {'n': 2})
+    store.get('a')
+    store.set('c', {'n': 3})
+    assert store.has('a') and store.has('c')
+    assert not store.has('b')
+    assert len(store) == 2
+
+
+def test_memory_store_expiry_and_sweep(clock):
+    store = MemorySessionStore(default_timeout=100, sweep_interval=10)
+    store.set('short', {'n': 1}, timeout=5)
+    store.set('long', {'n': 2})
+    clock.advance(6)
+    assert store.get('short') is None
+    assert store.get('long') == {'n': 2}
+
+    store.set('stale', {'n': 3}, timeout=1)
+    clock.advance(2)
+    assert len(store) == 2  # 沒有讀到就不會清
+    clock.advance(10)
+    store.set('fresh', {'n': 4})  # 寫入時超過 sweep_interval，順便清掉過期項目
+    assert len(store) == 2
+    assert not store.has('stale')
+
+
+def test_memory_store_add_and_delete():
+    store = MemorySessionStore()
+    assert store.add('k', {'n': 1})
+    assert not store.add('k', {'n': 2})
+    assert store.get('k') == {'n': 1}
+    assert store.delete('k')
+    assert not store.delete('k')
+    store.set('k', {'n': 1})
+    assert store.clear() and len(store) == 0
+
+
+def test_redis_store_uses_prefix_and_expiry(clock):
+    client = MemoryRedis()
+    client.set('other', b'keep')
+    store = RedisSessionStore(client, default_timeout=100)
+    value = {'user': 'alice'}
+    store.set('s1', value, timeout=10)
+    assert isinstance(client.get('ad-manager:s1'), bytes)
+    assert store.get('s1') == value
+    assert not store.add('s1', {'user': 'bob'})
+    clock.advance(11)
+    assert store.get('s1') is None
+    store.set('s2', value)
+    assert store.clear()
+    assert not store.has('s2')
+    assert client.get('other') == b'keep'  # clear() 只刪自己的 key
+    assert not store.delete('s2')
+
+
+def test_memory_redis_commands(clock):
+    client = MemoryRedis()
+    assert client.ping()
+    assert client.set('k', 'v')
+    assert client.get('k') == b'v'
+    assert client.set('k', 'other', nx=True) is None
+    assert client.set('missing', 'v', xx=True) is None
+    assert client.exists('k', 'missing') == 1
+    assert client.delete('k', 'missing') == 1
+    assert client.get('k') is None
+
+    client.set('ex', b'1', ex=10)
+    client.set('px', b'1', px=500)
+    clock.advance(1)
+    assert client.get('px') is None
+    assert client.get('ex') == b'1'
+    clock.advance(10)
+    assert client.get('ex') is None
+
+
+def test_memory_redis_sweep(clock):
+    client = MemoryRedis(sweep_interval=10)
+    client.set('a', b'1', ex=1)
+    client.set('b', b'1', ex=1)
+    clock.advance(11)
+    assert client.dbsize() == 2
+    client.set('c', b'1')
+    assert client.dbsize() == 1
+    assert client.flushdb() and client.dbsize() == 0
+
+
+def test_redis_session_expires_with_lifetime(clock):
+    app = _app(SESSION_BACKEND='redis', SESSION_REDIS_URL='memory://')
+    client = app.test_client()
+    client.get('/set/hello')
+    assert app.config['SESSION_CACHELIB'].client.dbsize() == 1
+    clock.advance(61)
+    assert client.get('/get').get_data(as_text=True) == ''
@@ -0,0 +1,20 @@
+# tests/test_uac.py
+from app.uac import UF_ACCOUNTDISABLE, decode_uac, is_enabled, uac_filter
+
+
+def test_decode_uac():
+    assert decode_uac(512) == ('NORMAL_ACCOUNT',)
+    assert decode_uac(514) == ('ACCOUNTDISABLE', 'NORMAL_ACCOUNT')
+    assert decode_uac(66048) == ('NORMAL_ACCOUNT', 'DONT_EXPIRE_PASSWORD')
+    assert decode_uac(0) == ()
+
+
+def test_is_enabled():
+    assert is_enabled(512) is True
+    assert is_enabled('514') is False
+    assert is_enabled(None) is None
+
+
+def test_uac_filter():
+    assert uac_filter(UF_ACCOUNTDISABLE) == '(userAccountControl:1.2.840.113556.1.4.803:=2)'
+    assert uac_filter(UF_ACCOUNTDISABLE, present=False) == '(!(userAccountControl:1.2.840.113556.1.4.803:=2))'